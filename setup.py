@@ -68,11 +68,22 @@ setup(
                         'tqdm',
                         'matplotlib'],  
 
+    # Optional dependencies, installed with e.g. `pip install sbelt[numba]`.
+    # The numba engine falls back to the lattice engine without Numba.
+    extras_require={
+        'numba': ['numba'],
+    },
+
     # For example, the following would provide a command called `sample` which
     # executes the function `main` from this package when invoked:
     entry_points={  
         'console_scripts': [
             'sbelt-run=sbelt.sbelt_runner:run',
+            'sbelt-ensemble=sbelt.ensemble:main',
+            'sbelt-sweep=sbelt.sweep:main',
+            'sbelt-io-benchmark=sbelt.io_benchmark:main',
+            'sbelt-benchmark=sbelt.benchmark:main',
+            'sbelt-scaling=sbelt.scaling:main',
         ],
     },
 )
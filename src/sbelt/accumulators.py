@@ -0,0 +1,532 @@
+"""
+This module contains streaming statistics of a run. Each statistic is
+updated every iteration from the event particles alone (their position
+and age before the iteration and the particle arrays after it), so the
+cost of an update is O(event particles) rather than O(particles) and
+statistics are exact no matter how rarely snapshots are saved.
+
+The statistics are written to final_metrics/statistics/{name} when the
+run finishes and are saved in checkpoints, so resumed and extended runs
+produce the same statistics as uninterrupted ones.
+
+Available statistics (see STATISTICS):
+    age: The distribution of particle ages over all iterations, i.e
+        the distribution of the ages averaged by avg_age.
+    residence: Residence times, the number of iterations each event
+        particle rested before being entrained.
+    hops: The distance travelled by event particles which stayed in
+        the stream, and the number of particles leaving and re-entering.
+    subregion_counts: Time averaged number of particles in each subregion.
+    elevation: Time averaged elevation of the bed surface along the stream.
+
+Other statistics can be added with register. A statistic is a class
+taking (parameters, model_particles, subregions, h) with the update,
+write, get_state and set_state methods of Statistic.
+
+Attributes:
+    AGE_BINS: Number of (geometric) bins of age and residence histograms.
+    RESERVOIR_SIZE: Number of values sampled by each reservoir.
+    STATISTICS: The available statistics, by name.
+"""
+import abc
+import json
+
+import numpy as np
+
+AGE_BINS = 64
+RESERVOIR_SIZE = 1000
+
+
+def age_edges(iterations, num_bins=AGE_BINS):
+    """ Returns integer, roughly geometric, histogram bin edges covering ages 0 to iterations. """
+    edges = np.unique(np.round(np.geomspace(1, iterations + 1, num_bins)).astype(np.int64))
+    return np.concatenate(([0], edges))
+
+
+class Histogram():
+    """ A histogram with fixed bins. Values outside the bins are counted in the
+    first or last bin.
+
+    Attributes:
+        edges: A NumPy array of the bin edges.
+        counts: A NumPy array of the count of each bin.
+    """
+    def __init__(self, edges):
+        self.edges = np.asarray(edges)
+        self.counts = np.zeros(len(self.edges) - 1, dtype=np.int64)
+
+    def add(self, values):
+        """Count values"""
+        clipped = np.clip(values, self.edges[0], self.edges[-1])
+        self.counts += np.histogram(clipped, self.edges)[0]
+
+    def get_state(self):
+        return {'edges': self.edges, 'counts': self.counts}
+
+    def set_state(self, state):
+        self.edges = np.array(state['edges'])
+        self.counts = np.array(state['counts'])
+
+
+class RunningMoments():
+    """ Count, mean, variance, minimum and maximum of a stream of values,
+    merged a batch at a time (Chan et al.).
+
+    Attributes:
+        count: The number of values seen (int).
+        mean: The mean of the values seen (float).
+        m2: The sum of squared differences from the mean (float).
+        minimum: The smallest value seen (float).
+        maximum: The largest value seen (float).
+    """
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = np.inf
+        self.maximum = -np.inf
+
+    @property
+    def variance(self):
+        """The population variance of the values seen"""
+        return self.m2 / self.count if self.count else np.nan
+
+    def add(self, values):
+        """Add a batch of values"""
+        values = np.asarray(values, dtype=float)
+        if values.size == 0:
+            return
+        count = self.count + values.size
+        batch_mean = values.mean()
+        delta = batch_mean - self.mean
+        self.m2 += np.sum(np.square(values - batch_mean)) + delta**2 * self.count * values.size / count
+        self.mean += delta * values.size / count
+        self.count = count
+        self.minimum = min(self.minimum, values.min())
+        self.maximum = max(self.maximum, values.max())
+
+    def write(self, grp):
+        """Write the moments to datasets of an h5py Group"""
+        grp['count'] = self.count
+        grp['mean'] = self.mean if self.count else np.nan
+        grp['std'] = np.sqrt(self.variance)
+        grp['min'] = self.minimum
+        grp['max'] = self.maximum
+
+    def get_state(self):
+        return {'moments': np.array([self.count, self.mean, self.m2, self.minimum, self.maximum])}
+
+    def set_state(self, state):
+        count, self.mean, self.m2, self.minimum, self.maximum = state['moments']
+        self.count = int(count)
+
+
+class Reservoir():
+    """ A uniform random sample of fixed size from a stream of values
+    (reservoir sampling, algorithm R). Samples are drawn from a generator
+    of the reservoir's own so that sampling does not change the run.
+
+    Attributes:
+        size: The size of the sample (int).
+        samples: A NumPy array of the sampled values.
+        seen: The number of values seen (int).
+    """
+    def __init__(self, size=RESERVOIR_SIZE, seed=None):
+        self.size = size
+        self.samples = np.empty(0)
+        self.seen = 0
+        self._rng = np.random.default_rng(seed)
+
+    def add(self, values):
+        """Add a batch of values"""
+        values = np.asarray(values, dtype=float)
+        free = max(0, min(self.size - len(self.samples), len(values)))
+        self.samples = np.concatenate((self.samples, values[:free]))
+        self.seen += free
+        for value in values[free:]:
+            self.seen += 1
+            slot = self._rng.integers(self.seen)
+            if slot < self.size:
+                self.samples[slot] = value
+
+    def get_state(self):
+        return {'samples': self.samples, 'seen': self.seen,
+                'rng': json.dumps(self._rng.bit_generator.state)}
+
+    def set_state(self, state):
+        self.samples = np.array(state['samples'])
+        self.seen = int(state['seen'])
+        self._rng.bit_generator.state = json.loads(state['rng'])
+
+
+class TimeAverage():
+    """ Time averages of an array of values which change at some iterations.
+
+    A value set at iteration t holds for iterations t until it is next
+    set, so each update costs O(values set).
+
+    Attributes:
+        values: A NumPy array of the current values.
+        total: A NumPy array of the sum of each value over past iterations.
+        total_sq: A NumPy array of the sum of each squared value over past iterations.
+        since: A NumPy array of the iteration each value was last set.
+        minimum: A NumPy array of the smallest value each has held.
+        maximum: A NumPy array of the largest value each has held.
+    """
+    def __init__(self, values, iteration=0):
+        self.values = np.array(values, dtype=float)
+        self.total = np.zeros_like(self.values)
+        self.total_sq = np.zeros_like(self.values)
+        self.since = np.full(self.values.shape, iteration, dtype=np.int64)
+        self.minimum = self.values.copy()
+        self.maximum = self.values.copy()
+
+    def set(self, iteration, indices, values):
+        """ Set the values at indices from an iteration onwards """
+        held = iteration - self.since[indices]
+        self.total[indices] += self.values[indices] * held
+        self.total_sq[indices] += np.square(self.values[indices]) * held
+        self.since[indices] = iteration
+        self.values[indices] = values
+        self.minimum[indices] = np.minimum(self.minimum[indices], values)
+        self.maximum[indices] = np.maximum(self.maximum[indices], values)
+
+    def write(self, grp, start, stop):
+        """Write the mean, std, min and max over iterations start to stop-1 to an h5py Group"""
+        held = stop - self.since
+        duration = max(stop - start, 1)
+        mean = (self.total + self.values * held) / duration
+        mean_sq = (self.total_sq + np.square(self.values) * held) / duration
+        grp['mean'] = mean
+        grp['std'] = np.sqrt(np.maximum(mean_sq - np.square(mean), 0))
+        grp['min'] = self.minimum
+        grp['max'] = self.maximum
+
+    def get_state(self):
+        return {'values': self.values, 'total': self.total, 'total_sq': self.total_sq,
+                'since': self.since, 'minimum': self.minimum, 'maximum': self.maximum}
+
+    def set_state(self, state):
+        for key, value in state.items():
+            setattr(self, key, np.array(value))
+
+
+def _seed(parameters, stream):
+    """Seed of a statistic's own generator, derived from the run's seed"""
+    return None if parameters['seed'] is None else [parameters['seed'], stream]
+
+
+class Statistic(abc.ABC):
+    """ Base class of the streaming statistics. Subclasses must implement
+    update and write, or fail when they are created at the start of a run.
+
+    Args:
+        parameters: The run's parameters (see sbelt_runner.run).
+        model_particles: The n-7 NumPy array of model particles at the start of the run.
+        subregions: The run's SubregionTable.
+        h: Geometric value used in calculations of particle placement.
+    """
+    def __init__(self, parameters, model_particles, subregions, h):
+        self.parts = {}
+
+    @abc.abstractmethod
+    def update(self, iteration, event_ids, before, model_particles):
+        """ Update the statistic after an iteration.
+
+        Args:
+            iteration: The iteration (int).
+            event_ids: A NumPy array of the uids of the iteration's event particles.
+            before: A k-3 NumPy array of the x, y and age of each event particle
+                before the iteration.
+            model_particles: The n-7 NumPy array of model particles after the iteration.
+                With the numba engine only the x and y of the event particles are
+                those after the iteration, see numba_engine.replay_events.
+        """
+
+    @abc.abstractmethod
+    def write(self, grp, iterations, model_particles):
+        """ Write the statistic to an h5py Group. Writing does not change the statistic.
+
+        Args:
+            grp: The h5py Group to write to.
+            iterations: The number of iterations run (int).
+            model_particles: The n-7 NumPy array of model particles after the last iteration.
+        """
+
+    def get_state(self):
+        """Returns the state of the statistic as a flat dictionary of arrays and strings"""
+        return {f'{name}.{key}': value for name, part in self.parts.items()
+                    for key, value in part.get_state().items()}
+
+    def set_state(self, state):
+        """Restore a state returned by get_state"""
+        for name, part in self.parts.items():
+            part.set_state({key.split('.')[1]: value for key, value in state.items()
+                                if key.split('.')[0] == name})
+
+
+def _range_sums(first, last, power):
+    """Sum of i**power for i in first..last (inclusive), 0 for empty ranges"""
+    def partial(m):
+        m = m.astype(float)
+        return m * (m + 1) / 2 if power == 1 else m * (m + 1) * (2 * m + 1) / 6
+    return np.where(last >= first, partial(last) - partial(first - 1), 0.0)
+
+
+class AgeDistribution(Statistic):
+    """ The distribution of particle ages over all iterations.
+
+    Every particle contributes its age after each iteration, so the mean
+    of the distribution is the mean of avg_age. A particle resting from
+    age a to age b contributes ages a..b, which are counted when the
+    particle is entrained (or when the statistic is written).
+    """
+    def __init__(self, parameters, model_particles, subregions, h):
+        self.histogram = Histogram(age_edges(parameters['iterations']))
+        self.parts = {'histogram': self.histogram}
+        # The first age each particle is recorded with in its current rest
+        self.rest_from = model_particles[:,5].astype(np.int64) + 1
+        self.sums = np.zeros(3)
+
+    def _add_rests(self, first, last):
+        lower, upper = self.histogram.edges[:-1], self.histogram.edges[1:].copy()
+        upper[-1] = np.iinfo(np.int64).max
+        overlap = (np.minimum(last[:,None] + 1, upper) - np.maximum(first[:,None], lower))
+        self.histogram.counts += np.clip(overlap, 0, None).sum(axis=0)
+        self.sums += [np.clip(last - first + 1, 0, None).sum(), _range_sums(first, last, 1).sum(),
+                        _range_sums(first, last, 2).sum()]
+
+    def update(self, iteration, event_ids, before, model_particles):
+        self._add_rests(self.rest_from[event_ids], before[:,2].astype(np.int64))
+        self.rest_from[event_ids] = 0
+
+    def write(self, grp, iterations, model_particles):
+        counts, sums = self.histogram.counts.copy(), self.sums.copy()
+        self._add_rests(self.rest_from, model_particles[:,5].astype(np.int64))
+        grp['edges'] = self.histogram.edges
+        grp['counts'] = self.histogram.counts
+        count, total, total_sq = self.sums
+        grp['count'] = int(count)
+        grp['mean'] = total / count
+        grp['std'] = np.sqrt(max(total_sq / count - (total / count)**2, 0))
+        self.histogram.counts, self.sums = counts, sums
+
+    def get_state(self):
+        return dict(super().get_state(), rest_from=self.rest_from, sums=self.sums)
+
+    def set_state(self, state):
+        super().set_state({key: value for key, value in state.items() if '.' in key})
+        self.rest_from = np.array(state['rest_from'])
+        self.sums = np.array(state['sums'])
+
+
+class ResidenceTimes(Statistic):
+    """ The number of iterations each event particle rested before being entrained. """
+    def __init__(self, parameters, model_particles, subregions, h):
+        self.histogram = Histogram(age_edges(parameters['iterations']))
+        self.moments = RunningMoments()
+        self.reservoir = Reservoir(seed=_seed(parameters, 1))
+        self.parts = {'histogram': self.histogram, 'moments': self.moments,
+                        'reservoir': self.reservoir}
+
+    def update(self, iteration, event_ids, before, model_particles):
+        for part in self.parts.values():
+            part.add(before[:,2])
+
+    def write(self, grp, iterations, model_particles):
+        grp['edges'] = self.histogram.edges
+        grp['counts'] = self.histogram.counts
+        self.moments.write(grp)
+        grp['samples'] = self.reservoir.samples
+
+
+class HopLengths(Statistic):
+    """ The distance travelled by event particles which stayed in the stream.
+
+    Particles leaving the stream are counted as exits and ghost particles
+    put back in the stream as entries.
+    """
+    def __init__(self, parameters, model_particles, subregions, h):
+        step = parameters['particle_diam'] / 2
+        num_steps = int(round(parameters['bed_length'] / step))
+        self.histogram = Histogram((np.arange(num_steps + 2) - 0.5) * step)
+        self.moments = RunningMoments()
+        self.reservoir = Reservoir(seed=_seed(parameters, 2))
+        self.parts = {'histogram': self.histogram, 'moments': self.moments,
+                        'reservoir': self.reservoir}
+        self.crossings = np.zeros(2, dtype=np.int64)
+
+    def update(self, iteration, event_ids, before, model_particles):
+        after = model_particles[event_ids, 0]
+        in_stream = (before[:,0] != -1) & (after != -1)
+        hops = after[in_stream] - before[in_stream, 0]
+        for part in self.parts.values():
+            part.add(hops)
+        self.crossings += [np.sum((before[:,0] != -1) & (after == -1)),
+                            np.sum((before[:,0] == -1) & (after != -1))]
+
+    def write(self, grp, iterations, model_particles):
+        grp['edges'] = self.histogram.edges
+        grp['counts'] = self.histogram.counts
+        self.moments.write(grp)
+        grp['samples'] = self.reservoir.samples
+        grp['exits'], grp['entries'] = self.crossings
+
+    def get_state(self):
+        return dict(super().get_state(), crossings=self.crossings)
+
+    def set_state(self, state):
+        super().set_state({key: value for key, value in state.items() if '.' in key})
+        self.crossings = np.array(state['crossings'])
+
+
+class SubregionCounts(Statistic):
+    """ Time averaged number of particles in each subregion. """
+    def __init__(self, parameters, model_particles, subregions, h):
+        self.left_boundaries = np.asarray(subregions.left_boundaries, dtype=float)
+        counts = np.bincount(self._subregion(model_particles[:,0]),
+                                minlength=len(self.left_boundaries) + 1)[1:]
+        self.counts = TimeAverage(counts)
+        self.parts = {'counts': self.counts}
+
+    def _subregion(self, x):
+        """Index (1-based, 0 for ghost particles) of the subregion of each x"""
+        return np.where(x == -1, 0, np.searchsorted(self.left_boundaries, x, side='right'))
+
+    def update(self, iteration, event_ids, before, model_particles):
+        change = np.zeros(len(self.left_boundaries) + 1)
+        np.subtract.at(change, self._subregion(before[:,0]), 1)
+        np.add.at(change, self._subregion(model_particles[event_ids, 0]), 1)
+        changed = np.flatnonzero(change[1:])
+        self.counts.set(iteration, changed, self.counts.values[changed] + change[1:][changed])
+
+    def write(self, grp, iterations, model_particles):
+        grp['left_boundaries'] = self.left_boundaries
+        self.counts.write(grp, 0, iterations)
+
+
+class ElevationProfile(Statistic):
+    """ Time averaged elevation of the bed surface at each vertex along the
+    stream: the elevation of the highest model particle at the vertex,
+    or 0 (the bed) if there is none. """
+    def __init__(self, parameters, model_particles, subregions, h):
+        self.step = parameters['particle_diam'] / 2
+        self.h = h
+        num_columns = int(round(parameters['bed_length'] / self.step)) + 1
+        # Elevation of the particle at each column and level, NaN if empty
+        self.occupied = np.full((num_columns, parameters['level_limit'] + 2), np.nan)
+        in_stream = model_particles[:,0] != -1
+        columns, levels = self._cells(model_particles[in_stream][:,[0,2]])
+        self.occupied[columns, levels] = model_particles[in_stream, 2]
+        self.elevation = TimeAverage(self._surface(np.arange(num_columns)))
+        self.parts = {'elevation': self.elevation}
+
+    def _cells(self, positions):
+        columns = np.rint(positions[:,0] / self.step).astype(int)
+        levels = np.rint(positions[:,1] / self.h).astype(int)
+        return columns, levels
+
+    def _surface(self, columns):
+        return np.nan_to_num(np.nanmax(np.concatenate((np.zeros((len(columns), 1)),
+                                                        self.occupied[columns]), axis=1), axis=1))
+
+    def update(self, iteration, event_ids, before, model_particles):
+        before = before[before[:,0] != -1]
+        after = model_particles[event_ids][:,[0,2]]
+        after = after[after[:,0] != -1]
+        old_columns, old_levels = self._cells(before[:,[0,1]])
+        new_columns, new_levels = self._cells(after)
+        self.occupied[old_columns, old_levels] = np.nan
+        self.occupied[new_columns, new_levels] = after[:,1]
+        columns = np.unique(np.concatenate((old_columns, new_columns)))
+        self.elevation.set(iteration, columns, self._surface(columns))
+
+    def write(self, grp, iterations, model_particles):
+        grp['x'] = np.arange(self.occupied.shape[0]) * self.step
+        self.elevation.write(grp, 0, iterations)
+
+    def get_state(self):
+        return dict(super().get_state(), occupied=self.occupied)
+
+    def set_state(self, state):
+        super().set_state({key: value for key, value in state.items() if '.' in key})
+        self.occupied = np.array(state['occupied'])
+
+
+STATISTICS = {'age': AgeDistribution,
+              'residence': ResidenceTimes,
+              'hops': HopLengths,
+              'subregion_counts': SubregionCounts,
+              'elevation': ElevationProfile}
+
+
+def register(name, statistic):
+    """Make a Statistic subclass available to runs under name"""
+    STATISTICS[name] = statistic
+
+
+def parse_names(names):
+    """ Returns the Python list of statistic names in a comma separated string.
+
+    Raises:
+        ValueError: if a name is not in STATISTICS.
+    """
+    names = [name.strip() for name in names.split(',') if name.strip()]
+    unknown = [name for name in names if name not in STATISTICS]
+    if unknown:
+        raise ValueError(f'Unknown statistics {unknown}, statistics must be in {list(STATISTICS)}.')
+    return names
+
+
+class StatisticsSet():
+    """ The streaming statistics of a run.
+
+    Attributes:
+        statistics: A dictionary of the run's Statistic instances, by name.
+    """
+    def __init__(self, names, parameters, model_particles, subregions, h):
+        self.statistics = {name: STATISTICS[name](parameters, model_particles, subregions, h)
+                            for name in parse_names(names)}
+
+    def __bool__(self):
+        return bool(self.statistics)
+
+    def capture(self, model_particles, event_ids, ghosts=None):
+        """ Returns the k-3 array of x, y and age of event particles to pass to update.
+
+        Args:
+            model_particles: The n-7 NumPy array of model particles before the iteration.
+            event_ids: A NumPy array of the uids of the iteration's event particles.
+            ghosts: Optional NumPy array of the uids of the particles which were
+                out of the stream before the event particles were selected.
+        """
+        before = model_particles[event_ids][:,[0,2,5]]
+        if ghosts is not None:
+            before[np.isin(event_ids, ghosts), 0] = -1
+        return before
+
+    def update(self, iteration, event_ids, before, model_particles):
+        """Update every statistic after an iteration (see Statistic.update)"""
+        event_ids = np.asarray(event_ids, dtype=int)
+        for statistic in self.statistics.values():
+            statistic.update(iteration, event_ids, before, model_particles)
+
+    def write(self, grp, iterations, model_particles):
+        """ Write every statistic to a subgroup of an h5py Group.
+
+        Args:
+            grp: The h5py Group to write to.
+            iterations: The number of iterations run (int).
+            model_particles: The n-7 NumPy array of model particles after the last iteration.
+        """
+        for name, statistic in self.statistics.items():
+            statistic.write(grp.create_group(name), iterations, model_particles)
+
+    def get_state(self):
+        """Returns the state of every statistic, by name"""
+        return {name: statistic.get_state() for name, statistic in self.statistics.items()}
+
+    def set_state(self, states):
+        """Restore states returned by get_state"""
+        for name, statistic in self.statistics.items():
+            statistic.set_state(states[name])
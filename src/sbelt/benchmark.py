@@ -0,0 +1,378 @@
+"""
+This module is a benchmark suite of the hot paths of the logic module
+(the reference engine). Each benchmark times one function, or a full
+iteration of the reference engine, on a stream built with a fixed seed,
+for every case of a grid of bed_length, particle_pack_dens,
+num_subregions and poiss_lambda values. Inputs are prepared (and copied)
+outside of the timed region, so every call does the same work.
+
+Benchmarks prefixed with lattice_ time the incremental indexes of the
+lattice engine doing the same work as the logic function they are
+named after, after the same entrainment event, so the two can be compared.
+
+Results are written as JSON together with the machine and library
+versions they were measured with, and can be compared with a baseline
+to catch performance regressions between releases.
+
+Examples:
+    From Python::
+
+        results = benchmark.run_benchmarks(grid={'bed_length': [40, 80]})
+
+    or from the command line::
+
+        $ sbelt-benchmark --bed-length 40 80 160 --json benchmark.json
+        $ sbelt-benchmark --json new.json --compare benchmark.json
+
+Attributes:
+    BENCHMARKS: The names of the benchmarks, in the order they are run.
+    GRID: The values of each parameter benchmarked by default.
+    BASE_PARAMETERS: Parameters of the benchmarked streams left out of the grid.
+    SEED: The default seed of the benchmarked streams.
+    MIN_TIME: Calls are repeated until a measurement takes at least this
+        long (seconds), up to MAX_NUMBER calls.
+    MAX_NUMBER: The largest number of calls per measurement.
+    THRESHOLD: Default slowdown (current / baseline median) reported as a regression.
+"""
+import argparse
+import datetime
+import itertools
+import json
+import platform
+import time
+
+import numpy as np
+
+from sbelt import lattice
+from sbelt import logic
+from sbelt import sbelt_runner
+from sbelt import streams
+
+BENCHMARKS = ['build_streambed', 'set_model_particles', 'compute_available_vertices',
+              'get_event_particles', 'move_model_particles', 'update_flux',
+              'update_particle_states', 'lattice_get_event_particles',
+              'lattice_update_particle_states', 'iteration']
+GRID = {'bed_length': [40, 80, 160],
+        'particle_pack_dens': [0.5, 0.78],
+        'num_subregions': [2, 4],
+        'poiss_lambda': [2, 5]}
+BASE_PARAMETERS = {'particle_diam': 0.5, 'level_limit': 3, 'iterations': 1, 'gauss_mu': 1,
+                   'gauss_sigma': 0.25, 'gauss': False, 'height_dependant_entr': False}
+SEED = 0
+MIN_TIME = 0.01
+MAX_NUMBER = 100
+THRESHOLD = 1.25
+
+
+def grid_cases(grid=None):
+    """ Returns a Python list with a parameter dictionary per case of a grid.
+
+    Args:
+        grid: A dictionary of the values of each parameter. Parameters left
+            out take their GRID values.
+    """
+    grid = dict(GRID, **(grid or {}))
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+
+
+def build_case(case, seed=SEED):
+    """ Build the stream of a case and the inputs of each benchmarked function.
+
+    One iteration of the reference engine is run (untimed) to get the
+    event particles, hops and moves that the benchmarks start from.
+
+    Args:
+        case: A dictionary of parameters overriding BASE_PARAMETERS.
+        seed: The seed of the stream (int).
+
+    Returns:
+        state: A dictionary of the case's parameters, particle arrays and inputs.
+    """
+    parameters = dict(BASE_PARAMETERS, **case)
+    rng = np.random.default_rng(seed)
+    h = sbelt_runner.compute_h(parameters['particle_diam'])
+    bed_particles, model_particles, model_supp, subregions = sbelt_runner.build_stream(parameters,
+                                                                                    h, rng)
+    # The Poisson mean is used as the number of events per subregion
+    e_events = int(round(parameters['poiss_lambda']))
+    model = model_particles.copy()
+    event_ids = logic.get_event_particles(e_events, subregions, model,
+                                            parameters['level_limit'], rng=rng)
+    unverified_e = logic.compute_hops(event_ids, model, parameters['gauss_mu'],
+                                        parameters['gauss_sigma'], rng=rng)
+    avail_vertices = logic.compute_available_vertices(model, bed_particles,
+                                                        parameters['particle_diam'],
+                                                        parameters['level_limit'],
+                                                        lifted_particles=event_ids)
+    moved, moved_supp = logic.move_model_particles(unverified_e, model.copy(), model_supp.copy(),
+                                                    bed_particles, avail_vertices, h, rng)
+    return {'parameters': parameters, 'seed': seed, 'h': h, 'e_events': e_events,
+            'bed_particles': bed_particles, 'model_particles': model_particles,
+            'model_supp': model_supp, 'event_ids': event_ids, 'unverified_e': unverified_e,
+            'avail_vertices': avail_vertices, 'moved_particles': moved, 'moved_supp': moved_supp}
+
+
+def prepare(name, state):
+    """Returns a call of benchmark name with fresh copies of its inputs"""
+    parameters = state['parameters']
+    diam, level_limit, h = parameters['particle_diam'], parameters['level_limit'], state['h']
+    rng = np.random.default_rng(state['seed'])
+    bed = state['bed_particles']
+    model, supp = state['model_particles'].copy(), state['model_supp'].copy()
+    subregions = logic.define_subregion_table(parameters['bed_length'],
+                                                parameters['num_subregions'], 1)
+
+    if name == 'build_streambed':
+        return lambda: logic.build_streambed(parameters['bed_length'], diam)
+    if name == 'set_model_particles':
+        empty = np.empty((0, 7))
+        vertices = logic.compute_available_vertices(empty, bed, diam, level_limit)
+        return lambda: logic.set_model_particles(bed, vertices, diam,
+                                                    parameters['particle_pack_dens'], h, rng)
+    if name == 'compute_available_vertices':
+        return lambda: logic.compute_available_vertices(model, bed, diam, level_limit,
+                                                        lifted_particles=state['event_ids'])
+    if name == 'get_event_particles':
+        return lambda: logic.get_event_particles(state['e_events'], subregions, model,
+                                                    level_limit, rng=rng)
+    if name == 'move_model_particles':
+        unverified_e = state['unverified_e'].copy()
+        return lambda: logic.move_model_particles(unverified_e, model, supp, bed,
+                                                    state['avail_vertices'], h, rng)
+    if name == 'update_flux':
+        initial = state['model_particles'][state['event_ids'], 0]
+        final = state['moved_particles'][state['event_ids'], 0]
+        return lambda: logic.update_flux(initial, final, 0, subregions)
+    if name == 'update_particle_states':
+        moved = state['moved_particles'].copy()
+        return lambda: logic.update_particle_states(moved, state['moved_supp'])
+    if name == 'lattice_get_event_particles':
+        # The index is updated for the event's particles, then read instead of rescanning
+        event = _lattice_event(state, subregions)
+        event['support_graph'].lift(event['event_ids'], event['model'], event['lifted_supp'])
+        event['support_graph'].place(event['event_ids'], event['model'], event['supp'])
+        buckets, model = event['particle_buckets'], event['model']
+        changed = np.concatenate((event['event_ids'], event['lifted_supp'][event['event_ids']].ravel(),
+                                    event['supp'][event['event_ids']].ravel()))
+        return lambda: (buckets.update(changed, model),
+                        buckets.get_event_particles(state['e_events'], subregions, model,
+                                                        level_limit, rng=rng))
+    if name == 'lattice_update_particle_states':
+        # Only the event particles and their old and new supports are touched
+        event = _lattice_event(state, subregions)
+        graph, model, event_ids = event['support_graph'], event['model'], event['event_ids']
+        return lambda: (graph.lift(event_ids, model, event['lifted_supp']),
+                        graph.place(event_ids, model, event['supp']))
+    if name == 'iteration':
+        random_streams = streams.RandomStreams(state['seed'], parameters['poiss_lambda'],
+                                                parameters['gauss_mu'], parameters['gauss_sigma'])
+        # Draw the streams' first blocks outside of the timed region, as runs amortise them
+        random_streams.event_count()
+        random_streams.hops(1)
+        return lambda: _iteration(parameters, h, bed, model, supp, subregions,
+                                    random_streams, rng)
+    raise ValueError(f'Unknown benchmark {name}, benchmarks must be in {BENCHMARKS}.')
+
+
+def _lattice_event(state, subregions):
+    """ Returns the lattice engine's structures after the case's
+    entrainment event has moved its particles, before the support graph
+    and particle buckets are updated for it. """
+    parameters = state['parameters']
+    model, supp = state['model_particles'].copy(), state['model_supp'].copy()
+    lattice_bed = lattice.LatticeBed(state['bed_particles'], model, parameters['particle_diam'],
+                                        parameters['level_limit'], state['h'])
+    particle_buckets = lattice.ParticleBuckets(lattice_bed, subregions, model)
+    support_graph = lattice.SupportGraph(model, supp, len(state['bed_particles']))
+    lifted_supp = supp.copy()
+    lattice_bed.lift(state['event_ids'])
+    lattice.move_model_particles(state['unverified_e'].copy(), model, supp, lattice_bed,
+                                    np.random.default_rng(state['seed']))
+    return {'lattice_bed': lattice_bed, 'particle_buckets': particle_buckets,
+            'support_graph': support_graph, 'event_ids': state['event_ids'], 'model': model,
+            'lifted_supp': lifted_supp, 'supp': supp}
+
+
+def _iteration(parameters, h, bed_particles, model_particles, model_supp, subregions,
+                    random_streams, rng):
+    """One iteration of the reference engine, as run by sbelt_runner.entrain"""
+    e_events = random_streams.event_count()
+    event_particle_ids = logic.get_event_particles(e_events, subregions, model_particles,
+                                                    parameters['level_limit'],
+                                                    parameters['height_dependant_entr'], rng)
+    unverified_e = logic.compute_hops(event_particle_ids, model_particles, parameters['gauss_mu'],
+                                        parameters['gauss_sigma'], normal=parameters['gauss'],
+                                        hops=random_streams.hops(len(event_particle_ids)))
+    avail_vertices = logic.compute_available_vertices(model_particles, bed_particles,
+                                                        parameters['particle_diam'],
+                                                        parameters['level_limit'],
+                                                        lifted_particles=event_particle_ids)
+    return sbelt_runner.entrainment_event(model_particles, model_supp, bed_particles,
+                                            event_particle_ids, avail_vertices, unverified_e,
+                                            subregions, 0, h, rng)
+
+
+def time_benchmark(name, state, repeat=5, number=None):
+    """ Time a benchmark on a case.
+
+    Args:
+        name: The benchmark, one of BENCHMARKS.
+        state: The case's state returned by build_case.
+        repeat: The number of measurements (int).
+        number: The number of calls per measurement (int). If None, it
+            is chosen so that a measurement takes at least MIN_TIME.
+
+    Returns:
+        timings: A NumPy array of the time per call of each measurement in seconds.
+        number: The number of calls per measurement (int).
+    """
+    def measure(number):
+        calls = [prepare(name, state) for _ in range(number)]
+        start = time.perf_counter()
+        for call in calls:
+            call()
+        return (time.perf_counter() - start) / number
+
+    if number is None:
+        number = int(min(MAX_NUMBER, max(1, np.ceil(MIN_TIME / measure(1)))))
+    return np.array([measure(number) for _ in range(repeat)]), number
+
+
+def run_benchmarks(grid=None, benchmarks=None, repeat=5, seed=SEED):
+    """ Run benchmarks on every case of a grid.
+
+    Args:
+        grid: A dictionary of the values of each parameter (see grid_cases).
+        benchmarks: A Python list of benchmark names. Defaults to BENCHMARKS.
+        repeat: The number of measurements of each benchmark and case (int).
+        seed: The seed of the benchmarked streams (int).
+
+    Returns:
+        results: A dictionary with the run's metadata ('metadata') and a
+            Python list of the timings of each benchmark and case ('results').
+            Times are in seconds per call.
+    """
+    benchmarks = BENCHMARKS if benchmarks is None else benchmarks
+    results = []
+    for case in grid_cases(grid):
+        state = build_case(case, seed)
+        for name in benchmarks:
+            timings, number = time_benchmark(name, state, repeat)
+            results.append({'benchmark': name,
+                            'case': case,
+                            'particles': len(state['model_particles']),
+                            'events': len(state['event_ids']),
+                            'number': number,
+                            'min': float(timings.min()),
+                            'median': float(np.median(timings)),
+                            'mean': float(timings.mean())})
+    return {'metadata': metadata(repeat, seed), 'results': results}
+
+
+def metadata(repeat, seed):
+    """Returns a dictionary describing the machine and libraries benchmarked"""
+    return {'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor() or platform.machine(),
+            'repeat': repeat,
+            'seed': seed}
+
+
+def _key(result):
+    return result['benchmark'], json.dumps(result['case'], sort_keys=True)
+
+
+def compare(baseline, current, threshold=THRESHOLD):
+    """ Compare benchmark results with a baseline.
+
+    Args:
+        baseline: Results returned by run_benchmarks (or read from its JSON).
+        current: Results returned by run_benchmarks.
+        threshold: The slowdown (current / baseline median) above which a
+            benchmark is reported as a regression (float).
+
+    Returns:
+        comparison: A Python list with a dictionary per benchmark and case
+            present in both results, holding the benchmark, the case,
+            both medians, their ratio and whether it is a regression.
+    """
+    medians = {_key(result): result['median'] for result in baseline['results']}
+    comparison = []
+    for result in current['results']:
+        if _key(result) not in medians:
+            continue
+        ratio = result['median'] / medians[_key(result)]
+        comparison.append({'benchmark': result['benchmark'],
+                           'case': result['case'],
+                           'baseline': medians[_key(result)],
+                           'current': result['median'],
+                           'ratio': ratio,
+                           'regression': ratio > threshold})
+    return comparison
+
+
+def _case_label(case):
+    return ' '.join(f'{value:g}' for value in case.values())
+
+
+def format_results(results):
+    """Returns the results of run_benchmarks as a table (string)"""
+    header = ' '.join(GRID)
+    lines = [f'{"benchmark":<32} {header:<50} {"particles":>9} {"median (ms)":>12} {"min (ms)":>10}']
+    for result in results['results']:
+        lines.append(f'{result["benchmark"]:<32} {_case_label(result["case"]):<50} '
+                        f'{result["particles"]:>9} {result["median"] * 1e3:>12.4f} '
+                        f'{result["min"] * 1e3:>10.4f}')
+    return '\n'.join(lines)
+
+
+def format_comparison(comparison):
+    """Returns the comparison returned by compare as a table (string)"""
+    lines = [f'{"benchmark":<32} {" ".join(GRID):<50} {"ratio":>7}']
+    for row in comparison:
+        flag = '  REGRESSION' if row['regression'] else ''
+        lines.append(f'{row["benchmark"]:<32} {_case_label(row["case"]):<50} '
+                        f'{row["ratio"]:>7.2f}{flag}')
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    """ Command line entry point, see the module docstring.
+
+    Returns 1 if a baseline is compared and a benchmark regressed, 0 otherwise.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the hot paths of the logic module.')
+    parser.add_argument('--bed-length', type=int, nargs='+', default=GRID['bed_length'])
+    parser.add_argument('--pack-dens', type=float, nargs='+', default=GRID['particle_pack_dens'])
+    parser.add_argument('--num-subregions', type=int, nargs='+', default=GRID['num_subregions'])
+    parser.add_argument('--poiss-lambda', type=float, nargs='+', default=GRID['poiss_lambda'])
+    parser.add_argument('--benchmarks', nargs='+', default=BENCHMARKS, choices=BENCHMARKS)
+    parser.add_argument('--repeat', type=int, default=5, help='Measurements per benchmark.')
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--json', default=None, help='Also write the results to this JSON file.')
+    parser.add_argument('--compare', default=None, help='JSON results of a baseline to compare with.')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='Slowdown reported as a regression.')
+    args = parser.parse_args(argv)
+
+    grid = {'bed_length': args.bed_length, 'particle_pack_dens': args.pack_dens,
+            'num_subregions': args.num_subregions, 'poiss_lambda': args.poiss_lambda}
+    results = run_benchmarks(grid, args.benchmarks, args.repeat, args.seed)
+    print(format_results(results))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            comparison = compare(json.load(f), results, args.threshold)
+        print(format_comparison(comparison))
+        if any(row['regression'] for row in comparison):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,124 @@
+"""
+This module is responsible for writing and reading run checkpoints. A
+checkpoint holds everything needed to continue a run exactly as if it
+had not stopped: the particle arrays, the flux and age arrays, the next
+iteration, the snapshot counter, the state of every random number
+generator used by the run and the state of its streaming statistics
+and phase timers.
+
+Checkpoints are written to a side file next to the run's output
+({out_name}.checkpoint.hdf5). Each checkpoint is first written to a
+temporary file which then replaces the previous checkpoint, so a crash
+while checkpointing always leaves the previous checkpoint intact.
+All functions are designed for internal use and may change without note.
+
+Attributes:
+    CHECKPOINT_NAME: Format of the checkpoint file name.
+"""
+import json
+import os
+
+import h5py
+import numpy as np
+
+CHECKPOINT_NAME = '{out_name}.checkpoint.hdf5'
+
+
+def checkpoint_path(out_path, out_name):
+    """Returns the location of a run's checkpoint file"""
+    return os.path.join(out_path, CHECKPOINT_NAME.format(out_name=out_name))
+
+
+def write_checkpoint(path, iteration, snapshot_counter, bed_particles, model_particles,
+                        model_supp, flux, avg_age, age_range, rng, random_streams,
+                        statistics=None, timing=None):
+    """ Atomically write a checkpoint.
+
+    Args:
+        path: Location of the checkpoint file.
+        iteration: The next iteration to run (int).
+        snapshot_counter: Iterations run since the last snapshot (int).
+        bed_particles: An m-7 NumPy array representing the stream's m bed particles.
+        model_particles: An n-7 NumPy array representing the stream's n model particles.
+        model_supp: An n-2 NumPy array with the uids of the two particles supporting each 
+            model particle.
+        flux: An iterations x num_subregions NumPy array of crossings.
+        avg_age: NumPy array of the average particle age of each iteration.
+        age_range: NumPy array of the particle age range of each iteration.
+        rng: The run's numpy.random.Generator.
+        random_streams: The run's streams.RandomStreams.
+        statistics: Optional dictionary of the state of each of the run's
+            streaming statistics, by name (see accumulators.StatisticsSet.get_state).
+        timing: Optional dictionary of the state of the run's phase timer
+            (see timing.PhaseTimer.get_state).
+    """
+    tmp_path = f'{path}.tmp'
+    with h5py.File(tmp_path, 'w') as f:
+        f.attrs['iteration'] = iteration
+        f.attrs['snapshot_counter'] = snapshot_counter
+        f.attrs['rng'] = json.dumps(rng.bit_generator.state)
+        f.create_dataset('bed', data=bed_particles)
+        f.create_dataset('model', data=model_particles)
+        f.create_dataset('model_supp', data=model_supp)
+        # Only the iterations run so far are kept, so a run can be extended
+        f.create_dataset('flux', data=flux[:iteration])
+        f.create_dataset('avg_age', data=avg_age[:iteration])
+        f.create_dataset('age_range', data=age_range[:iteration])
+        _write_state(f.create_group('random_streams'), random_streams.get_state())
+        grp_statistics = f.create_group('statistics')
+        for name, state in (statistics or {}).items():
+            _write_state(grp_statistics.create_group(name), state)
+        _write_state(f.create_group('timing'), timing or {})
+    os.replace(tmp_path, path)
+
+
+def _write_state(grp, state):
+    """Write a dictionary of strings (as attributes) and arrays to an h5py Group"""
+    for key, value in state.items():
+        if isinstance(value, str):
+            grp.attrs[key] = value
+        else:
+            grp.create_dataset(key, data=value)
+
+
+def _read_state(grp):
+    """Read a dictionary written by _write_state"""
+    state = dict(grp.attrs)
+    state.update({key: grp[key][()] for key in grp})
+    return state
+
+
+def read_checkpoint(path):
+    """ Read a checkpoint.
+
+    Args:
+        path: Location of the checkpoint file.
+
+    Returns:
+        checkpoint: A dictionary with the arguments of write_checkpoint,
+            except path. rng is a numpy.random.Generator and random_streams
+            is the dictionary to pass to RandomStreams.set_state. statistics
+            is empty if the run has no streaming statistics and timing if
+            the run is not timed.
+
+    Raises:
+        ValueError: if there is no checkpoint at path.
+    """
+    if not os.path.exists(path):
+        raise ValueError(f'No checkpoint found at {path}.')
+    with h5py.File(path, 'r') as f:
+        rng = np.random.default_rng()
+        rng.bit_generator.state = json.loads(f.attrs['rng'])
+        statistics = {name: _read_state(grp) for name, grp in f.get('statistics', {}).items()}
+        return {'iteration': int(f.attrs['iteration']),
+                'snapshot_counter': int(f.attrs['snapshot_counter']),
+                'bed_particles': f['bed'][()],
+                'model_particles': f['model'][()],
+                'model_supp': f['model_supp'][()],
+                'flux': f['flux'][()],
+                'avg_age': f['avg_age'][()],
+                'age_range': f['age_range'][()],
+                'rng': rng,
+                'random_streams': _read_state(f['random_streams']),
+                'statistics': statistics,
+                'timing': _read_state(f['timing']) if 'timing' in f else {}}
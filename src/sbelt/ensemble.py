@@ -0,0 +1,190 @@
+"""
+This module is responsible for executing ensembles of sbelt runs. An
+ensemble is a list of parameter sets, each run for a number of replicas,
+with every member run in its own process.
+
+Every member gets its own seed. Unless seeds are given explicitly, they
+are derived from a single root seed with numpy.random.SeedSequence, so
+an ensemble with the same root seed is reproducible on any machine and
+no matter how many workers are used.
+
+Each member writes its own output file and a manifest (JSON) records the
+parameters, seed, output file, status and wall time of every member,
+along with the root seed used.
+
+Examples:
+    An ensemble can be run from Python::
+
+        ensemble.run_ensemble([{'iterations': 1000}, {'iterations': 1000, 'gauss': True}],
+                                replicas=10, root_seed=42, workers=4)
+
+    or from the command line, where parameters.json holds a parameter
+    dictionary or a list of them::
+
+        $ sbelt-ensemble parameters.json --replicas 10 --root-seed 42 --workers 4
+
+Attributes:
+    MANIFEST_NAME: Name of the manifest file written to the ensemble directory.
+    MEMBER_NAME: Format of each member's out_name.
+    RESERVED_PARAMETERS: Parameters that are set per member by the ensemble.
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from sbelt import sbelt_runner
+
+MANIFEST_NAME = 'manifest.json'
+MEMBER_NAME = 'member-{index:04d}'
+RESERVED_PARAMETERS = ['seed', 'out_path', 'out_name']
+logging.getLogger(__name__)
+
+
+def member_seeds(root_seed, num_members):
+    """ Derive independent seeds from a root seed.
+
+    Args:
+        root_seed: A non-negative int, or None to draw fresh entropy.
+        num_members: The number of seeds to derive (int).
+
+    Returns:
+        root_seed: The root seed used (int). Equal to the root_seed
+            argument unless it was None.
+        seeds: A Python list of num_members non-negative ints.
+    """
+    seed_seq = np.random.SeedSequence(root_seed)
+    # Seeds are stored in HDF5 params, so keep them within int64
+    seeds = [int(child.generate_state(1, np.uint64)[0] >> np.uint64(1))
+                for child in seed_seq.spawn(num_members)]
+    return int(seed_seq.entropy), seeds
+
+
+def run_ensemble(parameter_sets, replicas=1, seeds=None, root_seed=None, workers=None,
+                    out_path='.', out_name='sbelt-ensemble'):
+    """ Execute an ensemble of sbelt runs.
+
+    Members are ordered by parameter set, then replica. Member i writes
+    {out_path}/{out_name}/member-{i:04d}.hdf5. A failing member does not
+    stop the ensemble; its error is recorded in the manifest.
+
+    Args:
+        parameter_sets: A dictionary, or Python list of dictionaries, of
+            keyword arguments to sbelt_runner.run. Cannot contain any of
+            RESERVED_PARAMETERS.
+        replicas: The number of members to run for each parameter set (int).
+        seeds: Optional Python list of one seed per member. If None, seeds
+            are derived from root_seed (see member_seeds).
+        root_seed: A non-negative int used to derive member seeds. If None,
+            fresh entropy is used and recorded in the manifest.
+        workers: The number of worker processes (int). If None, the number
+            of processors on the machine is used.
+        out_path: A string representing the relative location to save the output.
+        out_name: A string representing the name of the ensemble directory.
+
+    Returns:
+        manifest: A dictionary with the contents of the written manifest.
+
+    Raises:
+        ValueError: if a parameter set contains a reserved parameter or the
+            number of seeds does not match the number of members.
+    """
+    if isinstance(parameter_sets, dict):
+        parameter_sets = [parameter_sets]
+    for parameters in parameter_sets:
+        reserved = [key for key in RESERVED_PARAMETERS if key in parameters]
+        if reserved:
+            raise ValueError(f'{reserved} are set per member by the ensemble.')
+
+    members = [dict(parameters) for parameters in parameter_sets for _ in range(replicas)]
+    if seeds is None:
+        root_seed, seeds = member_seeds(root_seed, len(members))
+    elif len(seeds) != len(members):
+        raise ValueError(f'Expected {len(members)} seeds, got {len(seeds)}.')
+
+    ensemble_path = os.path.join(out_path, out_name)
+    os.makedirs(ensemble_path, exist_ok=True)
+
+    print(f'Running {len(members)} member(s) with {workers or os.cpu_count()} worker(s)...')
+    start = time.perf_counter()
+    results = [None] * len(members)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_member, parameters, int(seed), ensemble_path,
+                                    MEMBER_NAME.format(index=index)): index
+                    for index, (parameters, seed) in enumerate(zip(members, seeds))}
+        for future in as_completed(futures):
+            index = futures[future]
+            results[index] = future.result()
+            if results[index]['status'] == 'failed':
+                logging.error(f'Member {index} failed: {results[index]["error"]}')
+
+    manifest = {'root_seed': root_seed,
+                'replicas': replicas,
+                'workers': workers or os.cpu_count(),
+                'wall_time': time.perf_counter() - start,
+                'members': [dict(index=index, parameters=parameters, seed=int(seed), **result)
+                            for index, (parameters, seed, result)
+                            in enumerate(zip(members, seeds, results))]}
+    with open(os.path.join(ensemble_path, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, default=str)
+
+    failures = sum(member['status'] == 'failed' for member in manifest['members'])
+    print(f'Ensemble finished in {manifest["wall_time"]:.1f}s with {failures} failure(s).')
+    return manifest
+
+
+def run_member(parameters, seed, out_path, out_name):
+    """ Run a single ensemble member. Executed in a worker process.
+
+    Args:
+        parameters: A dictionary of keyword arguments to sbelt_runner.run.
+        seed: The member's seed (int).
+        out_path: A string representing the relative location to save the output.
+        out_name: A string representing the name of the output file.
+
+    Returns:
+        result: A dictionary with the member's output file, status
+            ('ok' or 'failed'), wall time and error (None unless failed).
+    """
+    start = time.perf_counter()
+    error = None
+    try:
+        # Progress output from many processes is just noise
+        with open(os.devnull, 'w') as devnull, \
+                contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+            sbelt_runner.run(**parameters, seed=seed, out_path=out_path, out_name=out_name)
+    except Exception:
+        error = traceback.format_exc()
+    return {'output': os.path.join(out_path, f'{out_name}.hdf5'),
+            'status': 'ok' if error is None else 'failed',
+            'wall_time': time.perf_counter() - start,
+            'error': error}
+
+
+def main(argv=None):
+    """Command line entry point, see the module docstring"""
+    parser = argparse.ArgumentParser(description='Run an ensemble of sbelt runs.')
+    parser.add_argument('parameters', help='JSON file with a parameter dictionary or a list of them.')
+    parser.add_argument('--replicas', type=int, default=1, help='Members per parameter set.')
+    parser.add_argument('--root-seed', type=int, default=None, help='Seed to derive member seeds from.')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes.')
+    parser.add_argument('--out-path', default='.', help='Location to save the ensemble.')
+    parser.add_argument('--out-name', default='sbelt-ensemble', help='Name of the ensemble directory.')
+    args = parser.parse_args(argv)
+
+    with open(args.parameters) as f:
+        parameter_sets = json.load(f)
+    manifest = run_ensemble(parameter_sets, replicas=args.replicas, root_seed=args.root_seed,
+                                workers=args.workers, out_path=args.out_path,
+                                out_name=args.out_name)
+    return 1 if any(member['status'] == 'failed' for member in manifest['members']) else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
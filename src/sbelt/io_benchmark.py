@@ -0,0 +1,161 @@
+"""
+This module is a small benchmark of the output storage options. It runs
+a standard model run once, keeping every snapshot, and then times
+writing those snapshots to a new file with each combination of storage
+options, reporting the write throughput (MB/s of uncompressed snapshot
+data) and the resulting file size.
+
+Only writing snapshots is timed, not the model itself, so the numbers
+show the cost of each option on its own.
+
+Examples:
+    From Python::
+
+        results = io_benchmark.run_benchmark(iterations=500)
+
+    or from the command line::
+
+        $ sbelt-io-benchmark --iterations 500 --json io-benchmark.json
+
+Attributes:
+    STANDARD_RUN: Parameters of the run whose snapshots are written.
+    OPTIONS: The storage options benchmarked by default. Options left
+        out take the defaults of sbelt_runner.run.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+from sbelt import sbelt_runner
+from sbelt import storage
+
+STANDARD_RUN = {'iterations': 1000, 'bed_length': 100, 'data_save_interval': 1,
+                'engine': 'lattice', 'seed': 0}
+OPTIONS = [{'compression': 'none'},
+           {'compression': 'lzf'},
+           {'compression': 'lzf', 'shuffle': True},
+           {'compression': 'gzip', 'compression_level': 1},
+           {'compression': 'gzip', 'compression_level': 4},
+           {'compression': 'gzip', 'compression_level': 4, 'shuffle': True},
+           {'compression': 'gzip', 'compression_level': 9},
+           {'compression': 'gzip', 'compression_level': 4, 'float_precision': 'float32'},
+           {'storage_layout': 'v2', 'compression': 'lzf'},
+           {'storage_layout': 'v2', 'compression': 'gzip', 'compression_level': 4},
+           {'storage_layout': 'v2', 'compression': 'gzip', 'compression_level': 4,
+                'shuffle': True},
+           {'storage_layout': 'delta', 'compression': 'gzip', 'compression_level': 4}]
+
+
+def standard_snapshots(out_path, **run_parameters):
+    """ Run the standard run and return its snapshots.
+
+    Args:
+        out_path: A string representing the location to save the run's output.
+        **run_parameters: Parameters of sbelt_runner.run overriding STANDARD_RUN.
+
+    Returns:
+        snapshots: A Python list of (iteration, model, event_ids) tuples.
+    """
+    parameters = dict(STANDARD_RUN, **run_parameters)
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        sbelt_runner.run(out_path=out_path, out_name='standard', compression='none',
+                            **parameters)
+    with h5py.File(os.path.join(out_path, 'standard.hdf5'), 'r') as f:
+        return list(storage.iter_snapshots(f))
+
+
+def time_writes(path, snapshots, storage_layout='v1', keyframe_interval=100, compression='gzip',
+                    compression_level=4, shuffle=False, float_precision='float64',
+                    snapshot_chunk_bytes=storage.CHUNK_BYTES):
+    """ Time writing snapshots to a new file with the given storage options.
+
+    Args:
+        path: A string representing the file to write.
+        snapshots: A Python list of (iteration, model, event_ids) tuples.
+        The remaining arguments are the storage options of sbelt_runner.run.
+
+    Returns:
+        seconds: The time taken to write and close the file (float).
+    """
+    filters = storage.dataset_filters(compression, compression_level, shuffle)
+    float_type = np.float32 if float_precision == 'float32' else None
+    start = time.perf_counter()
+    with h5py.File(path, 'w') as f:
+        writer = storage.snapshot_writer(f, storage_layout, keyframe_interval, filters,
+                                            snapshot_chunk_bytes)
+        for iteration, model, event_ids in snapshots:
+            writer.append(iteration, model.astype(float_type) if float_type else model,
+                            event_ids)
+        writer.close()
+    return time.perf_counter() - start
+
+
+def run_benchmark(options=None, repeat=3, **run_parameters):
+    """ Benchmark writing the standard run's snapshots with each of options.
+
+    Args:
+        options: A Python list of dictionaries of storage options. Defaults
+            to OPTIONS.
+        repeat: The number of times each option is timed. The fastest
+            time is reported (int).
+        **run_parameters: Parameters of sbelt_runner.run overriding STANDARD_RUN.
+
+    Returns:
+        results: A Python list with a dictionary per option holding the
+            options, the best write time in seconds, the write throughput
+            in MB/s, the file size in bytes and the compression ratio.
+    """
+    options = OPTIONS if options is None else options
+    results = []
+    with tempfile.TemporaryDirectory() as out_path:
+        snapshots = standard_snapshots(out_path, **run_parameters)
+        raw_bytes = sum(model.nbytes + event_ids.nbytes for _, model, event_ids in snapshots)
+        path = os.path.join(out_path, 'benchmark.hdf5')
+        for option in options:
+            seconds = min(time_writes(path, snapshots, **option) for _ in range(repeat))
+            file_bytes = os.path.getsize(path)
+            results.append({'options': option,
+                            'seconds': seconds,
+                            'mb_per_s': raw_bytes / seconds / 1e6,
+                            'file_bytes': file_bytes,
+                            'ratio': raw_bytes / file_bytes})
+    return results
+
+
+def format_results(results):
+    """Returns the results of run_benchmark as a table (string)"""
+    lines = [f'{"options":<70} {"MB/s":>8} {"size (MB)":>10} {"ratio":>6}']
+    for result in results:
+        option = ', '.join(f'{key}={value}' for key, value in result['options'].items())
+        lines.append(f'{option:<70} {result["mb_per_s"]:>8.1f} '
+                        f'{result["file_bytes"] / 1e6:>10.2f} {result["ratio"]:>6.1f}')
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    """Command line entry point, see the module docstring"""
+    parser = argparse.ArgumentParser(description='Benchmark the output storage options.')
+    parser.add_argument('--iterations', type=int, default=STANDARD_RUN['iterations'])
+    parser.add_argument('--bed-length', type=int, default=STANDARD_RUN['bed_length'])
+    parser.add_argument('--repeat', type=int, default=3, help='Timings per option.')
+    parser.add_argument('--json', default=None, help='Also write the results to this JSON file.')
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(repeat=args.repeat, iterations=args.iterations,
+                                bed_length=args.bed_length)
+    print(format_results(results))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
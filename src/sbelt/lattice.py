@@ -0,0 +1,594 @@
+"""
+This module contains an integer height-map representation of the
+stream which can be used as an alternative to the float-based search
+functions in the logic module. All functions/classes are designed
+for internal use and may change without note.
+
+Every legal x location in the stream sits on a lattice of
+half-diameter slots. Bed particles occupy the odd slots at level 0,
+model particles resting on the bed occupy the even slots at level 1,
+and so on. Because of this, the state of the stream can be described
+by two integer arrays::
+
+    levels[slot]      = level of the top particle in the slot (-1 if empty)
+    uids[level, slot] = uid of the particle at that level and slot
+
+Support lookup, elevation assignment and level limit checks then become
+O(1) array reads rather than scans over all particles. The model_particles
+and model_supp arrays are still maintained so that the rest of the model
+(event selection, hops, flux and storage) is unaffected.
+"""
+
+import numpy as np
+
+from sbelt import logic
+
+import logging
+logging.getLogger(__name__)
+
+
+class LatticeBed():
+    """ Integer height-map of a stream.
+
+    Attributes:
+        half_diam: Half of the particle diameter (float), the lattice spacing.
+        level_limit: The maximum number of model particle levels (int).
+        elevations: NumPy array of the elevation of each level. Values
+            are computed with the same rounding as logic.place_particle.
+        slot_x: NumPy array of the x location of each slot.
+        levels: NumPy int array of the top level in each slot (-1 if empty).
+        uids: NumPy int array (levels x slots) of the uid at each
+            level and slot. Only entries at or below levels[slot] are valid.
+        slot_of: NumPy int array of the slot of each model particle, indexed
+            by uid (-1 for particles that are not in-stream).
+        level_of: NumPy int array of the level of each model particle, indexed
+            by uid (-1 for particles that are not in-stream).
+        available: NumPy boolean array indicating which slots are available
+            vertices. Maintained incrementally by lift, place and settle.
+        next_vertex: NextVertexIndex of the available slots, updated in
+            place whenever a slot's availability changes.
+    """
+    def __init__(self, bed_particles, model_particles, particle_diam, level_limit, h):
+        self.half_diam = particle_diam / 2
+        self.level_limit = level_limit
+
+        elevations = np.zeros(level_limit + 1, dtype=float)
+        for level in range(1, level_limit + 1):
+            elevations[level] = round(np.add(h, elevations[level-1]), 2)
+        self.elevations = elevations
+
+        bed_slots = self.slot(bed_particles[:,0])
+        num_slots = int(np.max(bed_slots)) + 2
+        self.slot_x = np.round(np.arange(num_slots) * self.half_diam, 2)
+        self.levels = np.full(num_slots, -1, dtype=np.int64)
+        self.uids = np.zeros((level_limit + 1, num_slots), dtype=np.int64)
+        self.levels[bed_slots] = 0
+        self.uids[0, bed_slots] = bed_particles[:,3].astype(np.int64)
+
+        num_particles = len(model_particles)
+        self.slot_of = np.full(num_particles, -1, dtype=np.int64)
+        self.level_of = np.full(num_particles, -1, dtype=np.int64)
+        in_stream = np.nonzero(model_particles[:,0] != -1)[0]
+        if in_stream.size != 0:
+            slots = self.slot(model_particles[in_stream, 0])
+            levels = self.level(model_particles[in_stream, 2])
+            self.slot_of[in_stream] = slots
+            self.level_of[in_stream] = levels
+            self.uids[levels, slots] = model_particles[in_stream, 3].astype(np.int64)
+            np.maximum.at(self.levels, slots, levels)
+
+        self.available = np.zeros(num_slots, dtype=bool)
+        self.available[1:-1] = self.compute_available(np.arange(1, num_slots-1))
+        self.next_vertex = NextVertexIndex(self.available)
+        self._unsettled = []
+
+    def slot(self, x):
+        """Returns the lattice slot(s) of x location(s)"""
+        return np.rint(np.divide(x, self.half_diam)).astype(np.int64)
+
+    def level(self, y):
+        """Returns the level(s) of elevation(s)"""
+        y = np.atleast_1d(y)
+        return np.abs(y[:, None] - self.elevations[None, :]).argmin(axis=1)
+
+    def lift(self, uids):
+        """ Remove particles from the stream.
+
+        Lifted particles must be at the top of their slot (i.e. active).
+        Particles which are not in-stream (ghost particles) are ignored.
+        Availability of the slots around each lifted particle is updated.
+
+        Args:
+            uids: NumPy array of uids of the particles being lifted.
+        """
+        uids = np.asarray(uids, dtype=np.int64)
+        uids = uids[self.slot_of[uids] != -1]
+        slots = self.slot_of[uids]
+        # The next particle down a slot is always 2 levels below
+        self.levels[slots] = np.maximum(self.level_of[uids] - 2, -1)
+        self.slot_of[uids] = -1
+        self.level_of[uids] = -1
+        self._refresh(np.concatenate((slots-1, slots, slots+1)))
+
+    def compute_available(self, slots):
+        """ Compute whether slots are available vertices.
+
+        A slot is available when both of its neighbouring slots have
+        their top particle on the same level, the slot itself is not
+        occupied at or above that level, and a particle placed there
+        would not exceed the level limit.
+
+        Args:
+            slots: NumPy int array of slots, none of which can be
+                the first or last slot.
+
+        Returns:
+            available: NumPy boolean array, True where the slot is available.
+        """
+        left = self.levels[slots-1]
+        middle = self.levels[slots]
+        right = self.levels[slots+1]
+        return ((left == right)
+                & (left >= 0)
+                & (middle < left)
+                & (left < self.level_limit))
+
+    def _refresh(self, slots):
+        """Recompute the availability of slots, updating next_vertex for those that change"""
+        slots = np.unique(slots)
+        slots = slots[(slots >= 1) & (slots <= len(self.levels) - 2)]
+        available = self.compute_available(slots)
+        changed = available != self.available[slots]
+        self.available[slots[changed]] = available[changed]
+        for slot, now_available in zip(slots[changed].tolist(), available[changed].tolist()):
+            if now_available:
+                self.next_vertex.add(slot)
+            else:
+                self.next_vertex.remove(slot)
+
+    def settle(self):
+        """ Update availability of the slots next to particles placed
+        since the last call.
+
+        Vertices created by a placement (i.e on top of a placed particle) 
+        are not available for the remainder of the entrainment event in which 
+        the placement happens, matching logic.compute_available_vertices being 
+        called once per iteration. Call this once all event particles are placed.
+        """
+        self._refresh(np.array(self._unsettled, dtype=np.int64))
+        self._unsettled = []
+
+    def available_slots(self):
+        """Returns a sorted NumPy int array of available slots."""
+        return np.flatnonzero(self.available)
+
+    def available_vertices(self):
+        """Returns a sorted NumPy array of all available vertices in the stream."""
+        return self.slot_x[self.available_slots()]
+
+    def place(self, uid, slot):
+        """ Place a particle at a slot.
+
+        The slot becomes unavailable immediately but the neighbouring
+        slots are only refreshed on the next call to settle.
+
+        Args:
+            uid: The uid of the particle being placed (int).
+            slot: The slot the particle is being placed at (int).
+
+        Returns:
+            x: Float of the particle's new x location.
+            y: Float of the particle's new y location.
+            left_support: UID of the left support for the placed particle.
+            right_support: UID of the right support for the placed particle.
+        """
+        level = self.levels[slot-1] + 1
+        left_support = self.uids[level-1, slot-1]
+        right_support = self.uids[level-1, slot+1]
+
+        self.levels[slot] = level
+        if self.available[slot]:
+            self.available[slot] = False
+            self.next_vertex.remove(slot)
+        self._unsettled.extend((slot-1, slot+1))
+        self.uids[level, slot] = uid
+        self.slot_of[uid] = slot
+        self.level_of[uid] = level
+
+        return self.slot_x[slot], self.elevations[level], left_support, right_support
+
+
+class NextVertexIndex():
+    """ Disjoint-set index of available slots.
+
+    Answers "what is the closest available slot at or downstream
+    of slot s" and removes slots in near-constant amortised time. 
+    Every unavailable slot is linked to a slot to its right, no further
+    than the next available slot, so the root of a slot's set is the 
+    next available slot. Paths are compressed on every find. A slot 
+    which becomes available again is added back by relinking the 
+    unavailable slots between it and the previous available slot, so 
+    the index is built once and only touched slots are updated.
+
+    Attributes:
+        end: Sentinel returned by find when no slot is available
+            at or downstream of the requested slot.
+    """
+    def __init__(self, available):
+        self.end = len(available)
+        slots = np.arange(self.end + 1)
+        parent = slots + 1
+        parent[:-1][available] = slots[:-1][available]
+        parent[-1] = self.end
+        self._parent = parent.tolist()
+        self._available = available.tolist() + [True]
+
+    def find(self, slot):
+        """Returns the closest available slot >= slot, or end if none exists"""
+        parent = self._parent
+        root = slot
+        while parent[root] != root:
+            root = parent[root]
+        while parent[slot] != root:
+            parent[slot], slot = root, parent[slot]
+        return root
+
+    def remove(self, slot):
+        """Mark an available slot as unavailable"""
+        self._parent[slot] = slot + 1
+        self._available[slot] = False
+
+    def add(self, slot):
+        """Mark an unavailable slot as available"""
+        parent, available = self._parent, self._available
+        parent[slot] = slot
+        available[slot] = True
+        # Unavailable slots up to the previous available slot may link past this one
+        slot_before = slot - 1
+        while slot_before >= 0 and not available[slot_before]:
+            parent[slot_before] = slot
+            slot_before -= 1
+
+
+class SupportGraph():
+    """ Reverse support index of the stream.
+
+    For each particle (model or bed), records the particles resting on 
+    it. A particle can have at most two particles resting on it, one on 
+    each shoulder. Model particle states are updated from this index 
+    as event particles are lifted and placed, so only the particles 
+    involved have their active attribute touched.
+
+    Attributes:
+        resting: NumPy int array (n+m x 2) of the uids of particles resting on 
+            the left and right shoulder of each particle (-1 if none). Row i 
+            is model particle i for i < n and bed particle -(i-n+1) otherwise.
+        rest_count: NumPy int array of the number of particles resting on each 
+            particle, indexed the same as resting.
+    """
+    def __init__(self, model_particles, model_supp, num_bed_particles):
+        self.num_particles = len(model_particles)
+        self.resting = np.full((self.num_particles + num_bed_particles, 2), -1, dtype=np.int64)
+        self.rest_count = np.zeros(self.num_particles + num_bed_particles, dtype=np.int64)
+
+        placed = np.flatnonzero(~np.isnan(model_supp[:,0]))
+        self._add(placed, model_supp[placed])
+
+    def _row(self, uid):
+        """Returns the row of a uid (int) in resting and rest_count"""
+        return uid if uid >= 0 else self.num_particles - uid - 1
+
+    def _rows(self, uids):
+        """Returns a NumPy array of the rows of uids in resting and rest_count"""
+        uids = uids.astype(np.int64)
+        return np.where(uids >= 0, uids, self.num_particles - uids - 1)
+
+    def _add(self, uids, supports):
+        left, right = self._rows(supports[:,0]), self._rows(supports[:,1])
+        # A particle sits on the right shoulder of its left support, and vice versa
+        self.resting[left, 1] = uids
+        self.resting[right, 0] = uids
+        np.add.at(self.rest_count, left, 1)
+        np.add.at(self.rest_count, right, 1)
+
+    def resting_on(self, uid):
+        """Returns a NumPy array of the uids of the particles resting on uid"""
+        resting = self.resting[self._row(uid)]
+        return resting[resting != -1]
+
+    def lift(self, uids, model_particles, model_supp):
+        """ Remove particles from the index.
+
+        Must be called before the particles' supports are updated.
+        Model particle supports with nothing left resting on them 
+        are set to active.
+
+        Args:
+            uids: NumPy array of uids of the particles being lifted.
+            model_particles: An n-7 NumPy array representing the stream's
+                n model particles.
+            model_supp: An n-2 NumPy array with the uids of the two 
+                particles supporting each model particle.
+        """
+        uids = np.asarray(uids, dtype=np.int64)
+        uids = uids[~np.isnan(model_supp[uids, 0])]
+        rows = np.concatenate((self._rows(model_supp[uids, 0]), self._rows(model_supp[uids, 1])))
+        self.resting[rows[:len(uids)], 1] = -1
+        self.resting[rows[len(uids):], 0] = -1
+        np.subtract.at(self.rest_count, rows, 1)
+        # Model particles have the first rows
+        freed = rows[(rows < self.num_particles) & (self.rest_count[rows] == 0)]
+        model_particles[freed, 4] = 1
+
+    def place(self, uids, model_particles, model_supp):
+        """ Add placed particles to the index.
+
+        Must be called after the particles' supports are updated. Placed
+        (and ghost) particles are set to active and model particle supports
+        are set to inactive.
+
+        Args:
+            uids: NumPy array of uids of the particles that were placed.
+            model_particles: An n-7 NumPy array representing the stream's
+                n model particles.
+            model_supp: An n-2 NumPy array with the uids of the two 
+                particles supporting each model particle.
+        """
+        uids = np.asarray(uids, dtype=np.int64)
+        model_particles[uids, 4] = 1
+        uids = uids[~np.isnan(model_supp[uids, 0])]
+        self._add(uids, model_supp[uids])
+        supports = model_supp[uids].ravel().astype(np.int64)
+        model_particles[supports[supports >= 0], 4] = 0
+
+
+class ParticleBuckets():
+    """ Index of the active, in-stream particles in each subregion.
+
+    The index is updated only for particles whose location or state 
+    changes, so event selection does not need to rescan every model 
+    particle once per subregion. A particle resting on a boundary 
+    shared by two subregions is a member of both.
+
+    Each subregion's members are kept unordered in a compact array:
+    members are appended and removed by swapping in the last member,
+    so an update costs O(1) per changed particle. Event particles are
+    sampled from the arrays in place. After rebuild (and when the index
+    is built) each subregion's members are in ascending order.
+
+    Attributes:
+        members: Python array with a NumPy array of uids per subregion of
+            the active in-stream particles within the subregion's
+            boundaries. The arrays are views of the index.
+        level_counts: NumPy int array (subregions x levels) of the number
+            of in-stream particles at each level of each subregion.
+        ghosts: Python set of uids of ghost particles.
+    """
+    def __init__(self, lattice_bed, subregions, model_particles):
+        self.lattice_bed = lattice_bed
+        left_boundaries = np.array([subregion.leftBoundary() for subregion in subregions])
+        right_boundaries = np.array([subregion.rightBoundary() for subregion in subregions])
+        # First and last subregion whose boundaries contain each slot. Subregions
+        # are wider than a slot, so a slot is in at most two subregions
+        self._first = np.searchsorted(right_boundaries, lattice_bed.slot_x, side='left')
+        self._last = np.searchsorted(left_boundaries, lattice_bed.slot_x, side='right') - 1
+
+        num_particles = len(model_particles)
+        self._slot = np.copy(lattice_bed.slot_of)
+        self._level = np.copy(lattice_bed.level_of)
+        self._active = (self._slot != -1) & (model_particles[:,4] != 0)
+        self.ghosts = set(np.flatnonzero(model_particles[:,0] == -1).tolist())
+
+        # A slot holds at most one particle per level
+        slots = np.zeros(len(subregions), dtype=np.int64)
+        in_range = self._first <= self._last
+        np.add.at(slots, self._first[in_range], 1)
+        np.add.at(slots, self._last[in_range & (self._last > self._first)], 1)
+        capacity = np.minimum(slots * (lattice_bed.level_limit + 1), num_particles)
+        self._members = [np.empty(size, dtype=np.int64) for size in capacity]
+        self._sizes = [0] * len(subregions)
+        # Position of each particle in the members of its first (column 0)
+        # and last (column 1) subregion
+        self._position = np.full((num_particles, 2), -1, dtype=np.int64)
+
+        self.level_counts = np.zeros((len(subregions), lattice_bed.level_limit + 1), 
+                                        dtype=np.int64)
+        uids, idx, _ = self._subregions_of(np.flatnonzero(self._slot != -1))
+        np.add.at(self.level_counts, (idx, self._level[uids]), 1)
+        self.rebuild()
+
+    @property
+    def members(self):
+        return [members[:size] for members, size in zip(self._members, self._sizes)]
+
+    def rebuild(self):
+        """ Rebuild each subregion's members in ascending order of uid. 
+
+        The order of the members decides which particles a draw selects,
+        so runs resumed from a checkpoint (which build a new index) only
+        continue identically if the index is rebuilt at the checkpoint. """
+        self._position[:] = -1
+        uids, idx, column = self._subregions_of(np.flatnonzero(self._active))
+        order = np.lexsort((uids, idx))
+        uids, idx, column = uids[order], idx[order], column[order]
+        for j in range(len(self._members)):
+            begin, end = np.searchsorted(idx, [j, j + 1])
+            self._members[j][:end - begin] = uids[begin:end]
+            self._position[uids[begin:end], column[begin:end]] = np.arange(end - begin)
+            self._sizes[j] = int(end - begin)
+
+    def positions(self, idx, uids):
+        """ Returns a Python array of the positions in members[idx] of the
+        uids (NumPy array) which are members. """
+        positions = []
+        for uid in np.asarray(uids, dtype=np.int64).tolist():
+            slot = self._slot[uid]
+            if slot == -1 or not self._active[uid]:
+                continue
+            if self._first[slot] == idx:
+                positions.append(int(self._position[uid, 0]))
+            elif self._last[slot] == idx:
+                positions.append(int(self._position[uid, 1]))
+        return positions
+
+    def _subregions_of(self, uids):
+        """ Returns the uids repeated once per subregion they are in (as 
+        recorded in the index), the index of each of those subregions and
+        the column of the uid's position in it. """
+        first, last = self._first[self._slot[uids]], self._last[self._slot[uids]]
+        both = last > first
+        return (np.concatenate((uids, uids[both])), 
+                np.concatenate((first, last[both])),
+                np.concatenate((np.zeros(len(uids), dtype=np.int64), 
+                                np.ones(np.count_nonzero(both), dtype=np.int64))))
+
+    def _add(self, uids):
+        uids, idx, column = self._subregions_of(uids)
+        np.add.at(self.level_counts, (idx, self._level[uids]), 1)
+        active = self._active[uids]
+        for uid, j, c in zip(uids[active].tolist(), idx[active].tolist(), 
+                                column[active].tolist()):
+            self._members[j][self._sizes[j]] = uid
+            self._position[uid, c] = self._sizes[j]
+            self._sizes[j] += 1
+
+    def _remove(self, uids):
+        uids, idx, column = self._subregions_of(uids)
+        np.subtract.at(self.level_counts, (idx, self._level[uids]), 1)
+        active = self._active[uids]
+        for uid, j, c in zip(uids[active].tolist(), idx[active].tolist(), 
+                                column[active].tolist()):
+            position = self._position[uid, c]
+            self._sizes[j] -= 1
+            moved = self._members[j][self._sizes[j]]
+            self._members[j][position] = moved
+            self._position[moved, int(self._first[self._slot[moved]] != j)] = position
+            self._position[uid, c] = -1
+
+    def update(self, uids, model_particles):
+        """ Update the index for particles that moved or changed state.
+
+        Args:
+            uids: NumPy array of uids of the particles that changed. 
+                Negative (bed) and NaN uids are ignored.
+            model_particles: An n-7 NumPy array representing the stream's
+                n model particles.
+        """
+        uids = np.asarray(uids, dtype=float)
+        uids = np.unique(uids[uids >= 0]).astype(np.int64)
+        self._remove(uids[self._slot[uids] != -1])
+        self.ghosts.difference_update(uids.tolist())
+
+        self._slot[uids] = self.lattice_bed.slot_of[uids]
+        self._level[uids] = self.lattice_bed.level_of[uids]
+        in_stream = self._slot[uids] != -1
+        self._active[uids] = in_stream & (model_particles[uids, 4] != 0)
+        self._add(uids[in_stream])
+        self.ghosts.update(uids[~in_stream & (model_particles[uids, 0] == -1)].tolist())
+
+    def get_event_particles(self, e_events, subregions, model_particles, level_limit, 
+                                                            height_dependant=False, rng=None):
+        """ Find and return list of particles to be entrained.
+
+        Equivalent to logic.get_event_particles but candidates are 
+        read from the index rather than found by scanning model_particles,
+        and are sampled in the order of the index.
+
+        Args:
+            e_events: The number of events requested per subregion (int).
+            subregions: Python array of Subregion objects or a SubregionTable. 
+            model_particles: An n-7 NumPy array representing the stream's n 
+                model particles.
+            level_limit: The maximum number of levels permitted in-stream (int).
+            height_dependant: Boolean flag indicating whether particles at the
+                level limit are always entrained.
+            rng: A numpy.random.Generator to draw from. If None, NumPy's
+                global random state is used.
+
+        Returns:
+            event_particles: A NumPy array of k uids representing the model particles
+                that have been selected for entrainment.
+        """
+        members = self.members
+        tips = []
+        for idx, subregion_members in enumerate(members):
+            tip_particles = np.empty(0, dtype=np.int64)
+            if height_dependant:
+                levels = np.flatnonzero(self.level_counts[idx] > 0)
+                if len(levels) == level_limit:
+                    tip_particles = subregion_members[self._level[subregion_members] 
+                                                        == levels[level_limit-1]]
+            tips.append(tip_particles)
+
+        ghost_particles = np.array(sorted(self.ghosts), dtype=np.intp)
+        model_particles[ghost_particles, 0] = 0
+
+        return logic.select_event_particles(e_events, subregions, members, 
+                                                tips, ghost_particles, rng, self.positions)
+
+
+def move_model_particles(event_particles, model_particles, model_supp, lattice_bed, rng=None):
+    """ Move model particles in the stream using a LatticeBed.
+
+    Equivalent to logic.move_model_particles but supports and elevations
+    are read from the lattice and closest vertices are found with the 
+    lattice's next_vertex index. Event particles must have already been
+    lifted from lattice_bed.
+
+    Args:
+        event_particles: A k-7 Numpy array representing event particle.
+        model_particles: An n-7 NumPy array representing the stream's
+            n model particles.
+        model_supp: An n-2 NumPy array with the uids of the two particles supporting each
+            model particle (e.g model_supp[j] = supports for model particle j).
+        lattice_bed: A LatticeBed with the event particles lifted.
+        rng: A numpy.random.Generator to draw from. If None, NumPy's
+            global random state is used.
+
+    Returns:
+        model_particles: The provided model_particles array (Args)
+            but with updated (x,y) attributes based on placements.
+        model_supports: An updated model_supports (Args) based on
+            placements.
+    """
+    index = lattice_bed.next_vertex
+    # Randomly iterate over event particles
+    for particle in logic.get_rng(rng).permutation(event_particles):
+        uid = int(particle[3])
+        orig_x = model_particles[uid][0]
+        if index.find(0) == index.end:
+            raise ValueError('Available vertices array is empty, cannot find closest vertex')
+        if particle[0] < 0:
+            raise ValueError('Desired hop is negative (invalid)')
+        # First slot whose x location is >= the desired hop
+        desired_slot = int(np.searchsorted(lattice_bed.slot_x, particle[0], side='left'))
+        slot = index.find(min(desired_slot, index.end))
+
+        if slot == index.end:
+            exceed_msg = (
+                f'Particle {uid} exceeded stream...'
+                f'sending to -1 axis'
+            )
+            logging.info(exceed_msg)
+            particle[6] = particle[6] + 1
+            particle[0] = -1
+
+            model_supp[uid][0] = np.nan
+            model_supp[uid][1] = np.nan
+        else:
+            hop_msg = (
+                f'Particle {uid} entrained from {orig_x} '
+                f'to {lattice_bed.slot_x[slot]}. Desired hop was: {particle[0]}'
+            )
+            logging.info(hop_msg)
+
+            placed_x, placed_y, left_supp, right_supp = lattice_bed.place(uid, slot)
+            particle[0] = placed_x
+            particle[2] = placed_y
+
+            model_supp[uid][0] = left_supp
+            model_supp[uid][1] = right_supp
+
+        model_particles[uid] = particle
+    lattice_bed.settle()
+    return model_particles, model_supp
@@ -16,7 +16,6 @@ more information on the other attributes.
 """
 
 import math
-import random
 import numpy as np
 
 
@@ -24,6 +23,21 @@ import logging
 logging.getLogger(__name__)
 
 
+def get_rng(rng=None):
+    """ Returns the random number generator to draw from.
+
+    Functions that consume randomness accept an rng argument. When
+    it is None they fall back to NumPy's global random state, which
+    provides the same drawing methods as a numpy.random.Generator.
+
+    Args:
+        rng: A numpy.random.Generator or None.
+    """
+    if rng is None:
+        return np.random
+    return rng
+
+
 class Subregion():
     """ A subregion in the stream.
     
@@ -45,12 +59,16 @@ class Subregion():
         left_boundary: Location of the left boundary (float).
         right_boundary: Location of the right boundary (float).
         iterations: The number of iterations for the model run.
+        flux_list: Optional NumPy int array to record flux in. Used by
+            SubregionTable to share its flux matrix.
     """
-    def __init__(self, name, left_boundary, right_boundary, iterations):
+    def __init__(self, name, left_boundary, right_boundary, iterations, flux_list=None):
         self.name = name
         self.left_boundary = left_boundary
         self.right_boundary = right_boundary
-        self.flux_list = np.zeros(iterations, dtype=np.int64)
+        if flux_list is None:
+            flux_list = np.zeros(iterations, dtype=np.int64)
+        self.flux_list = flux_list
         
     def leftBoundary(self):
         """Returns subregion's left boundary"""
@@ -76,7 +94,74 @@ class Subregion():
         """Returns subregion's flux list"""
         return self.flux_list
 
-def get_event_particles(e_events, subregions, model_particles, level_limit, height_dependant=False):
+class SubregionTable():
+    """ A table of all subregions in the stream.
+
+    Stores the subregion boundaries as NumPy arrays and the flux
+    of every subregion in a single iterations x num_subregions 
+    int matrix so crossings can be counted for all particles
+    and subregions at once. Iterating over or indexing a table
+    gives Subregion objects whose flux lists are views into the 
+    flux matrix, so a table can be used anywhere a Python array 
+    of Subregion objects is expected.
+
+    Attributes:
+        left_boundaries: NumPy array of left boundary locations.
+        right_boundaries: NumPy array of right boundary locations.
+        flux: NumPy int array (iterations x num_subregions) of crossings.
+    """
+    def __init__(self, names, left_boundaries, right_boundaries, iterations):
+        self.left_boundaries = np.asarray(left_boundaries, dtype=float)
+        self.right_boundaries = np.asarray(right_boundaries, dtype=float)
+        self.flux = np.zeros((iterations, len(names)), dtype=np.int64)
+        self._subregions = [Subregion(name, left, right, iterations, 
+                                        flux_list=self.flux[:, idx])
+                            for idx, (name, left, right) in enumerate(zip(names, 
+                                                                    left_boundaries, 
+                                                                    right_boundaries))]
+
+    def __len__(self):
+        return len(self._subregions)
+
+    def __iter__(self):
+        return iter(self._subregions)
+
+    def __getitem__(self, idx):
+        return self._subregions[idx]
+
+    def update_flux(self, initial_positions, final_positions, iteration):
+        """ Count downstream boundary crossings for all particles at once.
+
+        A particle starting in subregion i and finishing at x crosses 
+        the right boundary of every subregion from i up to the last
+        one whose right boundary is <= x. Particles that leave the 
+        stream (final position of -1) only cross the right boundary 
+        of the last subregion, matching update_flux.
+
+        Args:
+            initial_positions: NumPy array of initial x locations.
+            final_positions: NumPy array of final (verified) x locations.
+            iteration: The iteration for the flux to be updated for (int).
+        """
+        num_subregions = len(self._subregions)
+        initial_positions = np.asarray(initial_positions)
+        final_positions = np.asarray(final_positions)
+
+        start = np.searchsorted(self.left_boundaries, initial_positions, side='right') - 1
+        end = np.searchsorted(self.right_boundaries, final_positions, side='right')
+        ghost = final_positions == -1
+        start[ghost] = num_subregions - 1
+        end[ghost] = num_subregions
+        end = np.maximum(start, end)
+
+        crossings = np.zeros(num_subregions + 1, dtype=np.int64)
+        np.add.at(crossings, start, 1)
+        np.add.at(crossings, end, -1)
+        self.flux[iteration] += np.cumsum(crossings[:-1])
+
+
+def get_event_particles(e_events, subregions, model_particles, level_limit, height_dependant=False, 
+                                                                                    rng=None):
     """ Find and return list of particles to be entrained
 
     Will loop through each subregion and select n = e_events
@@ -88,6 +173,8 @@ def get_event_particles(e_events, subregions, model_particles, level_limit, heig
         subregions: Python array of initialized Subregion objects. 
         model_particles: An n-7 NumPy array representing the stream's n 
             model particles.
+        rng: A numpy.random.Generator to draw from. If None, NumPy's
+            global random state is used.
 
     Returns:
         event_particles: A NumPy array of k uids representing the model particles
@@ -98,10 +185,8 @@ def get_event_particles(e_events, subregions, model_particles, level_limit, heig
             Will represent that model particles with uids 2.0, 5.0 and
             25.0 have been selected for entrainment. 
     """
-    if e_events == 0:
-        e_events = 1 #???
-    
-    event_particles = []
+    candidates = []
+    tips = []
     for subregion in subregions:
         # Take only particles in the boundaries of the current subregion
         subregion_particles = model_particles[
@@ -113,37 +198,134 @@ def get_event_particles(e_events, subregions, model_particles, level_limit, heig
         # Take only particles that are 'active' 
         active_particles =  in_stream_particles[
                                                 in_stream_particles[:,4] != 0]
+        candidates.append(active_particles[:,3].astype(np.intp))
 
-        # Do not take any particles that have been selected for entrainment (i.e do not double select)
-        # This only happens when particles rest on the boundary. 
-        active_event, active_idx, event_idx = np.intersect1d(active_particles[:,3], event_particles, return_indices=True)
-        active_particles = np.delete(active_particles, active_idx, axis=0)
-
-        subregion_event_ids = []  
+        tip_particles = np.empty(0, dtype=np.intp)
         if height_dependant: # any particle at the level limit must be entrained
             levels = elevation_list(subregion_particles[:,2], desc=False)
-            tip_particles = []
             # find the tip particles -- these are the particles being entrained
             if len(levels) == level_limit: 
-                tip_particles = active_particles[active_particles[:,2] == levels[level_limit-1]]
-            for particle in tip_particles:
-                subregion_event_ids.append(particle[3])
-                active_particles = active_particles[active_particles[:,2] != particle[2]]
-        # If there are not enough particles in the subregion to sample from, alter the sample size
-        if e_events > len(active_particles):
-            random_sample = random.sample(range(len(active_particles)), 
-                                        len(active_particles))
-        else: 
-            random_sample = random.sample(range(len(active_particles)), 
-                                        e_events)
-        # TODO: change so that we don't rely on loop index to grab particle
-        for index in random_sample:
-            subregion_event_ids.append(int(active_particles[index][3])  )
-        
-        ghost_particles = np.where(model_particles[:,0] == -1)[0]
-        for index in ghost_particles:
-            model_particles[index][0] = 0 
-            subregion_event_ids.append(index)
+                tip_particles = active_particles[active_particles[:,2] 
+                                                    == levels[level_limit-1]][:,3].astype(np.intp)
+        tips.append(tip_particles)
+
+    ghost_particles = np.where(model_particles[:,0] == -1)[0]
+    model_particles[ghost_particles, 0] = 0
+
+    return select_event_particles(e_events, subregions, candidates, tips, ghost_particles, rng)
+
+
+def candidate_positions(candidates, uids):
+    """ Find uids in an array of candidates sorted in ascending order.
+
+    Args:
+        candidates: NumPy array of uids, sorted in ascending order.
+        uids: NumPy array of uids to find.
+
+    Returns:
+        positions: Python array of the positions in candidates of the
+            uids which are candidates.
+    """
+    uids = np.asarray(uids, dtype=np.intp)
+    positions = np.searchsorted(candidates, uids)
+    found = positions < len(candidates)
+    positions, uids = positions[found], uids[found]
+    return positions[candidates[positions] == uids].tolist()
+
+
+def sample_candidates(candidates, excluded, draws):
+    """ Sample candidates with a partial Fisher-Yates shuffle.
+
+    Swaps are recorded in a dictionary instead of being applied to 
+    candidates, so the cost depends on the number of samples and
+    exclusions but not on the number of candidates, and candidates
+    is never copied or modified.
+
+    Args:
+        candidates: NumPy array of uids to sample from.
+        excluded: Python array of the positions in candidates of the
+            uids which must not be selected.
+        draws: NumPy array of uniform values in [0, 1), one per 
+            sample requested.
+
+    Returns:
+        selected: Python list of the sampled uids. If there are not enough
+            candidates all those not excluded are selected.
+    """
+    swapped = {}
+    # Swap the excluded candidates to the front, where they are never drawn
+    start = 0
+    for position in sorted(set(excluded)):
+        swapped[start], swapped[position] = (swapped.get(position, candidates[position]),
+                                                swapped.get(start, candidates[start]))
+        start += 1
+
+    selected = []
+    for j in range(start, start + min(len(draws), len(candidates) - start)):
+        swap = j + int(draws[j - start] * (len(candidates) - j))
+        selected.append(int(swapped.get(swap, candidates[swap])))
+        swapped[swap] = swapped.get(j, candidates[j])
+    return selected
+
+
+def select_event_particles(e_events, subregions, candidates, tips, ghost_particles, rng=None,
+                                find=None):
+    """ Select the particles to be entrained from each subregion's candidates.
+
+    Randomness for every subregion is drawn in a single batched call 
+    (e_events uniform values per subregion) so that the draw order only
+    depends on the number of subregions and events, not on how the 
+    candidates were found. Each subregion's sample is taken with a 
+    partial Fisher-Yates shuffle over its candidates (see 
+    sample_candidates), so the particles selected for a given draw
+    depend on the order of the candidates.
+
+    Particles resting on a boundary are candidates of both subregions
+    sharing the boundary, but will not be selected twice. Tip particles
+    are always selected and never count towards the sample. Ghost particles
+    are always selected as part of the first subregion.
+
+    Args:
+        e_events: The number of events requested per subregion (int).
+        subregions: Python array of Subregion objects or a SubregionTable.
+        candidates: Python array with a NumPy array of uids of the active 
+            in-stream particles in each subregion.
+        tips: Python array with a NumPy array of uids of the tip
+            particles (see get_event_particles) in each subregion. 
+        ghost_particles: NumPy array of uids of ghost particles.
+        rng: A numpy.random.Generator to draw from. If None, NumPy's
+            global random state is used.
+        find: A function find(idx, uids) returning a Python array of the
+            positions in candidates[idx] of the uids which are candidates. If None,
+            each array of candidates must be sorted in ascending order
+            and is searched with candidate_positions.
+
+    Returns:
+        event_particles: A NumPy array of k uids representing the model particles
+            that have been selected for entrainment.
+    """
+    if e_events == 0:
+        e_events = 1 #???
+    if find is None:
+        find = lambda idx, uids: candidate_positions(candidates[idx], uids)
+
+    draws = get_rng(rng).random((len(subregions), e_events))
+    event_particles = []
+    previous_ids = np.empty(0, dtype=np.intp)
+    for idx, subregion in enumerate(subregions):
+        # Do not take any particles that have been selected for entrainment (i.e do not double select)
+        # This only happens when particles rest on the boundary. 
+        subregion_tips = tips[idx]
+        if previous_ids.size != 0 and subregion_tips.size != 0:
+            subregion_tips = subregion_tips[~np.isin(subregion_tips, previous_ids)]
+        subregion_event_ids = [int(uid) for uid in subregion_tips]
+
+        # If there are not enough particles in the subregion to sample from, fewer are selected
+        excluded = find(idx, np.concatenate((previous_ids, subregion_tips)).astype(np.intp))
+        subregion_event_ids.extend(sample_candidates(candidates[idx], excluded, draws[idx]))
+
+        if idx == 0:
+            subregion_event_ids.extend(int(uid) for uid in ghost_particles)
         
         if e_events != len(subregion_event_ids):
             msg = (
@@ -151,6 +333,7 @@ def get_event_particles(e_events, subregions, model_particles, level_limit, heig
                      f'but {len(subregion_event_ids)} are occuring'
             )
             logging.info(msg)
+        previous_ids = np.array(subregion_event_ids, dtype=np.intp)
         event_particles = event_particles + subregion_event_ids
     event_particles = np.array(event_particles, dtype=np.intp)
 
@@ -178,6 +361,27 @@ def define_subregions(bed_length, num_subregions, iterations):
         subregions_arr.append(subregion)
     
     return subregions_arr
+
+
+def define_subregion_table(bed_length, num_subregions, iterations):
+    """ Define the subregion table for model stream.
+
+    Boundaries are identical to those from define_subregions.
+    
+    Args:
+        bed_length: The length of the stream (int). 
+        num_subregions: The number of subregions (int).
+        iterations: The number of iterations for the model run (int).
+
+    Returns:
+        subregion_table: An initialized SubregionTable. 
+    """
+    subregions_arr = define_subregions(bed_length, num_subregions, 0)
+    names = [subregion.getName() for subregion in subregions_arr]
+    left_boundaries = [subregion.leftBoundary() for subregion in subregions_arr]
+    right_boundaries = [subregion.rightBoundary() for subregion in subregions_arr]
+
+    return SubregionTable(names, left_boundaries, right_boundaries, iterations)
     
 def build_streambed(bed_length, particle_diam):
     """ Builds the array of bed particles.
@@ -353,12 +557,42 @@ def find_supports(particle, model_particles, bed_particles):
     return left_support[0], right_support[0]
 
 
-def set_model_particles(bed_particles, available_vertices, particle_diam, pack_fraction, h):
+def find_bed_supports(centres, bed_particles):
+    """ Find the bed particles centred at each location.
+
+    Args:
+        centres: NumPy array of x locations.
+        bed_particles: An m-7 NumPy array representing the stream's m 
+            bed particles.
+
+    Returns:
+        rows: NumPy int array of the row in bed_particles of the bed particle 
+            centred at each location.
+
+    Raises:
+        ValueError: if no bed particle is centred at a location.
+    """
+    order = np.argsort(bed_particles[:,0])
+    bed_x = bed_particles[order, 0]
+    idx = np.clip(np.searchsorted(bed_x, centres), 1, len(bed_x) - 1)
+    # take whichever neighbour is closest to guard against float drift in the bed
+    idx = np.where(np.abs(bed_x[idx-1] - centres) <= np.abs(bed_x[idx] - centres), idx-1, idx)
+    missing = ~np.isclose(bed_x[idx], centres)
+    if np.any(missing):
+        error_msg = f'No bed particle at {centres[missing][0]}'
+        logging.error(error_msg)
+        raise ValueError(error_msg)
+    return order[idx]
+
+
+def set_model_particles(bed_particles, available_vertices, particle_diam, pack_fraction, h, rng=None):
     """ Create array of n model particles and set each particle in-stream.
     
     Model particles are randomly placed at available vertex
     locations (x,y) across the bed. Location and initial attribute
-    values are stored in the returned NumPy array. 
+    values are stored in the returned NumPy array. All particles are
+    placed at once, so every available vertex must be formed by two
+    bed particles.
     
     Args:
         bed_particles: An m-7 NumPy array representing the stream's m bed particles.
@@ -368,6 +602,8 @@ def set_model_particles(bed_particles, available_vertices, particle_diam, pack_f
             repo for more information.
         h: Geometric value used in calculations of particle placement (float). See
             in-line and project documentation for further explanation.
+        rng: A numpy.random.Generator to draw from. If None, NumPy's
+            global random state is used.
     
     Returns:
         model_particles: An n-7 NumPy array representing the stream's n model particles and their 
@@ -391,40 +627,57 @@ def set_model_particles(bed_particles, available_vertices, particle_diam, pack_f
     num_placement_loc = np.size(available_vertices)
     # determine the number of model particles that should be introduced into the stream bed
     num_particles = determine_num_particles(pack_fraction, num_placement_loc)
-    # create an empty n-6 array to store model particle information
+    # create an empty n-7 array to store model particle information
     model_particles = np.zeros([num_particles, 7], dtype='float')
     model_supp = np.zeros([num_particles, 2], dtype='float')
-  
-    for particle in range(num_particles):  
-        # the following lines select a vertex to place the current particle at, 
-        # and ensure that it is not already occupied by another particle
-        random_idx = random.randint(0, np.size(available_vertices)-1)
-        vertex = available_vertices[random_idx]
-        available_vertices = available_vertices[available_vertices != vertex]
-
-        # intialize the particle information
-        model_particles[particle][0] = vertex 
-        model_particles[particle][1] = particle_diam
-        
-        model_particles[particle][3] = particle # id number for each particle
-        model_particles[particle][4] = 1 # each particle begins as active
-        
-        # place particle at the chosen vertex
-        p_x, p_y, left_supp, right_supp  = place_particle(model_particles[particle], 
-                                                            model_particles, 
-                                                            bed_particles, 
-                                                            h)
-        model_particles[particle][0] = p_x
-        model_particles[particle][2] = p_y
-        model_particles[particle][5] = 0
-        model_particles[particle][6] = 0
-
-        model_supp[particle][0] = left_supp
-        model_supp[particle][1] = right_supp
+
+    # select a distinct vertex for every particle in one draw. The order is random,
+    # so uids are assigned to vertices at random
+    vertices = np.asarray(available_vertices)[
+                        get_rng(rng).choice(num_placement_loc, num_particles, replace=False)]
     
+    # all vertices are on the bed, so the supports are the bed particles a radius either side
+    left_supp = find_bed_supports(vertices - (particle_diam / 2), bed_particles)
+    right_supp = find_bed_supports(vertices + (particle_diam / 2), bed_particles)
+
+    model_particles[:,0] = np.round(vertices, 2)
+    model_particles[:,1] = particle_diam
+    model_particles[:,2] = np.round(np.add(h, bed_particles[left_supp, 2]), 2)
+    model_particles[:,3] = np.arange(num_particles) # id number for each particle
+    model_particles[:,4] = 1 # each particle begins as active
+    
+    model_supp[:,0] = bed_particles[left_supp, 3]
+    model_supp[:,1] = bed_particles[right_supp, 3]
+
     return model_particles, model_supp
 
 
+def validate_uids(model_particles):
+    """ Validate that each model particle's uid is its row index.
+
+    Functions in this module (and the lattice module) address model
+    particles by uid, i.e model_particles[uid] is the particle with
+    that uid. set_model_particles creates particles this way, this
+    function checks the contract still holds.
+
+    Args:
+        model_particles: An n-7 NumPy array representing the stream's 
+            n model particles.
+
+    Raises:
+        ValueError: if any uid does not equal its row index.
+    """
+    mismatched = np.flatnonzero(model_particles[:,3] != np.arange(len(model_particles)))
+    if mismatched.size != 0:
+        error_msg = (
+                     f'Model particle uids must equal their row index. '
+                     f'Found {mismatched.size} mismatch(es), first at row {mismatched[0]} '
+                     f'with uid {model_particles[mismatched[0]][3]}'
+        )
+        logging.error(error_msg)
+        raise ValueError(error_msg)
+
+
 def compute_available_vertices(model_particles, bed_particles, particle_diam, level_limit,
                                lifted_particles=None):
     """ Compute the avaliable vertices in the model stream.
@@ -458,7 +711,7 @@ def compute_available_vertices(model_particles, bed_particles, particle_diam, le
     Returns:
         available_vertices: A NumPy array with all available vertices in the stream. 
     """
-    nulled_vertices = []
+    nulled_vertices = set()
     avail_vertices = []
     
     # If we are lifting particles, we need to consider the subset of particles
@@ -478,7 +731,7 @@ def compute_available_vertices(model_particles, bed_particles, particle_diam, le
         tmp_particles = all_particles[all_particles[:,2] == elevation]
         
         for particle in tmp_particles:    
-            nulled_vertices.append(particle[0])
+            nulled_vertices.add(particle[0])
         
         right_vertices = tmp_particles[:,0] + (particle_diam / 2)
         left_vertices = tmp_particles[:,0] - (particle_diam / 2)
@@ -487,7 +740,7 @@ def compute_available_vertices(model_particles, bed_particles, particle_diam, le
         # Enforce level limit by nulling any vertex above limit:
         if len(elevations) == level_limit+1 and idx==0: 
             for vertex in tmp_shared_vertices:
-                nulled_vertices.append(vertex)
+                nulled_vertices.add(vertex)
         
         for vertex in tmp_shared_vertices:
             if vertex not in nulled_vertices:
@@ -508,7 +761,7 @@ def elevation_list(elevations, desc=True):
            ue = ue[::-1]
     return ue
  
-def compute_hops(event_particle_ids, model_particles, mu, sigma, normal=False):
+def compute_hops(event_particle_ids, model_particles, mu, sigma, normal=False, rng=None, hops=None):
     """ Given a list of event paritcles, this function will 
     add a hop distance to current x locations of all event particles. 
     
@@ -524,23 +777,29 @@ def compute_hops(event_particle_ids, model_particles, mu, sigma, normal=False):
             n model particles.
         normal (default = False): Boolean flag for which distribution to sample
             Hop values from. True = sample from Normal, False = sample from log-Normal. 
+        rng: A numpy.random.Generator to draw from. If None, NumPy's
+            global random state is used.
+        hops: A NumPy array of k pre-drawn, rounded hop lengths (see 
+            streams.RandomStreams). If None, hops are drawn from rng.
     
     Returns:
         event_particles: A k-7 Numpy array representing each event particle
             with updated x locations (x=deried hop location).
     """
     event_particles = model_particles[event_particle_ids]
-    if normal:
-        s = np.random.normal(mu, sigma, len(event_particle_ids))
-    else:
-        s = np.random.lognormal(mu, sigma, len(event_particle_ids))
-    s_hop = np.round(s, 1)
-    s_hop = list(s_hop)
-    event_particles[:,0] = event_particles[:,0] + s_hop
+    if hops is None:
+        rng = get_rng(rng)
+        if normal:
+            s = rng.normal(mu, sigma, len(event_particle_ids))
+        else:
+            s = rng.lognormal(mu, sigma, len(event_particle_ids))
+        hops = np.round(s, 1)
+    event_particles[:,0] = event_particles[:,0] + hops
     
     return event_particles
  
-def move_model_particles(event_particles, model_particles, model_supp, bed_particles, available_vertices, h):
+def move_model_particles(event_particles, model_particles, model_supp, bed_particles, available_vertices, h, 
+                                                                                    rng=None):
     """ Move model particles in the stream.
     
     Given an array of event particles and their desired hops, move each
@@ -560,6 +819,8 @@ def move_model_particles(event_particles, model_particles, model_supp, bed_parti
         available_vertices: A NumPy array with all available vertices in the stream. 
         h: Geometric value used in calculations of particle placement (float). See
             in-line and project documentation for further explanation.
+        rng: A numpy.random.Generator to draw from. If None, NumPy's
+            global random state is used.
     
     Returns:
         model_particles: The provided model_particles array (Args) 
@@ -569,8 +830,10 @@ def move_model_particles(event_particles, model_particles, model_supp, bed_parti
             have their model supports updated.
     """
     # Randomly iterate over event particles
-    for particle in np.random.permutation(event_particles):
-        orig_x = model_particles[model_particles[:,3] == particle[3]][0][0]
+    for particle in get_rng(rng).permutation(event_particles):
+        # uids are row indices (see validate_uids)
+        uid = int(particle[3])
+        orig_x = model_particles[uid][0]
         verified_hop = find_closest_vertex(particle[0], available_vertices)
         
         if verified_hop == -1:
@@ -600,7 +863,7 @@ def move_model_particles(event_particles, model_particles, model_supp, bed_parti
             model_supp[int(particle[3])][0] = left_supp
             model_supp[int(particle[3])][1] = right_supp
 
-        model_particles[model_particles[:,3] == particle[3]] = particle
+        model_particles[uid] = particle
     return model_particles, model_supp
 
 
@@ -616,14 +879,19 @@ def update_flux(initial_positions, final_positions, iteration, subregions):
         initial_positions: NumPy array of initial x locations.
         final_positions: NumPy array of final (verified) x locations.
         iteration: The iteration for the flux to be updated for (int).
-        subregions: Python array of Subregion objects.
+        subregions: Python array of Subregion objects or a SubregionTable.
+            Crossings are counted in a single vectorised pass for a 
+            SubregionTable.
 
     Returns:
         subregions: Python array of Subregion objects with updated flux lists.
     """
-    # This can _most definitely_ be made quicker but for now, it works
     if len(initial_positions) != len(final_positions):
         raise ValueError(f'Initial_positions and final_positions do not contain the same # of elements')
+
+    if isinstance(subregions, SubregionTable):
+        subregions.update_flux(initial_positions, final_positions, iteration)
+        return subregions
     
     for position in range(0, len(initial_positions)):
 
@@ -0,0 +1,377 @@
+"""
+This module contains an optional compiled entrainment kernel. It is only
+used when Numba (https://numba.pydata.org/) can be imported; otherwise
+NUMBA_AVAILABLE is False and sbelt_runner falls back to the lattice engine.
+All functions are designed for internal use and may change without note.
+
+The kernel runs one or many complete iterations (event selection, hops,
+lifting, placement, flux, states and ages) over the plain arrays of a
+LatticeBed, the model particle arrays and a SubregionTable. It follows
+the same rules as the lattice engine, but draws from Numba's own random
+number generator. Runs are reproducible for a given seed (see seed),
+however they do not match the other engines run-for-run, only in
+distribution.
+
+When a run has streaming statistics (see the accumulators module) the
+kernel also logs the event particles of every iteration it runs, with
+their x, y and age before the iteration and their x and y after it.
+The statistics are then updated from the log (see replay_events), so
+the kernel still runs many iterations per call.
+
+Attributes:
+    NUMBA_AVAILABLE: True if Numba could be imported.
+    LOG_ROWS: The number of event particles the log has room for when
+        it is allocated. It grows as needed.
+"""
+import numpy as np
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """Stand-in decorator used when Numba is not installed"""
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+LOG_ROWS = 1024
+
+
+@njit(cache=True)
+def seed(value):
+    """Seed Numba's random number generator (int)"""
+    np.random.seed(value)
+
+
+@njit(cache=True)
+def _refresh(levels, available, slot, level_limit):
+    """Recompute the availability of a single slot"""
+    if slot < 1 or slot > len(levels) - 2:
+        return
+    left = levels[slot-1]
+    available[slot] = (left == levels[slot+1]
+                        and left >= 0
+                        and levels[slot] < left
+                        and left < level_limit)
+
+
+@njit(cache=True)
+def _grow(log, rows):
+    """Returns a copy of a 2-d log array with room for rows rows"""
+    grown = np.empty((rows, log.shape[1]), dtype=log.dtype)
+    grown[:log.shape[0]] = log
+    return grown
+
+
+@njit(cache=True)
+def run_iterations(model_particles, model_supp, levels, uids, slot_of, level_of, available,
+                   slot_x, elevations, left_boundaries, right_boundaries, first, last,
+                   flux, avg_age, age_range, start, stop, poiss_lambda, mu, sigma, normal,
+                   level_limit, height_dependant, record=False):
+    """ Run iterations [start, stop) of the model.
+
+    All arrays are updated in place. See lattice.LatticeBed and
+    lattice.ParticleBuckets for the meaning of the lattice and
+    subregion arrays. A LatticeBed's next_vertex index is not
+    updated, so its arrays should not be passed back to its methods.
+
+    Args:
+        model_particles: An n-7 NumPy array representing the stream's
+            n model particles.
+        model_supp: An n-2 NumPy array with the uids of the two particles
+            supporting each model particle.
+        levels, uids, slot_of, level_of, available, slot_x, elevations: The
+            arrays of a LatticeBed with the same names.
+        left_boundaries, right_boundaries: Subregion boundary arrays.
+        first, last: NumPy int arrays of the first and last subregion
+            containing each slot.
+        flux: An iterations x num_subregions int array of crossings.
+        avg_age: NumPy array of the average particle age of each iteration.
+        age_range: NumPy array of the particle age range of each iteration.
+        start: The first iteration to run (int).
+        stop: The iteration to stop before (int).
+        poiss_lambda, mu, sigma, normal, level_limit, height_dependant: As
+            passed to sbelt_runner.run.
+        record: Boolean flag indicating whether to log the event particles
+            of every iteration.
+
+    Returns:
+        event_particles: A NumPy array of the uids of the event particles of
+            the final iteration.
+        log_counts: A NumPy int array of the number of event particles of
+            each iteration. Empty unless record is True.
+        log_ids: A NumPy int array of the uids of the event particles of
+            each iteration, one iteration after the other.
+        log_before: A NumPy array (k x 3) of the x, y and age of each logged
+            event particle before its iteration, x is -1 for ghost particles.
+        log_after: A NumPy array (k x 2) of the x and y of each logged
+            event particle after its iteration.
+    """
+    n = model_particles.shape[0]
+    num_subregions = len(left_boundaries)
+    counts = np.zeros(num_subregions, dtype=np.int64)
+    offsets = np.zeros(num_subregions + 1, dtype=np.int64)
+    fill = np.zeros(num_subregions, dtype=np.int64)
+    members = np.empty(2 * n, dtype=np.int64)
+    level_present = np.zeros((num_subregions, level_limit + 1), dtype=np.int64)
+    selected = np.zeros(n, dtype=np.bool_)
+    pool = np.empty(n, dtype=np.int64)
+    events = np.empty(n, dtype=np.int64)
+    initial_x = np.empty(n, dtype=np.float64)
+    desired = np.empty(n, dtype=np.float64)
+    affected = np.empty(5 * n, dtype=np.int64)
+    placed_slots = np.empty(n, dtype=np.int64)
+    num_events = 0
+    log_counts = np.zeros(stop - start if record else 0, dtype=np.int64)
+    rows = LOG_ROWS if record else 0
+    log_ids = np.empty((rows, 1), dtype=np.int64)
+    log_before = np.empty((rows, 3), dtype=np.float64)
+    log_after = np.empty((rows, 2), dtype=np.float64)
+    logged = 0
+
+    for iteration in range(start, stop):
+        e_events = np.random.poisson(poiss_lambda)
+        if e_events == 0:
+            e_events = 1
+
+        # Index the active, in-stream particles of each subregion
+        counts[:] = 0
+        level_present[:, :] = 0
+        for uid in range(n):
+            slot = slot_of[uid]
+            if slot == -1:
+                continue
+            for j in range(first[slot], last[slot] + 1):
+                level_present[j, level_of[uid]] += 1
+                if model_particles[uid, 4] != 0:
+                    counts[j] += 1
+        for j in range(num_subregions):
+            offsets[j+1] = offsets[j] + counts[j]
+            fill[j] = offsets[j]
+        for uid in range(n):
+            slot = slot_of[uid]
+            if slot == -1 or model_particles[uid, 4] == 0:
+                continue
+            for j in range(first[slot], last[slot] + 1):
+                members[fill[j]] = uid
+                fill[j] += 1
+
+        # Select event particles
+        num_events = 0
+        ghosts_from = 0
+        ghosts_to = 0
+        for j in range(num_subregions):
+            k = 0
+            for p in range(offsets[j], offsets[j+1]):
+                if not selected[members[p]]:
+                    pool[k] = members[p]
+                    k += 1
+            if height_dependant:
+                num_levels = 0
+                for level in range(1, level_limit + 1):
+                    if level_present[j, level] > 0:
+                        num_levels += 1
+                if num_levels == level_limit:
+                    kept = 0
+                    for p in range(k):
+                        if level_of[pool[p]] == level_limit:
+                            selected[pool[p]] = True
+                            events[num_events] = pool[p]
+                            num_events += 1
+                        else:
+                            pool[kept] = pool[p]
+                            kept += 1
+                    k = kept
+            for t in range(min(e_events, k)):
+                swap = t + int(np.random.random() * (k - t))
+                uid = pool[swap]
+                pool[swap] = pool[t]
+                selected[uid] = True
+                events[num_events] = uid
+                num_events += 1
+            if j == 0:
+                ghosts_from = num_events
+                for uid in range(n):
+                    if model_particles[uid, 0] == -1:
+                        model_particles[uid, 0] = 0
+                        selected[uid] = True
+                        events[num_events] = uid
+                        num_events += 1
+                ghosts_to = num_events
+
+        if record:
+            if logged + num_events > log_ids.shape[0]:
+                rows = max(2 * log_ids.shape[0], logged + num_events)
+                log_ids = _grow(log_ids, rows)
+                log_before = _grow(log_before, rows)
+                log_after = _grow(log_after, rows)
+            for i in range(num_events):
+                uid = events[i]
+                log_ids[logged+i, 0] = uid
+                log_before[logged+i, 0] = model_particles[uid, 0]
+                log_before[logged+i, 1] = model_particles[uid, 2]
+                log_before[logged+i, 2] = model_particles[uid, 5]
+                if i >= ghosts_from and i < ghosts_to:
+                    log_before[logged+i, 0] = -1
+
+        # Compute hops and lift event particles
+        num_affected = 0
+        for i in range(num_events):
+            uid = events[i]
+            if normal:
+                hop = np.random.normal(mu, sigma)
+            else:
+                hop = np.random.lognormal(mu, sigma)
+            initial_x[i] = model_particles[uid, 0]
+            desired[i] = model_particles[uid, 0] + round(hop, 1)
+
+            affected[num_affected] = uid
+            num_affected += 1
+            slot = slot_of[uid]
+            if slot == -1:
+                continue
+            for c in range(2):
+                affected[num_affected] = int(model_supp[uid, c])
+                num_affected += 1
+            levels[slot] = max(level_of[uid] - 2, -1)
+            slot_of[uid] = -1
+            level_of[uid] = -1
+            for neighbour in range(slot - 1, slot + 2):
+                _refresh(levels, available, neighbour, level_limit)
+
+        # Move event particles in random order
+        num_available = 0
+        for slot in range(len(available)):
+            if available[slot]:
+                num_available += 1
+        num_placed = 0
+        for i in np.random.permutation(num_events):
+            uid = events[i]
+            if num_available == 0:
+                raise ValueError('Available vertices array is empty, cannot find closest vertex')
+            if desired[i] < 0:
+                raise ValueError('Desired hop is negative (invalid)')
+            slot = np.searchsorted(slot_x, desired[i])
+            while slot < len(available) and not available[slot]:
+                slot += 1
+            if slot == len(available):
+                model_particles[uid, 6] += 1
+                model_particles[uid, 0] = -1
+                model_supp[uid, 0] = np.nan
+                model_supp[uid, 1] = np.nan
+                continue
+            level = levels[slot-1] + 1
+            model_supp[uid, 0] = uids[level-1, slot-1]
+            model_supp[uid, 1] = uids[level-1, slot+1]
+            levels[slot] = level
+            uids[level, slot] = uid
+            slot_of[uid] = slot
+            level_of[uid] = level
+            available[slot] = False
+            num_available -= 1
+            placed_slots[num_placed] = slot
+            num_placed += 1
+            model_particles[uid, 0] = slot_x[slot]
+            model_particles[uid, 2] = elevations[level]
+            for c in range(2):
+                affected[num_affected] = int(model_supp[uid, c])
+                num_affected += 1
+        for p in range(num_placed):
+            _refresh(levels, available, placed_slots[p] - 1, level_limit)
+            _refresh(levels, available, placed_slots[p] + 1, level_limit)
+
+        # Record crossings
+        for i in range(num_events):
+            final_x = model_particles[events[i], 0]
+            if final_x == -1:
+                flux[iteration, num_subregions - 1] += 1
+                continue
+            begin = np.searchsorted(left_boundaries, initial_x[i], side='right') - 1
+            end = np.searchsorted(right_boundaries, final_x, side='right')
+            for j in range(begin, end):
+                flux[iteration, j] += 1
+
+        # Update states of the particles that moved or had supports change
+        for a in range(num_affected):
+            uid = affected[a]
+            if uid < 0:
+                continue
+            slot = slot_of[uid]
+            if slot == -1:
+                model_particles[uid, 4] = 1
+            elif levels[slot-1] < level_of[uid] and levels[slot+1] < level_of[uid]:
+                model_particles[uid, 4] = 1
+            else:
+                model_particles[uid, 4] = 0
+
+        # Increment ages and record age statistics
+        total_age = 0.0
+        min_age = np.inf
+        max_age = -np.inf
+        for uid in range(n):
+            if selected[uid]:
+                model_particles[uid, 5] = 0
+                selected[uid] = False
+            else:
+                model_particles[uid, 5] += 1
+            age = model_particles[uid, 5]
+            total_age += age
+            min_age = min(min_age, age)
+            max_age = max(max_age, age)
+        avg_age[iteration] = total_age / n
+        age_range[iteration] = max_age - min_age
+
+        if record:
+            for i in range(num_events):
+                log_after[logged+i, 0] = model_particles[events[i], 0]
+                log_after[logged+i, 1] = model_particles[events[i], 2]
+            log_counts[iteration - start] = num_events
+            logged += num_events
+
+    return (events[:num_events].copy(), log_counts, log_ids[:logged, 0].copy(), 
+            log_before[:logged].copy(), log_after[:logged].copy())
+
+
+def replay_events(statistics, start, log_counts, log_ids, log_before, log_after,
+                    model_particles):
+    """ Update statistics for each iteration logged by run_iterations.
+
+    Each update sees the x and y of the iteration's event particles after
+    the iteration; all other values of model_particles are those after
+    the last logged iteration. A particle only moves when it is an event
+    particle, so model_particles is unchanged once every iteration has
+    been replayed.
+
+    Args:
+        statistics: The run's accumulators.StatisticsSet.
+        start: The first logged iteration (int).
+        log_counts, log_ids, log_before, log_after: As returned by 
+            run_iterations.
+        model_particles: An n-7 NumPy array representing the stream's
+            n model particles after the last logged iteration.
+    """
+    offsets = np.concatenate(([0], np.cumsum(log_counts)))
+    for iteration, (begin, end) in enumerate(zip(offsets[:-1], offsets[1:]), start):
+        event_ids = log_ids[begin:end]
+        model_particles[event_ids, 0] = log_after[begin:end, 0]
+        model_particles[event_ids, 2] = log_after[begin:end, 1]
+        statistics.update(iteration, event_ids, log_before[begin:end], model_particles)
+
+
+def subregion_slots(lattice_bed, subregions):
+    """ Find the first and last subregion containing each slot.
+
+    Args:
+        lattice_bed: A LatticeBed.
+        subregions: A SubregionTable.
+
+    Returns:
+        first: NumPy int array of the first subregion containing each slot.
+        last: NumPy int array of the last subregion containing each slot.
+    """
+    first = np.searchsorted(subregions.right_boundaries, lattice_bed.slot_x, side='left')
+    last = np.searchsorted(subregions.left_boundaries, lattice_bed.slot_x, side='right') - 1
+    return first, last
@@ -0,0 +1,124 @@
+"""
+This module contains a compact, typed storage format for model particles
+and converters to and from the legacy n-7 NumPy arrays used by the logic
+module. It is only a format for the output (see the particle_layout
+parameter of sbelt_runner.run): every engine keeps a run's particles in
+memory as the legacy arrays, so the layout reduces the size of snapshots
+but not the memory used by a run.
+
+In the legacy layout every attribute is stored as a float64 and the
+particle diameter is repeated in every row, while supports are stored
+in a separate n-2 float64 array. The compact layout stores each particle
+as a single NumPy structured record::
+
+    (x, y, uid, active, age, loops, left_supp, right_supp)
+
+with integer uids and supports, a uint8 active flag, unsigned ages and
+loop counts and, optionally, float32 coordinates. The diameter is not
+stored per particle. A compact record is 37 bytes (29 with float32
+coordinates) compared to 72 bytes for a legacy particle and its supports
+in a snapshot.
+
+Attributes:
+    LAYOUTS: Names of the supported particle layouts.
+    NO_SUPPORT: Support value used for particles without supports
+        (ghost particles), stored as NaN in the legacy layout.
+"""
+import numpy as np
+
+LAYOUTS = ['legacy', 'compact', 'compact32']
+NO_SUPPORT = np.iinfo(np.int32).min
+
+
+def particle_dtype(float32=False):
+    """ Returns the structured NumPy dtype of a compact particle.
+
+    Args:
+        float32: Boolean flag indicating whether x and y are stored as
+            float32 (True) or float64 (False).
+    """
+    coord = np.float32 if float32 else np.float64
+    return np.dtype([('x', coord),
+                     ('y', coord),
+                     ('uid', np.int32),
+                     ('active', np.uint8),
+                     ('age', np.uint32),
+                     ('loops', np.uint32),
+                     ('left_supp', np.int32),
+                     ('right_supp', np.int32)])
+
+
+def to_compact(model_particles, model_supp, float32=False):
+    """ Convert legacy particle arrays to the compact layout.
+
+    Args:
+        model_particles: An n-7 NumPy array representing the stream's
+            n model particles.
+        model_supp: An n-2 NumPy array with the uids of the two
+            particles supporting each model particle.
+        float32: Boolean flag indicating whether to store x and y as float32.
+
+    Returns:
+        compact: A NumPy structured array of n compact particles.
+    """
+    compact = np.empty(len(model_particles), dtype=particle_dtype(float32))
+    compact['x'] = model_particles[:,0]
+    compact['y'] = model_particles[:,2]
+    compact['uid'] = model_particles[:,3]
+    compact['active'] = model_particles[:,4]
+    compact['age'] = model_particles[:,5]
+    compact['loops'] = model_particles[:,6]
+    for field, column in (('left_supp', 0), ('right_supp', 1)):
+        supports = model_supp[:,column]
+        compact[field] = np.where(np.isnan(supports), NO_SUPPORT, np.nan_to_num(supports))
+    return compact
+
+
+def to_legacy(compact, particle_diam):
+    """ Convert compact particles to the legacy particle arrays.
+
+    Args:
+        compact: A NumPy structured array of n compact particles.
+        particle_diam: The diameter of all particles (float).
+
+    Returns:
+        model_particles: An n-7 NumPy array representing the n model particles.
+        model_supp: An n-2 NumPy array with the uids of the two
+            particles supporting each model particle.
+    """
+    model_particles = np.zeros((len(compact), 7), dtype=float)
+    model_particles[:,0] = compact['x']
+    model_particles[:,1] = particle_diam
+    model_particles[:,2] = compact['y']
+    model_particles[:,3] = compact['uid']
+    model_particles[:,4] = compact['active']
+    model_particles[:,5] = compact['age']
+    model_particles[:,6] = compact['loops']
+
+    model_supp = np.zeros((len(compact), 2), dtype=float)
+    for field, column in (('left_supp', 0), ('right_supp', 1)):
+        supports = compact[field].astype(float)
+        supports[compact[field] == NO_SUPPORT] = np.nan
+        model_supp[:,column] = supports
+    return model_particles, model_supp
+
+
+def pack(model_particles, model_supp, layout, float32=False):
+    """ Convert legacy particle arrays to the given layout for storage.
+
+    Args:
+        model_particles: An n-7 NumPy array representing the stream's
+            n model particles.
+        model_supp: An n-2 NumPy array with the uids of the two
+            particles supporting each model particle.
+        layout: One of LAYOUTS.
+        float32: Boolean flag indicating whether to store floats as
+            float32 (always the case for compact32).
+
+    Returns:
+        particles: model_particles (as float32 if float32) for the legacy
+            layout, otherwise a NumPy structured array of compact particles.
+    """
+    if layout == 'legacy':
+        return model_particles.astype(np.float32) if float32 else model_particles
+    return to_compact(model_particles, model_supp, float32=(float32 or layout == 'compact32'))
@@ -203,4 +203,46 @@ def crossing_info_age(particle_crossing_list, particle_age_list, n_iterations, s
         plt.show()
     else:
         fi_path = out_location + out_name + '.png'
-        fig.savefig(fi_path, format='png', dpi=600)
\ No newline at end of file
+        fig.savefig(fi_path, format='png', dpi=600)
+
+def scaling(values, phase_values, fits, parameter, quantity='Time per call (s)', fig_size=[8, 7], out_location=None, out_name=None):
+    """ Log-log plot of the cost of each phase against a parameter, with
+    each phase's fitted power law. See the scaling module.
+
+    Args:
+        values: array of the values of the parameter
+        phase_values: dictionary of each phase's measured cost at each value, by phase name
+        fits: dictionary of each phase's fitted (exponent, coefficient), by phase name
+        parameter: name of the parameter (x axis label)
+        quantity: name of the measured cost (y axis label)
+        fig_size: x and y dimension of figure in inches
+        out_location: save location. Default=None will print plot to screen
+            but will not save.
+        out_name: filename (ignored if out_location not set) 
+    """
+    if out_location is not None:
+        if out_name is None:
+            raise ValueError('The out_name argument must be set if saving file.')
+
+    fig = plt.figure(figsize=(fig_size[0], fig_size[1]))
+    ax = fig.add_subplot(1, 1, 1)
+    ax.set_xscale('log')
+    ax.set_yscale('log')
+    values = np.asarray(values, dtype=float)
+    for phase, measured in phase_values.items():
+        exponent, coefficient = fits[phase]
+        line, = ax.plot(values, measured, marker='o', lw=0, fillstyle='none')
+        if np.isfinite(exponent):
+            ax.plot(values, coefficient * values**exponent, color=line.get_color(), 
+                        label=f'{phase} (exponent {exponent:.2f})')
+    plt.title(f'Scaling with {parameter}', fontsize=10, style='italic')
+    plt.xlabel(parameter)
+    plt.ylabel(quantity)
+    plt.legend(loc='upper left', frameon=0, fontsize=8)
+    if out_location is None:
+        plt.show()
+    else:
+        fi_path = out_location + out_name + '.png'
+        fig.savefig(fi_path, format='png', dpi=600)
+        plt.close(fig)
+    return
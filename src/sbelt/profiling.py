@@ -0,0 +1,259 @@
+"""
+This module contains the profilers of a run. When profiling is enabled
+a window of iterations (profile_start to profile_stop) is profiled with
+either cProfile ('cprofile'), which records every function call, or a
+sampling profiler ('sampling'), which records the call stack of the run
+every SAMPLE_INTERVAL seconds from a background thread and slows the run
+down much less. The profile is written next to the run's output, as a
+pstats file ({out_name}.pstats, see the pstats module) or as collapsed
+stacks ({out_name}.collapsed, one 'frame;frame;... samples' line per
+stack, as read by flame graph tools). A resumed run (see
+sbelt_runner.resume) keeps the profile written before, unless some of the
+resumed iterations are in the window, which are then profiled instead.
+
+While the window runs, the peak memory allocated in each phase of the
+iterations (see the timing module) is also measured with tracemalloc and
+written to final_metrics/profile. Allocations made inside the numba
+engine's compiled kernel are not seen by tracemalloc.
+
+Profiling slows the profiled iterations down, so their phase times (see
+the timing module) include the profilers' overhead.
+
+Attributes:
+    PROFILERS: The profiling modes of a run.
+    SAMPLE_INTERVAL: Seconds between samples of the sampling profiler.
+        Samples are only taken when the run releases the GIL, at least
+        every sys.getswitchinterval() seconds.
+    PSTATS_NAME: Format of the pstats file name.
+    COLLAPSED_NAME: Format of the collapsed stacks file name.
+"""
+import collections
+import cProfile
+import os
+import sys
+import threading
+import tracemalloc
+
+import numpy as np
+
+from sbelt import timing
+
+PROFILERS = ['off', 'cprofile', 'sampling']
+SAMPLE_INTERVAL = 0.005
+PSTATS_NAME = '{out_name}.pstats'
+COLLAPSED_NAME = '{out_name}.collapsed'
+
+
+def collapse(frame):
+    """ Returns the call stack ending at frame as a string of
+    'function (file:line)' frames, outermost first, separated by ';'. """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def reset_peak_memory(owned):
+    """ Start measuring the peak memory allocated from now on.
+
+    If the caller started tracemalloc (owned) its traces are cleared, which
+    resets the traced memory and its peak to 0 on every Python version
+    (tracemalloc.reset_peak needs Python 3.9). Blocks allocated before are
+    forgotten, and freeing them does not lower the traced memory. Traces
+    started by someone else are kept: the peak is reset where Python allows
+    it, so on Python 3.8 the peak measured can include earlier allocations.
+
+    Returns:
+        baseline: The traced memory (bytes) to subtract from tracemalloc's
+            peak to get the peak allocated since the call.
+    """
+    if owned:
+        tracemalloc.clear_traces()
+        return 0
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    return tracemalloc.get_traced_memory()[0]
+
+
+class SamplingProfiler():
+    """ Samples the call stack of the thread which enabled it from a
+    background thread.
+
+    Attributes:
+        interval: Seconds between samples (float).
+        stacks: A collections.Counter of the samples of each collapsed stack.
+    """
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._thread = None
+
+    def enable(self):
+        """Start sampling the calling thread"""
+        self._target = threading.get_ident()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def disable(self):
+        """Stop sampling"""
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is not None:
+                self.stacks[collapse(frame)] += 1
+
+    def dump_stats(self, path):
+        """Write the samples as collapsed stacks, most sampled first"""
+        with open(path, 'w') as f:
+            for stack, samples in self.stacks.most_common():
+                f.write(f'{stack} {samples}\n')
+
+
+class ProfilingTimer():
+    """ Profiles a window of iterations and measures the peak memory
+    allocated in each of their phases.
+
+    It takes the place of the run's phase timer: start, lap, finish and
+    timed are passed on to the timer and also drive the profiler, so
+    memory is measured per phase where the timer times them. The timer's
+    other methods are passed on unchanged.
+
+    Attributes:
+        timer: The run's phase timer (timing.PhaseTimer or timing.NULL_TIMER).
+        profile: The profiling mode, one of PROFILERS except 'off'.
+        phases: A Python list of the phase names.
+        start_iteration: The first profiled iteration (int).
+        stop_iteration: The iteration profiling stops before (int).
+        iterations: The number of iterations profiled so far (int).
+        peak_bytes: A NumPy array of the largest peak memory, in bytes,
+            allocated by each phase in an iteration.
+        mean_peak_bytes: A NumPy array of the mean of each phase's peak memory.
+    """
+    def __init__(self, timer, profile, engine, start_iteration, stop_iteration):
+        self.timer = timer
+        self.profile = profile
+        self.phases = timing.NUMBA_PHASES if engine == 'numba' else timing.PHASES
+        self.start_iteration = start_iteration
+        self.stop_iteration = stop_iteration
+        self.iterations = 0
+        self._profiler = cProfile.Profile() if profile == 'cprofile' else SamplingProfiler()
+        self._columns = {phase: column for column, phase in enumerate(self.phases)}
+        self._peaks = [0] * len(self.phases)
+        self._sums = [0] * len(self.phases)
+        self._calls = [0] * len(self.phases)
+        self._active = False
+        self._tracing = False
+        self._iteration = 0
+        self._baseline = 0
+
+    def __bool__(self):
+        return bool(self.timer)
+
+    @property
+    def peak_bytes(self):
+        return np.array(self._peaks, dtype=np.int64)
+
+    @property
+    def mean_peak_bytes(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(np.array(self._calls) > 0,
+                                np.array(self._sums) / np.array(self._calls), np.nan)
+
+    def start(self, iteration):
+        """Start an iteration (int), starting the profiler if it opens the window"""
+        self._iteration = iteration
+        if not self._active and self.start_iteration <= iteration < self.stop_iteration:
+            self._enable()
+        if self._active:
+            self._baseline = reset_peak_memory(not self._tracing)
+        self.timer.start(iteration)
+
+    def lap(self, phase):
+        """End a phase, recording its peak memory while profiling"""
+        self.timer.lap(phase)
+        if self._active:
+            self._record(self._columns[phase])
+
+    def finish(self, count=1):
+        """ Finish the iteration started last, which stands for count
+        iterations. The profiler stops if they close the window. """
+        self.timer.finish(count)
+        if self._active:
+            self.iterations += count
+            if self._iteration + count >= self.stop_iteration:
+                self.close()
+
+    def timed(self, phase, function, *args):
+        """Call function(*args) as timing.PhaseTimer.timed does, recording its peak memory"""
+        if not self._active:
+            return self.timer.timed(phase, function, *args)
+        self._baseline = reset_peak_memory(not self._tracing)
+        result = self.timer.timed(phase, function, *args)
+        self._record(self._columns[phase])
+        return result
+
+    def _record(self, column):
+        peak = tracemalloc.get_traced_memory()[1] - self._baseline
+        self._peaks[column] = max(self._peaks[column], peak)
+        self._sums[column] += peak
+        self._calls[column] += 1
+        self._baseline = reset_peak_memory(not self._tracing)
+
+    def _enable(self):
+        self._tracing = tracemalloc.is_tracing()
+        if not self._tracing:
+            tracemalloc.start()
+        self._profiler.enable()
+        self._active = True
+
+    def close(self):
+        """Stop profiling. Called when the window closes and when the run ends, even if it failed"""
+        if self._active:
+            self._profiler.disable()
+            if not self._tracing:
+                tracemalloc.stop()
+            self._active = False
+
+    def write_profile(self, grp, out_path, out_name):
+        """ Write the profile next to the run's output and the peak memory
+        of each phase to an h5py Group. Returns the profile's location. """
+        name = PSTATS_NAME if self.profile == 'cprofile' else COLLAPSED_NAME
+        path = os.path.join(out_path, name.format(out_name=out_name))
+        self._profiler.dump_stats(path)
+        grp.attrs['profile'] = self.profile
+        grp.attrs['file'] = os.path.basename(path)
+        grp['phases'] = np.array(self.phases, dtype='S')
+        grp['peak_bytes'] = self.peak_bytes
+        grp['mean_peak_bytes'] = self.mean_peak_bytes
+        grp['window'] = [self.start_iteration, self.stop_iteration]
+        grp['iterations'] = self.iterations
+        return path
+
+    def format_memory(self):
+        """Returns the peak memory of each phase as a table (string)"""
+        lines = [f'{"phase":<16} {"peak (KiB)":>12} {"mean (KiB)":>12}']
+        for column, phase in enumerate(self.phases):
+            if self._calls[column]:
+                lines.append(f'{phase:<16} {self._peaks[column] / 1024:>12.1f} '
+                                f'{self._sums[column] / self._calls[column] / 1024:>12.1f}')
+        return '\n'.join(lines)
+
+    def get_state(self):
+        return self.timer.get_state()
+
+    def set_state(self, state):
+        self.timer.set_state(state)
+
+    def write(self, grp):
+        self.timer.write(grp)
+
+    def format_summary(self):
+        return self.timer.format_summary()
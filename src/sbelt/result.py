@@ -0,0 +1,305 @@
+"""
+This module contains SbeltResult, a lazy reader of the output of a run.
+
+Opening a result only opens the HDF5 file; parameters, flux and age
+information and snapshots are read when first accessed. Snapshots are
+read a chunk at a time (a v2 model chunk, a delta keyframe and its
+changes or a v1 iteration group) and decoded chunks are kept in a least
+recently used cache bounded in bytes, so slicing snapshots by
+iteration or reading one particle's history over a range of iterations
+only decodes the chunks holding them, and repeated access is served
+from memory. Any storage or particle layout can be read.
+
+Examples:
+    Read a run's output::
+
+        with result.SbeltResult('sbelt-out.hdf5') as run:
+            bed_length = run.params['bed_length']
+            flux = run.flux['subregion-0']
+            model = run.model(500)
+            models = run.models(start=1000, stop=2000)
+            iterations, ages = run.column('age', uids=[3, 4])
+
+Attributes:
+    CACHE_BYTES: Default size limit of the chunk cache in bytes.
+    LEGACY_COLUMNS: Column of each attribute in the legacy particle layout.
+"""
+import collections
+
+import h5py
+import numpy as np
+
+from sbelt import particles
+from sbelt import storage
+
+CACHE_BYTES = 2**28
+LEGACY_COLUMNS = {'x': 0, 'diam': 1, 'y': 2, 'uid': 3, 'active': 4, 'age': 5, 'loops': 6}
+
+
+class ChunkCache():
+    """ A least recently used cache of decoded chunks, limited in size.
+
+    A chunk is a NumPy array or a dictionary of them. The most recently
+    used chunk is always kept, even if it is larger than the limit.
+
+    Attributes:
+        max_bytes: The size limit of the cache in bytes (int).
+        nbytes: The size of the cached chunks in bytes (int).
+        hits: The number of lookups served from the cache (int).
+        misses: The number of lookups which loaded a chunk (int).
+    """
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._chunks = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._chunks)
+
+    def get(self, key, load):
+        """ Returns the chunk of a key, calling load() to read it if not cached. """
+        if key in self._chunks:
+            self._chunks.move_to_end(key)
+            self.hits += 1
+            return self._chunks[key]
+        self.misses += 1
+        chunk = load()
+        self._chunks[key] = chunk
+        self.nbytes += _nbytes(chunk)
+        while self.nbytes > self.max_bytes and len(self._chunks) > 1:
+            _, evicted = self._chunks.popitem(last=False)
+            self.nbytes -= _nbytes(evicted)
+        return chunk
+
+    def clear(self):
+        """Remove all cached chunks"""
+        self._chunks.clear()
+        self.nbytes = 0
+
+
+def _nbytes(chunk):
+    if isinstance(chunk, dict):
+        return sum(value.nbytes for value in chunk.values() if isinstance(value, np.ndarray))
+    return chunk.nbytes
+
+
+class SbeltResult():
+    """ Lazy, read-only access to the output file of a run.
+
+    Model particle arrays are returned as stored (see particles.pack),
+    except by model_particles which always returns legacy arrays.
+
+    Attributes:
+        path: The path of the output file (string).
+        cache: The ChunkCache of decoded snapshot chunks.
+    """
+    def __init__(self, path, cache_bytes=CACHE_BYTES):
+        self.path = path
+        self.cache = ChunkCache(cache_bytes)
+        self._f = None
+        self._params = None
+        self._iterations = None
+        self._event_offsets = None
+        self._keyframe_snapshot = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.iterations)
+
+    @property
+    def file(self):
+        """The open h5py File, opened on first use"""
+        if self._f is None:
+            self._f = h5py.File(self.path, 'r')
+        return self._f
+
+    def close(self):
+        """Close the file and empty the cache"""
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+        self.cache.clear()
+
+    @property
+    def params(self):
+        """A dictionary of the run's parameters"""
+        if self._params is None:
+            self._params = storage.read_params(self.file)
+        return self._params
+
+    @property
+    def bed(self):
+        """An m-7 NumPy array of the run's bed particles"""
+        return self.file['initial_values/bed'][()]
+
+    @property
+    def initial_model(self):
+        """The model particles before the first iteration, as stored"""
+        return self.file['initial_values/model'][()]
+
+    @property
+    def flux(self):
+        """A dictionary of each subregion's flux list, by subregion name"""
+        grp = self.file['final_metrics/subregions']
+        names = sorted(grp, key=lambda name: int(name.split('-')[1]))
+        return {name[:-len('-flux')]: grp[name][()] for name in names}
+
+    @property
+    def avg_age(self):
+        """A NumPy array of the average particle age of each iteration"""
+        return self.file['final_metrics/avg_age'][()]
+
+    @property
+    def age_range(self):
+        """A NumPy array of the particle age range of each iteration"""
+        return self.file['final_metrics/age_range'][()]
+
+    @property
+    def iterations(self):
+        """A NumPy array of the iterations with a snapshot"""
+        if self._iterations is None:
+            self._iterations = storage.snapshot_iterations(self.file)
+        return self._iterations
+
+    def model(self, iteration):
+        """ Returns the model particles of an iteration, as stored.
+
+        Raises:
+            KeyError: if there is no snapshot of the iteration.
+        """
+        index = self._index(iteration)
+        for _, model in self._models(index, index + 1):
+            return model.copy()
+
+    def model_particles(self, iteration):
+        """ Returns the model particles of an iteration as a legacy n-7 array.
+
+        Raises:
+            KeyError: if there is no snapshot of the iteration.
+        """
+        model = self.model(iteration)
+        if model.dtype.names:
+            model, _ = particles.to_legacy(model, self.params['particle_diam'])
+        return model
+
+    def event_ids(self, iteration):
+        """ Returns the uids of the event particles of an iteration.
+
+        Raises:
+            KeyError: if there is no snapshot of the iteration.
+        """
+        index = self._index(iteration)
+        if 'snapshots' not in self.file:
+            return self.file[f'iteration_{iteration}/event_ids'][()]
+        start, stop = self._offsets()[index:index + 2]
+        return self.file['snapshots/event_ids'][start:stop]
+
+    def models(self, start=None, stop=None):
+        """ Returns the model particles of all snapshots in a range of iterations.
+
+        Args:
+            start: The first iteration of the range (int). Defaults to the first snapshot.
+            stop: The end of the range, exclusive (int). Defaults to after the last snapshot.
+
+        Returns:
+            models: A NumPy array with the model particles of each snapshot,
+                as stored, stacked along the first axis.
+        """
+        first, last = self._range(start, stop)
+        return np.array([model.copy() for _, model in self._models(first, last)])
+
+    def snapshots(self, start=None, stop=None):
+        """ Iterate over the snapshots in a range of iterations (see models).
+
+        Yields:
+            iteration: The iteration of the snapshot (int).
+            model: A NumPy array of the model particles as stored.
+            event_ids: A NumPy array of the uids of the iteration's event particles.
+        """
+        first, last = self._range(start, stop)
+        for index, model in self._models(first, last):
+            iteration = int(self.iterations[index])
+            yield iteration, model.copy(), self.event_ids(iteration)
+
+    def column(self, column, uids=None, start=None, stop=None):
+        """ Returns one attribute of some particles over a range of iterations.
+
+        Args:
+            column: The attribute: a name in LEGACY_COLUMNS or a legacy
+                column index for the legacy layout, a field name for
+                the compact layouts.
+            uids: Optional sequence of particle uids. Defaults to all particles.
+            start: The first iteration of the range (int). Defaults to the first snapshot.
+            stop: The end of the range, exclusive (int). Defaults to after the last snapshot.
+
+        Returns:
+            iterations: A NumPy array of the iterations of the snapshots in the range.
+            values: A NumPy array of the attribute with a row per snapshot
+                and a column per uid.
+        """
+        first, last = self._range(start, stop)
+        rows = slice(None) if uids is None else np.asarray(uids, dtype=int)
+        values = []
+        for _, model in self._models(first, last):
+            if model.dtype.names:
+                values.append(model[column][rows])
+            else:
+                values.append(model[rows, LEGACY_COLUMNS.get(column, column)])
+        return self.iterations[first:last], np.array(values)
+
+    def _index(self, iteration):
+        index = int(np.searchsorted(self.iterations, iteration))
+        if index == len(self.iterations) or self.iterations[index] != iteration:
+            raise KeyError(f'No snapshot of iteration {iteration}')
+        return index
+
+    def _range(self, start, stop):
+        first = 0 if start is None else int(np.searchsorted(self.iterations, start))
+        last = len(self.iterations) if stop is None else int(np.searchsorted(self.iterations, stop))
+        return first, max(first, last)
+
+    def _offsets(self):
+        if self._event_offsets is None:
+            self._event_offsets = self.file['snapshots/event_offsets'][()]
+        return self._event_offsets
+
+    def _models(self, first, stop):
+        """ Yield the index and model of snapshots first to stop-1 from cached
+        chunks. The yielded arrays belong to the cache or a replay, copy them. """
+        if 'snapshots' not in self.file:
+            for index in range(first, stop):
+                iteration = self.iterations[index]
+                yield index, self.cache.get(('v1', index),
+                                lambda: self.file[f'iteration_{iteration}/model'][()])
+            return
+
+        grp = self.file['snapshots']
+        if 'keyframes' not in grp:
+            dataset = grp['model']
+            size = dataset.chunks[0]
+            for index in range(first, stop):
+                chunk = index // size
+                block = self.cache.get(('v2', chunk),
+                                        lambda: dataset[chunk * size:(chunk + 1) * size])
+                yield index, block[index - chunk * size]
+            return
+
+        if self._keyframe_snapshot is None:
+            self._keyframe_snapshot = grp['keyframe_snapshot'][()]
+        keyframe = int(np.searchsorted(self._keyframe_snapshot, first, side='right')) - 1
+        index = first
+        while index < stop:
+            segment = self.cache.get(('delta', keyframe),
+                                        lambda: storage.read_segment(grp, keyframe))
+            for index, model in storage.replay_segment(segment, min(stop, segment['stop'])):
+                if index >= first:
+                    yield index, model
+            index = segment['stop']
+            keyframe += 1
@@ -18,6 +18,8 @@ Attributes:
     ITERATION_HEADER: String used to delineate iterations in INFO-level logs
     ENTRAINMENT_HEADER: String used to idenitfy event particle being
                             entrained each iteration in INFO-level logs
+    NUMBA_FALLBACK: String used to warn that the numba engine was requested
+                            but Numba could not be imported
 
 Todo:
     * setuptools console_scripts and '$ python sbelt_runner.py' executions 
@@ -26,6 +28,7 @@ Todo:
         users using sbelt from source code can pass desired arguments to
         the run call in the ``if __name_ == '__main__' function.``.
 """
+import inspect
 import numpy as np
 import h5py
 import logging
@@ -33,15 +36,30 @@ from tqdm import tqdm
 
 from sbelt import utils
 from sbelt import logic
+from sbelt import lattice
+from sbelt import particles
+from sbelt import numba_engine
+from sbelt import streams
+from sbelt import checkpoint
+from sbelt import storage
+from sbelt import accumulators
+from sbelt import timing
+from sbelt import profiling
 
 ITERATION_HEADER = ('Beginning iteration {iteration}...')
 ENTRAINMENT_HEADER = ('Entraining particles {event_particles}')
+NUMBA_FALLBACK = ('Numba is not installed, falling back to the lattice engine.')
 logging.getLogger(__name__)
 
 def run(iterations=1000, bed_length=100, particle_diam=0.5, particle_pack_dens = 0.78, \
                 num_subregions=4, level_limit=3, poiss_lambda=5, gauss=False, gauss_mu=1, \
                 gauss_sigma=0.25, data_save_interval=1, height_dependant_entr=False, \
-                out_path='.', out_name='sbelt-out'): 
+                out_path='.', out_name='sbelt-out', engine='reference', debug=False, \
+                particle_layout='legacy', seed=None, checkpoint_interval=0, \
+                storage_layout='v1', keyframe_interval=100, background_writer=False, \
+                writer_queue_size=16, compression='gzip', compression_level=4, shuffle=False, \
+                float_precision='float64', snapshot_chunk_bytes=1048576, flux_chunk_size=0, \
+                statistics='', timing='off', profile='off', profile_start=0, profile_stop=0): 
     """ Execute an sbelt run. 
 
     This function is responsible for calling appropriate logic
@@ -79,6 +97,66 @@ def run(iterations=1000, bed_length=100, particle_diam=0.5, particle_pack_dens =
             automatically entrains particles that are on the level limit.
         out_path: A string representing the relative location to save the output.
         out_name: A string representing the name of the output file.
+        engine: A string representing which state engine to use. 'reference' 
+            uses the float-based search functions in the logic module, 'lattice'
+            uses the integer height-map in the lattice module. The lattice engine 
+            follows the same rules but samples event particles from its own index,
+            so it matches the reference engine in distribution, not run-for-run.
+            'numba' runs the lattice rules in a compiled kernel (see the 
+            numba_engine module), matching the other engines in distribution but 
+            not run-for-run. Falls back to 'lattice' if Numba is not installed.
+        debug: A boolean flag indicating whether to check, every iteration, that
+            each model particle's uid is its row index. Always checked once at build.
+        particle_layout: A string representing how model particle arrays are 
+            stored in the output. 'legacy' stores n-7 float arrays, 'compact' 
+            and 'compact32' store typed records (including supports) with float64
+            and float32 coordinates respectively. Only the output is affected, runs
+            keep the n-7 arrays in memory. See the particles module.
+        seed: A non-negative int used to seed the run's random number generator
+            (numpy.random.Generator). If None, a seed is drawn from NumPy's global
+            random state. The seed is recorded in the output's params group.
+        checkpoint_interval: An int representing how often to checkpoint the run
+            (e.g 1000=every 1000 iterations). A checkpoint is also written when the 
+            run finishes. See resume. 0 disables checkpoints.
+        storage_layout: A string representing how snapshots are stored. 'v1' 
+            writes an iteration_{i} group per snapshot, 'v2' appends snapshots
+            to chunked datasets in the snapshots group and 'delta' stores only
+            the particles that changed between snapshots, with a full keyframe
+            every keyframe_interval iterations. See the storage module.
+        keyframe_interval: An int representing how often the 'delta' storage 
+            layout stores a keyframe (e.g 100=every 100 iterations).
+        background_writer: A boolean flag indicating whether snapshots are 
+            compressed and written by a background thread while the next 
+            iterations run. See storage.BackgroundWriter.
+        writer_queue_size: An int representing how many snapshots the background
+            writer can queue before iterations wait for it to catch up.
+        compression: A string representing the codec used to compress snapshots 
+            and flux and age information. One of 'none', 'lzf' or 'gzip'.
+        compression_level: An int (0-9) representing the gzip compression level.
+        shuffle: A boolean flag indicating whether to apply HDF5's shuffle filter
+            before compressing.
+        float_precision: A string representing the precision of the floats in 
+            snapshots and age information. One of 'float64' or 'float32'.
+        snapshot_chunk_bytes: An int representing the target size, in bytes, of
+            a chunk of the 'v2' and 'delta' snapshot datasets.
+        flux_chunk_size: An int representing the number of iterations per chunk
+            of the flux and age datasets. 0 lets h5py choose.
+        statistics: A string of comma separated names of streaming statistics
+            to compute (e.g 'age,hops'). Statistics are updated every iteration
+            and written to final_metrics/statistics. See the accumulators module.
+        timing: A string representing whether to time the phases of each iteration
+            (event selection, moves, flux, snapshot writes, ...). 'off' does not
+            time them, 'summary' writes the totals and percentiles of each phase
+            to final_metrics/timing and prints them at the end, 'full' also writes
+            the time of each phase in each iteration. See the timing module.
+        profile: A string representing how to profile a window of iterations. 'off'
+            does not profile them, 'cprofile' records every function call and 
+            writes {out_name}.pstats, 'sampling' samples the call stack and writes
+            {out_name}.collapsed, next to the output file. Either also writes the
+            peak memory of each phase to final_metrics/profile. See the profiling module.
+        profile_start: An int representing the first iteration to profile.
+        profile_stop: An int representing the iteration to stop profiling before. 
+            0 profiles until the end of the run.
     """ 
     #############################################################################
     # validate parameters
@@ -86,6 +164,17 @@ def run(iterations=1000, bed_length=100, particle_diam=0.5, particle_pack_dens =
     
     parameters = locals()
     utils.validate_arguments(parameters)
+    accumulators.parse_names(statistics)
+    if engine == 'numba' and not numba_engine.NUMBA_AVAILABLE:
+        logging.warning(NUMBA_FALLBACK)
+        print(NUMBA_FALLBACK)
+        engine = 'lattice'
+    if seed is None:
+        # Drawing from the global state keeps np.random.seed reproducible
+        seed = int(np.random.randint(np.iinfo(np.int32).max))
+        parameters['seed'] = seed
+    rng = np.random.default_rng(seed)
+    random_streams = streams.RandomStreams(seed, poiss_lambda, gauss_mu, gauss_sigma, gauss)
 
     #############################################################################
     #  Create model data and data structures
@@ -93,14 +182,9 @@ def run(iterations=1000, bed_length=100, particle_diam=0.5, particle_pack_dens =
     #############################################################################
 
     print(f'Building Bed and Model particle arrays...')
-    # Pre-compute d and h values for particle elevation placement
-        # see d and h here: https://math.stackexchange.com/questions/2293201/
-    d = np.divide(np.multiply(np.divide(particle_diam, 2), 
-                                        particle_diam), 
-                                        particle_diam)
-    h = np.sqrt(np.square(particle_diam) - np.square(d))
+    h = compute_h(particle_diam)
     # Build the required structures for entrainment events
-    bed_particles, model_particles, model_supp, subregions = build_stream(parameters, h)
+    bed_particles, model_particles, model_supp, subregions = build_stream(parameters, h, rng)
     print(f'Bed and Model particles built.')
 
     #############################################################################
@@ -109,7 +193,6 @@ def run(iterations=1000, bed_length=100, particle_diam=0.5, particle_pack_dens =
 
     particle_age_array = np.ones(iterations)*(-1) # -1 represents an untouched element
     particle_range_array = np.ones(iterations)*(-1)
-    snapshot_counter = 0
 
     #############################################################################
 
@@ -121,86 +204,408 @@ def run(iterations=1000, bed_length=100, particle_diam=0.5, particle_pack_dens =
         grp_p = f.create_group(f'params')
         for key, value in parameters.items():
             grp_p[key] = value
+        storage.write_storage_attrs(f, parameters)
 
         grp_iv = f.create_group(f'initial_values')
         grp_iv.create_dataset('bed', data=bed_particles)
-        grp_iv.create_dataset('model', data=model_particles)
+        grp_iv.create_dataset('model', data=particles.pack(model_particles, model_supp, 
+                                                            particle_layout))
 
-        #############################################################################
-        #  Entrainment iterations
-        #############################################################################
-        
-        print(f'Model and event particle arrays will be written to {hdf5_path} every {data_save_interval} iteration(s).')
-        print(f'Beginning entrainments...')
-        for iteration in tqdm(range(iterations)):
-            logging.info(ITERATION_HEADER.format(iteration=iteration))
-            snapshot_counter += 1
-
-            # Calculate number of entrainment events iteration
-            e_events = np.random.poisson(parameters['poiss_lambda'], None)
-            # Select n (= e_events) particles, per-subregion, to be entrained
-            event_particle_ids = logic.get_event_particles(e_events, subregions,
-                                                        model_particles, 
-                                                        level_limit, 
-                                                        height_dependant_entr)
-            logging.info(ENTRAINMENT_HEADER.format(event_particles=event_particle_ids))
-            # Determine hop distances of all event particles
-            unverified_e = logic.compute_hops(event_particle_ids, model_particles, gauss_mu,
-                                                    gauss_sigma, normal=gauss)
-            # Compute available vertices based on current model_particles state
-            avail_vertices = logic.compute_available_vertices(model_particles, 
-                                                        bed_particles,
-                                                        particle_diam,
-                                                        level_limit,
-                                                        lifted_particles=event_particle_ids)
-            # Run entrainment event                    
-            model_particles, model_supp, subregions = entrainment_event(model_particles, 
-                                                                    model_supp,
-                                                                    bed_particles, 
-                                                                    event_particle_ids,
-                                                                    avail_vertices, 
-                                                                    unverified_e,
-                                                                    subregions,
-                                                                    iteration,  
-                                                                    h)
-            # Compute age range and average age, store in np arrays
-            age_range = np.max(model_particles[:,5]) - np.min(model_particles[:,5])
-            particle_range_array[iteration] = age_range
-
-            avg_age = np.average(model_particles[:,5]) 
-            particle_age_array[iteration] = avg_age
-
-            # Record per-iteration information 
-            if (snapshot_counter == data_save_interval):
-                grp_i = f.create_group(f"iteration_{iteration}")
-                grp_i.create_dataset("model", data=model_particles, compression="gzip")
-                grp_i.create_dataset("event_ids", data=event_particle_ids, compression="gzip")
-                snapshot_counter = 0
-
-        #############################################################################
-        # Store flux and age information
-        #############################################################################
-        
-        print(f'Writting flux and age information to file...')
-        grp_final = f.create_group(f'final_metrics')
-        grp_sub = grp_final.create_group(f'subregions')
-        for subregion in subregions:
-            name = f'{subregion.getName()}-flux'
-            flux_list = subregion.getFluxList()
-            grp_sub.create_dataset(name, data=flux_list, compression="gzip")
-
-        grp_final.create_dataset('avg_age', data=particle_age_array, compression="gzip")
-        grp_final.create_dataset('age_range', data=particle_range_array, compression="gzip")
-        print(f'Finished writing flux and age information.')
-
-        print(f'Model run finished successfully.')
+        entrain(f, parameters, engine, h, bed_particles, model_particles, model_supp, 
+                    subregions, particle_age_array, particle_range_array, rng, random_streams)
+    return
+
+
+def resume(out_path='.', out_name='sbelt-out', extra_iterations=0):
+    """ Continue a run from its last checkpoint.
+
+    The run's output file is continued in place: snapshots written after
+    the checkpoint are discarded and the remaining iterations are run
+    with the run's original parameters. The result is identical to that
+    of a run which was never interrupted. Runs only have checkpoints if
+    they were started with checkpoint_interval > 0.
+
+    A finished run can be extended by extra_iterations. The run's 
+    iterations parameter is updated and the flux and age information 
+    is rewritten for the extended run.
+
+    Args:
+        out_path: A string representing the relative location of the run's output.
+        out_name: A string representing the name of the run's output file.
+        extra_iterations: An int indicating how many iterations to add to the run.
+
+    Raises:
+        ValueError: if the run has no checkpoint or extra_iterations is negative.
+    """
+    if not isinstance(extra_iterations, int) or extra_iterations < 0:
+        raise ValueError("extra_iterations must be an int >= 0.")
+    saved = checkpoint.read_checkpoint(checkpoint.checkpoint_path(out_path, out_name))
+
+    with h5py.File(f'{out_path}/{out_name}.hdf5', "a") as f:
+        # Parameters added since the run was written take their default values
+        parameters = {name: param.default for name, param 
+                        in inspect.signature(run).parameters.items()}
+        parameters.update(storage.read_params(f))
+        parameters['iterations'] += extra_iterations
+        parameters['out_path'] = out_path
+        parameters['out_name'] = out_name
+        utils.validate_arguments(parameters)
+        del f['params/iterations']
+        f['params/iterations'] = parameters['iterations']
+        storage.write_storage_attrs(f, parameters)
+
+        engine = parameters['engine']
+        if engine == 'numba' and not numba_engine.NUMBA_AVAILABLE:
+            logging.warning(NUMBA_FALLBACK)
+            print(NUMBA_FALLBACK)
+            engine = 'lattice'
+        random_streams = streams.RandomStreams(parameters['seed'], parameters['poiss_lambda'],
+                                                parameters['gauss_mu'], parameters['gauss_sigma'],
+                                                parameters['gauss'])
+        random_streams.set_state(saved['random_streams'])
+        h = compute_h(parameters['particle_diam'])
+
+        iteration = saved['iteration']
+        subregions = logic.define_subregion_table(parameters['bed_length'], 
+                                                    parameters['num_subregions'], 
+                                                    parameters['iterations'])
+        subregions.flux[:iteration] = saved['flux']
+        particle_age_array = np.ones(parameters['iterations'])*(-1)
+        particle_age_array[:iteration] = saved['avg_age']
+        particle_range_array = np.ones(parameters['iterations'])*(-1)
+        particle_range_array[:iteration] = saved['age_range']
+
+        # Anything written after the checkpoint will be written again
+        storage.snapshot_writer(f, parameters['storage_layout']).truncate(iteration)
+        if 'final_metrics' in f:
+            # The profile is only rewritten if the resumed iterations are profiled
+            for name in list(f['final_metrics']):
+                if name != 'profile':
+                    del f['final_metrics'][name]
+
+        print(f'Resuming {out_name} from iteration {iteration}...')
+        entrain(f, parameters, engine, h, saved['bed_particles'], saved['model_particles'],
+                    saved['model_supp'], subregions, particle_age_array, particle_range_array,
+                    saved['rng'], random_streams, start=iteration, 
+                    snapshot_counter=saved['snapshot_counter'],
+                    statistics_state=saved['statistics'], timing_state=saved['timing'])
     return
 
+
+def entrain(f, parameters, engine, h, bed_particles, model_particles, model_supp, subregions,
+                particle_age_array, particle_range_array, rng, random_streams, start=0,
+                snapshot_counter=0, statistics_state=None, timing_state=None):
+    """ Run the entrainment iterations of a run and store the results.
+
+    Iterations start..iterations-1 are run. Snapshots are written every 
+    data_save_interval iterations, checkpoints every checkpoint_interval
+    iterations (and once the run is finished), and the flux and age
+    information is written at the end.
+
+    Args:
+        f: The run's open, writable h5py File.
+        parameters: A dictionary of the run's parameters (see run).
+        engine: The engine to use. Equal to parameters['engine'] unless the
+            numba engine fell back to the lattice engine.
+        h: Geometric value used in calculations of particle placement.
+        bed_particles: An m-7 NumPy array representing the stream's m bed particles.
+        model_particles: An n-7 NumPy array representing the stream's n model particles.
+        model_supp: An n-2 NumPy array with the uids of the two particles supporting each 
+            model particle.
+        subregions: A SubregionTable of the stream's subregions.
+        particle_age_array: NumPy array of the average particle age of each iteration.
+        particle_range_array: NumPy array of the particle age range of each iteration.
+        rng: The run's numpy.random.Generator.
+        random_streams: The run's streams.RandomStreams.
+        start: The first iteration to run (int).
+        snapshot_counter: Iterations run since the last snapshot (int).
+        statistics_state: Optional state of the run's streaming statistics
+            to continue from (see accumulators.StatisticsSet.get_state).
+        timing_state: Optional state of the run's phase timer to continue from
+            (see timing.PhaseTimer.get_state).
+    """
+    iterations = parameters['iterations']
+    particle_diam = parameters['particle_diam']
+    level_limit = parameters['level_limit']
+    gauss = parameters['gauss']
+    gauss_mu = parameters['gauss_mu']
+    gauss_sigma = parameters['gauss_sigma']
+    data_save_interval = parameters['data_save_interval']
+    checkpoint_interval = parameters['checkpoint_interval']
+    height_dependant_entr = parameters['height_dependant_entr']
+    particle_layout = parameters['particle_layout']
+    float32 = parameters['float_precision'] == 'float32'
+    filters = storage.dataset_filters(parameters['compression'], parameters['compression_level'],
+                                        parameters['shuffle'])
+    debug = parameters['debug']
+    checkpoint_file = checkpoint.checkpoint_path(parameters['out_path'], parameters['out_name'])
+
+    lattice_bed = None
+    if engine in ('lattice', 'numba'):
+        lattice_bed = lattice.LatticeBed(bed_particles, model_particles, particle_diam, 
+                                                        level_limit, h)
+        particle_buckets = lattice.ParticleBuckets(lattice_bed, subregions, model_particles)
+        support_graph = lattice.SupportGraph(model_particles, model_supp, len(bed_particles))
+
+    snapshots = storage.snapshot_writer(f, parameters['storage_layout'], 
+                                            parameters['keyframe_interval'], filters,
+                                            parameters['snapshot_chunk_bytes'])
+    if parameters['background_writer']:
+        snapshots = storage.BackgroundWriter(snapshots, parameters['writer_queue_size'])
+
+    statistics = accumulators.StatisticsSet(parameters['statistics'], parameters, 
+                                                model_particles, subregions, h)
+    if statistics_state:
+        statistics.set_state(statistics_state)
+    timer = timing.phase_timer(parameters['timing'], engine, iterations)
+    if timer and timing_state:
+        timer.set_state(timing_state)
+    profiler = None
+    if parameters['profile'] != 'off':
+        # Phases are profiled where they are timed
+        timer = profiler = profiling.ProfilingTimer(timer, parameters['profile'], engine,
+                                                        parameters['profile_start'],
+                                                        parameters['profile_stop'] or iterations)
+
+    def save_checkpoint(iteration):
+        if engine == 'lattice':
+            # Resumed runs build their buckets in uid order, which decides the draws
+            particle_buckets.rebuild()
+        # Snapshots up to the checkpoint must be on disk before it replaces the last one
+        snapshots.flush()
+        f.flush()
+        checkpoint.write_checkpoint(checkpoint_file, iteration, snapshot_counter, 
+                                        bed_particles, model_particles, model_supp, 
+                                        subregions.flux, particle_age_array, 
+                                        particle_range_array, rng, random_streams,
+                                        statistics.get_state(), 
+                                        timer.get_state() if timer else None)
+
+    #############################################################################
+    #  Entrainment iterations
+    #############################################################################
+    
+    print(f'Model and event particle arrays will be written to {f.filename} every {data_save_interval} iteration(s).')
+    print(f'Beginning entrainments...')
+    try:
+        if engine == 'numba':
+            # Numba keeps its own random state, seeded from the run's for reproducibility.
+            # It is reseeded after every checkpoint so that resumed runs are identical
+            numba_engine.seed(rng.integers(np.iinfo(np.int32).max))
+            first, last = numba_engine.subregion_slots(lattice_bed, subregions)
+            progress = tqdm(total=iterations - start)
+            iteration = start
+            # Run the iterations up to the next snapshot or checkpoint inside the compiled kernel
+            while iteration < iterations:
+                timer.start(iteration)
+                stop = min(iteration + data_save_interval - snapshot_counter, iterations)
+                if checkpoint_interval:
+                    stop = min(stop, (iteration // checkpoint_interval + 1) * checkpoint_interval)
+                event_particle_ids, *log = numba_engine.run_iterations(model_particles, model_supp, 
+                                                lattice_bed.levels, lattice_bed.uids,
+                                                lattice_bed.slot_of, lattice_bed.level_of,
+                                                lattice_bed.available, lattice_bed.slot_x,
+                                                lattice_bed.elevations, 
+                                                subregions.left_boundaries,
+                                                subregions.right_boundaries, first, last,
+                                                subregions.flux, particle_age_array,
+                                                particle_range_array, iteration, stop,
+                                                parameters['poiss_lambda'], gauss_mu, 
+                                                gauss_sigma, gauss, level_limit, 
+                                                height_dependant_entr, bool(statistics))
+                timer.lap('kernel')
+                if statistics:
+                    # The kernel logs every iteration's event particles for the statistics
+                    numba_engine.replay_events(statistics, iteration, *log, model_particles)
+                    timer.lap('statistics')
+                progress.update(stop - iteration)
+                snapshot_counter += stop - iteration
+                block = stop - iteration
+                iteration = stop
+                if debug:
+                    logic.validate_uids(model_particles)
+                    timer.lap('validation')
+                if (snapshot_counter == data_save_interval):
+                    write_snapshot(snapshots, iteration - 1, model_particles, model_supp, 
+                                            event_particle_ids, particle_layout, float32)
+                    snapshot_counter = 0
+                    timer.lap('snapshot')
+                timer.finish(block)
+                if checkpoint_interval and iteration % checkpoint_interval == 0 and iteration < iterations:
+                    timer.timed('checkpoint', save_checkpoint, iteration)
+                    numba_engine.seed(rng.integers(np.iinfo(np.int32).max))
+            progress.close()
+        else:
+            for iteration in tqdm(range(start, iterations)):
+                timer.start(iteration)
+                logging.info(ITERATION_HEADER.format(iteration=iteration))
+                snapshot_counter += 1
+
+                if statistics:
+                    # Selecting event particles puts ghost particles at x=0
+                    ghosts = np.flatnonzero(model_particles[:,0] == -1)
+                    timer.lap('statistics')
+                # Calculate number of entrainment events iteration
+                e_events = random_streams.event_count()
+                # Select n (= e_events) particles, per-subregion, to be entrained
+                if lattice_bed is None:
+                    event_particle_ids = logic.get_event_particles(e_events, subregions,
+                                                                model_particles, 
+                                                                level_limit, 
+                                                                height_dependant_entr,
+                                                                rng)
+                else:
+                    event_particle_ids = particle_buckets.get_event_particles(e_events, subregions,
+                                                                model_particles, 
+                                                                level_limit, 
+                                                                height_dependant_entr,
+                                                                rng)
+                timer.lap('event_selection')
+                logging.info(ENTRAINMENT_HEADER.format(event_particles=event_particle_ids))
+                if statistics:
+                    before = statistics.capture(model_particles, event_particle_ids, ghosts)
+                    timer.lap('statistics')
+                # Determine hop distances of all event particles
+                unverified_e = logic.compute_hops(event_particle_ids, model_particles, gauss_mu,
+                                                        gauss_sigma, normal=gauss, 
+                                                        hops=random_streams.hops(len(event_particle_ids)))
+                timer.lap('hops')
+                if lattice_bed is None:
+                    # Compute available vertices based on current model_particles state
+                    avail_vertices = logic.compute_available_vertices(model_particles, 
+                                                                bed_particles,
+                                                                particle_diam,
+                                                                level_limit,
+                                                                lifted_particles=event_particle_ids)
+                    timer.lap('vertices')
+                    # Run entrainment event                    
+                    model_particles, model_supp, subregions = entrainment_event(model_particles, 
+                                                                            model_supp,
+                                                                            bed_particles, 
+                                                                            event_particle_ids,
+                                                                            avail_vertices, 
+                                                                            unverified_e,
+                                                                            subregions,
+                                                                            iteration,  
+                                                                            h,
+                                                                            rng,
+                                                                            timer)
+                else:
+                    model_particles, model_supp, subregions = lattice_entrainment_event(model_particles,
+                                                                            model_supp,
+                                                                            lattice_bed,
+                                                                            particle_buckets,
+                                                                            support_graph,
+                                                                            event_particle_ids,
+                                                                            unverified_e,
+                                                                            subregions,
+                                                                            iteration,
+                                                                            rng,
+                                                                            timer)
+                if debug:
+                    logic.validate_uids(model_particles)
+                    timer.lap('validation')
+
+                # Compute age range and average age, store in np arrays
+                age_range = np.max(model_particles[:,5]) - np.min(model_particles[:,5])
+                particle_range_array[iteration] = age_range
+
+                avg_age = np.average(model_particles[:,5]) 
+                particle_age_array[iteration] = avg_age
+                timer.lap('ages')
+
+                if statistics:
+                    statistics.update(iteration, event_particle_ids, before, model_particles)
+                    timer.lap('statistics')
+
+                # Record per-iteration information 
+                if (snapshot_counter == data_save_interval):
+                    write_snapshot(snapshots, iteration, model_particles, model_supp, 
+                                                event_particle_ids, particle_layout, float32)
+                    snapshot_counter = 0
+                    timer.lap('snapshot')
+                timer.finish()
+                if checkpoint_interval and (iteration + 1) % checkpoint_interval == 0 and iteration + 1 < iterations:
+                    timer.timed('checkpoint', save_checkpoint, iteration + 1)
+    finally:
+        # Write the snapshots queued so far, even if the run failed
+        snapshots.close()
+        if profiler is not None:
+            profiler.close()
+
+    #############################################################################
+    # Store flux and age information
+    #############################################################################
+    
+    if parameters['background_writer']:
+        timing_msg = (
+            f'Background writer spent {snapshots.write_time:.2f}s writing snapshots, '
+            f'iterations waited {snapshots.wait_time:.2f}s for it.'
+        )
+        logging.info(timing_msg)
+        print(timing_msg)
+    if timer:
+        timing_summary = f'Time spent in each phase of the iterations:\n{timer.format_summary()}'
+        logging.info(timing_summary)
+        print(timing_summary)
+    print(f'Writting flux and age information to file...')
+    grp_final = f.require_group(f'final_metrics')
+    grp_sub = grp_final.create_group(f'subregions')
+    for subregion in subregions:
+        name = f'{subregion.getName()}-flux'
+        flux_list = subregion.getFluxList()
+        storage.write_series(grp_sub, name, flux_list, filters, parameters['flux_chunk_size'])
+
+    float_type = np.float32 if float32 else float
+    for name, data in [('avg_age', particle_age_array), ('age_range', particle_range_array)]:
+        storage.write_series(grp_final, name, data.astype(float_type), filters, 
+                                parameters['flux_chunk_size'])
+    if statistics:
+        statistics.write(grp_final.create_group('statistics'), iterations, model_particles)
+    if timer:
+        timer.write(grp_final.create_group('timing'))
+    if profiler is not None and profiler.iterations:
+        if 'profile' in grp_final:
+            del grp_final['profile']
+        profile_path = profiler.write_profile(grp_final.create_group('profile'), 
+                                                parameters['out_path'], parameters['out_name'])
+        profile_msg = (
+            f'Profile of {profiler.iterations} iteration(s) written to {profile_path}. '
+            f'Peak memory allocated in each phase:\n{profiler.format_memory()}'
+        )
+        logging.info(profile_msg)
+        print(profile_msg)
+    print(f'Finished writing flux and age information.')
+
+    if checkpoint_interval:
+        # The final checkpoint lets a finished run be extended
+        save_checkpoint(iterations)
+
+    print(f'Model run finished successfully.')
+
+
 #############################################################################
 # Helper functions
 #############################################################################
 
-def build_stream(parameters, h):
+def compute_h(particle_diam):
+    """ Pre-compute the h value used for particle elevation placement.
+
+    See d and h here: https://math.stackexchange.com/questions/2293201/
+
+    Args:
+        particle_diam: The diameter of all particles (float).
+
+    Returns:
+        h: The height of a particle's centre above the centres of its supports (float).
+    """
+    d = np.divide(np.multiply(np.divide(particle_diam, 2), 
+                                        particle_diam), 
+                                        particle_diam)
+    return np.sqrt(np.square(particle_diam) - np.square(d))
+
+
+def build_stream(parameters, h, rng=None):
     """ Build the data structures which define a stream.       
 
     Build array of m bed particles and array of n model particles. 
@@ -214,6 +619,8 @@ def build_stream(parameters, h):
             
         h: Geometric value used in calculations of particle placement. See
             in-line and project documentation for further explanation.
+        rng: A numpy.random.Generator to draw from. If None, NumPy's
+            global random state is used.
 
     Returns:
         bed_particles: An m-7 NumPy array representing the stream's m bed
@@ -238,7 +645,7 @@ def build_stream(parameters, h):
         by bed particles with uids -1 and -2. Similarly, the model particle with uid n 
         (model_supp[n]) is supported by bed particles with uids -3 and -4.
 
-        subregions: An array of Subregion objects
+        subregions: A SubregionTable of the stream's subregions
     
     """
     bed_particles = logic.build_streambed(parameters['bed_length'], parameters['particle_diam'])
@@ -247,14 +654,36 @@ def build_stream(parameters, h):
                                                         parameters['level_limit'])    
     # Create model particle array and set on top of bed particles
     model_particles, model_supp = logic.set_model_particles(bed_particles, available_vertices, parameters['particle_diam'], 
-                                                        parameters['particle_pack_dens'],  h)
+                                                        parameters['particle_pack_dens'],  h, rng)
+    # Particles are addressed by uid from here on
+    logic.validate_uids(model_particles)
     # Define stream's subregions
-    subregions = logic.define_subregions(parameters['bed_length'], parameters['num_subregions'], parameters['iterations'])
+    subregions = logic.define_subregion_table(parameters['bed_length'], parameters['num_subregions'], parameters['iterations'])
     return bed_particles,model_particles, model_supp, subregions
 
 
+def write_snapshot(snapshots, iteration, model_particles, model_supp, event_particle_ids, 
+                    particle_layout, float32=False):
+    """ Record the model particles and event particles of an iteration.
+
+    Args:
+        snapshots: A snapshot writer (see storage.snapshot_writer).
+        iteration: The iteration being recorded (int).
+        model_particles: An n-7 NumPy array representing the stream's 
+            n model particles. 
+        model_supp: An n-2 NumPy array with the uids of the two particles supporting each 
+            model particle.
+        event_particle_ids: A NumPy array of the uids of the iteration's event particles.
+        particle_layout: The layout used to store model particles (see the particles module).
+        float32: Boolean flag indicating whether to store floats as float32.
+    """
+    snapshots.append(iteration, particles.pack(model_particles, model_supp, particle_layout, 
+                                                float32), event_particle_ids)
+
+
 def entrainment_event(model_particles, model_supp, bed_particles, event_particle_ids, avail_vertices, 
-                                                                    unverified_e, subregions, iteration, h):
+                                                                    unverified_e, subregions, iteration, h,
+                                                                    rng=None, timer=timing.NULL_TIMER):
     """ This function mimics a single entrainment event through
     calls to the entrainment-related logic functions. 
     
@@ -275,12 +704,15 @@ def entrainment_event(model_particles, model_supp, bed_particles, event_particle
             bed particles.
         event_particle_ids: A NumPy array of k uids representing the model particles
             that have been selected for entrainment.
+        rng: A numpy.random.Generator to draw from. If None, NumPy's
+            global random state is used.
+        timer: Optional timing.PhaseTimer timing the move, flux and states phases.
         
     Returns:
         model_particles: Updated model_particles (Args) with updated age, location, 
             loops, and states, based on entrainment event placements.
         model_supp: An updated model_supports (Args) based on placements.
-        subregions: Python array of Subregion objects with updated flux lists.
+        subregions: SubregionTable (or Python array of Subregion objects) with updated flux lists.
     """
 
     initial_x = model_particles[event_particle_ids][:,0]
@@ -289,12 +721,69 @@ def entrainment_event(model_particles, model_supp, bed_particles, event_particle
                                                                 model_supp, 
                                                                 bed_particles, 
                                                                 avail_vertices,
-                                                                h)
+                                                                h,
+                                                                rng)
+    timer.lap('move')
     final_x = model_particles[event_particle_ids][:,0]
     subregions = logic.update_flux(initial_x, final_x, iteration, subregions)
+    timer.lap('flux')
     model_particles = logic.update_particle_states(model_particles, model_supp)
     # Increment age at the end of each entrainment
     model_particles = logic.increment_age(model_particles, event_particle_ids)
+    timer.lap('states')
+
+    return model_particles, model_supp, subregions
+
+
+def lattice_entrainment_event(model_particles, model_supp, lattice_bed, particle_buckets, 
+                                support_graph, event_particle_ids, unverified_e, subregions, iteration,
+                                rng=None, timer=timing.NULL_TIMER):
+    """ Equivalent to entrainment_event but using a LatticeBed for
+    vertex, support and state computations.
+
+    Args:
+        model_particles: An n-7 NumPy array representing the stream's 
+            n model particles. 
+        model_supp: An n-2 NumPy array with the uids of the two particles supporting each 
+            model particle (e.g model_supp[j] = supports for model particle j). 
+        lattice_bed: A LatticeBed representing the current state of the stream.
+        particle_buckets: A ParticleBuckets index of the stream's subregions. Updated
+            for the event particles and their old and new supports.
+        support_graph: A SupportGraph of the stream. Used to update the states
+            of the event particles and their old and new supports.
+        event_particle_ids: A NumPy array of k uids representing the model particles
+            that have been selected for entrainment.
+        rng: A numpy.random.Generator to draw from. If None, NumPy's
+            global random state is used.
+        timer: Optional timing.PhaseTimer timing the move, flux and states phases.
+        
+    Returns:
+        model_particles: Updated model_particles (Args) with updated age, location, 
+            loops, and states, based on entrainment event placements.
+        model_supp: An updated model_supports (Args) based on placements.
+        subregions: SubregionTable (or Python array of Subregion objects) with updated flux lists.
+    """
+    initial_x = model_particles[event_particle_ids][:,0]
+    lifted_supp = model_supp[event_particle_ids]
+    lattice_bed.lift(event_particle_ids)
+    support_graph.lift(event_particle_ids, model_particles, model_supp)
+    model_particles, model_supp = lattice.move_model_particles(unverified_e,
+                                                                model_particles,
+                                                                model_supp,
+                                                                lattice_bed,
+                                                                rng)
+    timer.lap('move')
+    final_x = model_particles[event_particle_ids][:,0]
+    subregions = logic.update_flux(initial_x, final_x, iteration, subregions)
+    timer.lap('flux')
+    support_graph.place(event_particle_ids, model_particles, model_supp)
+    # Only event particles and their supports can change location or state
+    particle_buckets.update(np.concatenate((event_particle_ids, 
+                                            lifted_supp.ravel(), 
+                                            model_supp[event_particle_ids].ravel())), 
+                                            model_particles)
+    model_particles = logic.increment_age(model_particles, event_particle_ids)
+    timer.lap('states')
 
     return model_particles, model_supp, subregions
 
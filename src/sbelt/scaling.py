@@ -0,0 +1,221 @@
+"""
+This module measures how the cost of each phase of an iteration grows
+with the size of the stream (bed_length) and the number of entrainment
+events (poiss_lambda). Each parameter is swept over geometrically
+increasing values, the others held at FIXED, and the time and peak
+memory of every phase (see the benchmark module) are measured. A power
+law, cost = coefficient * value**exponent, is fitted to each phase and
+phases whose exponent exceeds SUPERLINEAR are flagged.
+
+The fits can be extrapolated to estimate the cost of much larger runs
+before running them (see predict).
+
+Peak memory is the largest amount of memory allocated by a phase while
+it runs, measured with tracemalloc, not counting its inputs.
+
+Examples:
+    From Python::
+
+        report = scaling.scaling_report(bed_lengths=[20, 40, 80, 160])
+        print(scaling.format_report(report))
+        seconds = scaling.predict(report, 'iteration', 'bed_length', 10000)
+
+    or from the command line::
+
+        $ sbelt-scaling --json scaling.json --plot ./ --predict-bed-length 10000
+
+Attributes:
+    BED_LENGTHS: The bed lengths swept by default.
+    LAMBDAS: The poiss_lambda values swept by default.
+    FIXED: The values of parameters while they are not swept.
+    SUPERLINEAR: Exponents above this are flagged as super-linear.
+"""
+import argparse
+import json
+import tracemalloc
+
+import numpy as np
+
+from sbelt import benchmark
+from sbelt import profiling
+from sbelt.plots import plotting
+
+BED_LENGTHS = [20, 40, 80, 160, 320]
+LAMBDAS = [1, 2, 4, 8, 16]
+FIXED = {'bed_length': 80, 'particle_pack_dens': 0.78, 'num_subregions': 4, 'poiss_lambda': 4}
+SUPERLINEAR = 1.1
+
+
+def peak_memory(name, state):
+    """ Returns the peak memory, in bytes, allocated by one call of a benchmark. """
+    call = benchmark.prepare(name, state)
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    try:
+        before = profiling.reset_peak_memory(not tracing)
+        call()
+        return tracemalloc.get_traced_memory()[1] - before
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+
+
+def fit_power_law(values, costs):
+    """ Least squares fit of cost = coefficient * value**exponent in log-log space.
+
+    Args:
+        values: A sequence of parameter values.
+        costs: A sequence of the measured cost at each value. Values
+            with a cost of 0 are left out.
+
+    Returns:
+        exponent: The fitted exponent (float), NaN if there are fewer than
+            two values with a cost.
+        coefficient: The fitted coefficient (float), NaN if exponent is.
+    """
+    values, costs = np.asarray(values, dtype=float), np.asarray(costs, dtype=float)
+    measured = costs > 0
+    if np.count_nonzero(measured) < 2:
+        return np.nan, np.nan
+    exponent, intercept = np.polyfit(np.log(values[measured]), np.log(costs[measured]), 1)
+    return float(exponent), float(np.exp(intercept))
+
+
+def sweep(parameter, values, phases=None, repeat=5, fixed=None, seed=benchmark.SEED):
+    """ Measure every phase at each value of a parameter and fit power laws.
+
+    Args:
+        parameter: The swept parameter, 'bed_length' or 'poiss_lambda'.
+        values: A sequence of values of the parameter.
+        phases: A Python list of phase (benchmark) names. Defaults to benchmark.BENCHMARKS.
+        repeat: The number of time measurements of each phase and value (int).
+        fixed: A dictionary of the values of the other parameters. Defaults to FIXED.
+        seed: The seed of the measured streams (int).
+
+    Returns:
+        result: A dictionary with the swept values, the number of particles
+            at each value and, for each phase, the median seconds and peak
+            bytes at each value, the fitted exponents and coefficients
+            and whether it is super-linear in time or memory.
+    """
+    phases = benchmark.BENCHMARKS if phases is None else phases
+    fixed = FIXED if fixed is None else fixed
+    measurements = {phase: {'seconds': [], 'peak_bytes': []} for phase in phases}
+    particles = []
+    for value in values:
+        state = benchmark.build_case(dict(fixed, **{parameter: value}), seed)
+        particles.append(len(state['model_particles']))
+        for phase in phases:
+            timings, _ = benchmark.time_benchmark(phase, state, repeat)
+            measurements[phase]['seconds'].append(float(np.median(timings)))
+            measurements[phase]['peak_bytes'].append(peak_memory(phase, state))
+
+    for measured in measurements.values():
+        measured['time_exponent'], measured['time_coefficient'] = fit_power_law(
+                                                                    values, measured['seconds'])
+        measured['memory_exponent'], measured['memory_coefficient'] = fit_power_law(
+                                                                    values, measured['peak_bytes'])
+        measured['superlinear'] = bool(measured['time_exponent'] > SUPERLINEAR
+                                        or measured['memory_exponent'] > SUPERLINEAR)
+    return {'values': list(values), 'particles': particles, 'phases': measurements}
+
+
+def scaling_report(bed_lengths=None, lambdas=None, phases=None, repeat=5, fixed=None,
+                        seed=benchmark.SEED):
+    """ Sweep bed_length and poiss_lambda (see sweep).
+
+    Args:
+        bed_lengths: A sequence of bed lengths. Defaults to BED_LENGTHS.
+        lambdas: A sequence of poiss_lambda values. Defaults to LAMBDAS.
+        The remaining arguments are those of sweep.
+
+    Returns:
+        report: A dictionary with the fixed parameters ('fixed') and the
+            result of each sweep, by parameter ('sweeps').
+    """
+    fixed = FIXED if fixed is None else fixed
+    sweeps = {'bed_length': BED_LENGTHS if bed_lengths is None else bed_lengths,
+              'poiss_lambda': LAMBDAS if lambdas is None else lambdas}
+    return {'fixed': fixed,
+            'sweeps': {parameter: sweep(parameter, values, phases, repeat, fixed, seed)
+                        for parameter, values in sweeps.items() if len(values)}}
+
+
+def predict(report, phase, parameter, value):
+    """ Returns the seconds per call of a phase extrapolated to a parameter value. """
+    measured = report['sweeps'][parameter]['phases'][phase]
+    return measured['time_coefficient'] * value**measured['time_exponent']
+
+
+def format_report(report):
+    """Returns the exponents of each phase in a report as a table (string)"""
+    lines = []
+    for parameter, result in report['sweeps'].items():
+        others = {name: value for name, value in report['fixed'].items() if name != parameter}
+        lines.append(f'Scaling with {parameter} ({", ".join(map(str, result["values"]))}), '
+                        f'other parameters {others}')
+        lines.append(f'{"phase":<32} {"time exponent":>14} {"memory exponent":>16}')
+        for phase, measured in result['phases'].items():
+            flag = '  SUPER-LINEAR' if measured['superlinear'] else ''
+            lines.append(f'{phase:<32} {measured["time_exponent"]:>14.2f} '
+                            f'{measured["memory_exponent"]:>16.2f}{flag}')
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def plot_report(report, out_location=None, out_name='scaling'):
+    """ Plot the time and peak memory of every phase of each sweep of a report.
+
+    Args:
+        report: A report returned by scaling_report.
+        out_location: Save location. Default=None shows the plots instead.
+        out_name: Prefix of the saved file names, which are
+            {out_name}-{parameter}-{time|memory}.png.
+    """
+    for parameter, result in report['sweeps'].items():
+        phases = result['phases']
+        for quantity, key, label in [('time', 'seconds', 'Time per call (s)'),
+                                        ('memory', 'peak_bytes', 'Peak memory (bytes)')]:
+            plotting.scaling(result['values'],
+                                {phase: measured[key] for phase, measured in phases.items()},
+                                {phase: (measured[f'{quantity}_exponent'],
+                                            measured[f'{quantity}_coefficient'])
+                                    for phase, measured in phases.items()},
+                                parameter, label, out_location=out_location,
+                                out_name=f'{out_name}-{parameter}-{quantity}')
+
+
+def main(argv=None):
+    """Command line entry point, see the module docstring"""
+    parser = argparse.ArgumentParser(description='Measure how each phase scales with '
+                                                    'bed_length and poiss_lambda.')
+    parser.add_argument('--bed-lengths', type=int, nargs='*', default=BED_LENGTHS)
+    parser.add_argument('--lambdas', type=float, nargs='*', default=LAMBDAS)
+    parser.add_argument('--phases', nargs='+', default=benchmark.BENCHMARKS,
+                        choices=benchmark.BENCHMARKS)
+    parser.add_argument('--repeat', type=int, default=5, help='Measurements per phase and value.')
+    parser.add_argument('--json', default=None, help='Also write the report to this JSON file.')
+    parser.add_argument('--plot', default=None,
+                        help='Save plots of the report in this directory.')
+    parser.add_argument('--predict-bed-length', type=float, default=None,
+                        help='Extrapolate the time per call of each phase to this bed length.')
+    args = parser.parse_args(argv)
+
+    report = scaling_report(args.bed_lengths, args.lambdas, args.phases, args.repeat)
+    print(format_report(report))
+    if args.predict_bed_length and 'bed_length' in report['sweeps']:
+        print(f'Predicted seconds per call at bed_length={args.predict_bed_length:g}:')
+        for phase in args.phases:
+            seconds = predict(report, phase, 'bed_length', args.predict_bed_length)
+            print(f'{phase:<32} {seconds:>14.6f}')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.plot:
+        plot_report(report, out_location=args.plot.rstrip('/') + '/')
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
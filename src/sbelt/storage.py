@@ -0,0 +1,667 @@
+"""
+This module is responsible for writing and reading the per-iteration
+snapshots (model particles and event particle uids) of a run. Three
+storage layouts are supported.
+
+v1 (the original layout) stores each snapshot in its own group::
+
+    iteration_{i}/model
+    iteration_{i}/event_ids
+
+v2 appends every snapshot to a handful of chunked, resizable datasets in
+a single group, so opening a file and writing a snapshot cost the same
+no matter how many snapshots the file already holds::
+
+    snapshots/iteration      (snapshots,) iteration number of each snapshot
+    snapshots/model          (snapshots, n, 7) or (snapshots, n) compact records
+    snapshots/event_ids      (total events,) event uids of all snapshots
+    snapshots/event_offsets  (snapshots + 1,) snapshot i's uids are
+                             event_ids[event_offsets[i]:event_offsets[i+1]]
+
+delta also appends to chunked datasets but only stores the full model
+particle array (a keyframe) for the first snapshot at or after every
+keyframe_interval iterations. In between, a snapshot stores only the
+particles which differ from the previous snapshot, other than by
+having aged. Between consecutive iterations these are the event
+particles and the particles whose active state changed::
+
+    snapshots/iteration          (snapshots,)
+    snapshots/keyframe_snapshot  (keyframes,) index of each keyframe's snapshot
+    snapshots/keyframes          (keyframes, n, 7) or (keyframes, n)
+    snapshots/changes            (total changes, 7) or (total changes,) changed particles
+    snapshots/change_rows        (total changes,) row of each changed particle
+    snapshots/change_offsets     (snapshots + 1,) as event_offsets, for changes
+    snapshots/event_ids
+    snapshots/event_offsets
+
+A delta snapshot is reconstructed by replaying the changes of every
+snapshot since the nearest keyframe, aging the other particles by the
+iterations between snapshots.
+
+The v2 and delta writers buffer snapshots in memory and write them a
+chunk at a time; flush must be called before the file is relied upon
+(e.g. when a checkpoint is written). read_snapshot, iter_snapshots,
+read_model_particles and snapshot_iterations read any layout. All
+functions/classes are designed for internal use and may change without
+note.
+
+Any writer can be wrapped in a BackgroundWriter, which hands copies of
+the snapshots to a thread through a bounded queue so that compressing
+and writing them overlaps with the following iterations. h5py releases
+the GIL while HDF5 compresses and writes chunks, so the thread runs in
+parallel with the simulation. When the queue is full, appending blocks
+until the thread catches up.
+
+Every compressed dataset is written with the filters returned by
+dataset_filters (gzip level 4, no shuffle, by default) and the v2 and
+delta snapshot datasets are chunked to roughly chunk_bytes per chunk.
+The storage options of a run are recorded as attributes of its file
+(see write_storage_attrs).
+
+Attributes:
+    LAYOUTS: Names of the supported storage layouts.
+    COMPRESSION: Names of the supported compression codecs.
+    STORAGE_OPTIONS: Run parameters recorded by write_storage_attrs.
+    CHUNK_BYTES: Default target size of a snapshot chunk in bytes (before compression).
+    KEYFRAME_INTERVAL: Default number of iterations between delta keyframes.
+    WRITER_QUEUE_SIZE: Default number of snapshots a BackgroundWriter can queue.
+"""
+import queue
+import threading
+import time
+
+import numpy as np
+
+from sbelt import particles
+
+LAYOUTS = ['v1', 'v2', 'delta']
+COMPRESSION = ['none', 'lzf', 'gzip']
+STORAGE_OPTIONS = ['storage_layout', 'keyframe_interval', 'compression', 'compression_level',
+                    'shuffle', 'float_precision', 'snapshot_chunk_bytes', 'flux_chunk_size']
+CHUNK_BYTES = 2**20
+KEYFRAME_INTERVAL = 100
+WRITER_QUEUE_SIZE = 16
+_EVENT_CHUNK = 4096
+
+
+def dataset_filters(compression='gzip', compression_level=4, shuffle=False):
+    """ Returns the keyword arguments of h5py's create_dataset for a codec.
+
+    Args:
+        compression: One of COMPRESSION.
+        compression_level: The gzip compression level, 0-9 (int). Ignored
+            by the other codecs.
+        shuffle: Boolean flag indicating whether to apply the shuffle filter,
+            which often helps compress arrays of numbers.
+    """
+    if compression == 'none':
+        return {'shuffle': shuffle}
+    if compression == 'lzf':
+        return {'compression': 'lzf', 'shuffle': shuffle}
+    return {'compression': 'gzip', 'compression_opts': compression_level, 'shuffle': shuffle}
+
+
+def write_storage_attrs(f, parameters):
+    """Record the storage options of a run's parameters as attributes of its open h5py File"""
+    for key in STORAGE_OPTIONS:
+        f.attrs[key] = parameters[key]
+
+
+def write_series(grp, name, data, filters=None, chunk_size=0):
+    """ Write a per-iteration series (e.g a flux list) to a dataset.
+
+    Args:
+        grp: The h5py Group to write to.
+        name: The name of the dataset.
+        data: A 1-D NumPy array.
+        filters: Keyword arguments from dataset_filters. Defaults to gzip.
+        chunk_size: The number of values per chunk (int). If 0, h5py
+            chooses the chunk shape.
+    """
+    filters = dataset_filters() if filters is None else filters
+    chunks = (min(chunk_size, len(data)),) if chunk_size and len(data) else None
+    grp.create_dataset(name, data=data, chunks=chunks, **filters)
+
+
+def snapshot_writer(f, storage_layout, keyframe_interval=KEYFRAME_INTERVAL, filters=None, 
+                        chunk_bytes=CHUNK_BYTES):
+    """ Returns a writer of snapshots to an open h5py File in the given layout.
+
+    Args:
+        f: An open, writable h5py File.
+        storage_layout: One of LAYOUTS.
+        keyframe_interval: The number of iterations between delta keyframes (int).
+        filters: Keyword arguments from dataset_filters. Defaults to gzip.
+        chunk_bytes: Target size of a v2 or delta snapshot chunk in bytes (int).
+    """
+    filters = dataset_filters() if filters is None else filters
+    if storage_layout == 'v2':
+        return ChunkedWriter(f, filters, chunk_bytes)
+    if storage_layout == 'delta':
+        return DeltaWriter(f, keyframe_interval, filters, chunk_bytes)
+    return GroupWriter(f, filters)
+
+
+class GroupWriter():
+    """ Writes snapshots in the v1 layout, one group per snapshot. """
+    def __init__(self, f, filters=None):
+        self.f = f
+        self.filters = dataset_filters() if filters is None else filters
+
+    def append(self, iteration, model, event_ids):
+        """ Write a snapshot.
+
+        Args:
+            iteration: The iteration of the snapshot (int).
+            model: A NumPy array of the model particles (see particles.pack).
+            event_ids: A NumPy array of the uids of the iteration's event particles.
+        """
+        grp_i = self.f.create_group(f"iteration_{iteration}")
+        grp_i.create_dataset("model", data=model, **self.filters)
+        grp_i.create_dataset("event_ids", data=event_ids, **self.filters)
+
+    def flush(self):
+        """Snapshots are written immediately, nothing to do"""
+
+    def close(self):
+        """Snapshots are written immediately, nothing to do"""
+
+    def truncate(self, iteration):
+        """Delete all snapshots at or after an iteration"""
+        for name in list(self.f):
+            if name.startswith('iteration_') and int(name.split('_')[1]) >= iteration:
+                del self.f[name]
+
+
+class ChunkedWriter():
+    """ Writes snapshots in the v2 layout, appending to chunked datasets.
+
+    Datasets are created on the first flush, when the shape and dtype
+    of the model particle arrays are known.
+
+    Attributes:
+        snapshots_per_chunk: The number of snapshots in a model chunk (int).
+            Also the number of snapshots buffered between writes.
+    """
+    def __init__(self, f, filters=None, chunk_bytes=CHUNK_BYTES):
+        self.f = f
+        self.filters = dataset_filters() if filters is None else filters
+        self.chunk_bytes = chunk_bytes
+        self.snapshots_per_chunk = None
+        self._iterations = []
+        self._models = []
+        self._event_ids = []
+
+    def append(self, iteration, model, event_ids):
+        """ Buffer a snapshot, writing the buffer once it fills a chunk.
+
+        Args:
+            iteration: The iteration of the snapshot (int).
+            model: A NumPy array of the model particles (see particles.pack).
+            event_ids: A NumPy array of the uids of the iteration's event particles.
+        """
+        if self.snapshots_per_chunk is None:
+            self.snapshots_per_chunk = max(1, self.chunk_bytes // max(model.nbytes, 1))
+        self._iterations.append(iteration)
+        self._models.append(np.array(model))
+        self._event_ids.append(np.asarray(event_ids, dtype=np.int64))
+        if len(self._iterations) >= self.snapshots_per_chunk:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered snapshots"""
+        if not self._iterations:
+            return
+        if 'snapshots' not in self.f:
+            self._create(self._models[0])
+        grp = self.f['snapshots']
+        num_snapshots = grp['iteration'].shape[0]
+        _append(grp['iteration'], np.array(self._iterations, dtype=np.int64))
+        _append(grp['model'], np.stack(self._models))
+        _append_ragged(grp['event_ids'], grp['event_offsets'], num_snapshots, self._event_ids)
+
+        self._iterations = []
+        self._models = []
+        self._event_ids = []
+
+    def close(self):
+        """Write all buffered snapshots"""
+        self.flush()
+
+    def truncate(self, iteration):
+        """Delete all snapshots at or after an iteration"""
+        self.flush()
+        if 'snapshots' not in self.f:
+            return
+        grp = self.f['snapshots']
+        keep = int(np.searchsorted(grp['iteration'][()], iteration, side='left'))
+        grp['iteration'].resize((keep,))
+        grp['model'].resize((keep,) + grp['model'].shape[1:])
+        grp['event_ids'].resize((int(grp['event_offsets'][keep]),))
+        grp['event_offsets'].resize((keep + 1,))
+
+    def _create(self, model):
+        grp = self.f.create_group('snapshots')
+        grp.create_dataset('iteration', shape=(0,), maxshape=(None,), dtype=np.int64,
+                            chunks=(_EVENT_CHUNK,))
+        grp.create_dataset('model', shape=(0,) + model.shape, maxshape=(None,) + model.shape,
+                            dtype=model.dtype, chunks=(self.snapshots_per_chunk,) + model.shape,
+                            **self.filters)
+        grp.create_dataset('event_ids', shape=(0,), maxshape=(None,), dtype=np.int64,
+                            chunks=(_EVENT_CHUNK,), **self.filters)
+        grp.create_dataset('event_offsets', data=np.zeros(1, dtype=np.int64), maxshape=(None,),
+                            chunks=(_EVENT_CHUNK,))
+
+
+class DeltaWriter():
+    """ Writes snapshots in the delta layout, keyframes plus changed particles.
+
+    Datasets are created on the first flush. When appending to a file
+    which already holds snapshots (e.g. a resumed run), the last stored
+    snapshot is reconstructed to diff the next one against.
+
+    Attributes:
+        keyframe_interval: The number of iterations between keyframes (int).
+    """
+    def __init__(self, f, keyframe_interval=KEYFRAME_INTERVAL, filters=None, 
+                    chunk_bytes=CHUNK_BYTES):
+        self.f = f
+        self.keyframe_interval = keyframe_interval
+        self.filters = dataset_filters() if filters is None else filters
+        self.chunk_bytes = chunk_bytes
+        self._num_snapshots = None
+        self._previous = None
+        self._previous_iteration = None
+        self._clear()
+
+    def _clear(self):
+        self._iterations = []
+        self._keyframe_snapshots = []
+        self._keyframes = []
+        self._changes = []
+        self._change_rows = []
+        self._event_ids = []
+        self._buffered_bytes = 0
+
+    def append(self, iteration, model, event_ids):
+        """ Buffer a snapshot, writing the buffer once it holds about a chunk.
+
+        Args:
+            iteration: The iteration of the snapshot (int).
+            model: A NumPy array of the model particles (see particles.pack).
+            event_ids: A NumPy array of the uids of the iteration's event particles.
+        """
+        if self._num_snapshots is None:
+            self._load_previous()
+        model = np.array(model)
+        if (self._previous is None or 
+                iteration // self.keyframe_interval != self._previous_iteration // self.keyframe_interval):
+            self._keyframe_snapshots.append(self._num_snapshots)
+            self._keyframes.append(model)
+            rows = np.empty(0, dtype=np.int64)
+            self._buffered_bytes += model.nbytes
+        else:
+            expected = self._previous.copy()
+            _age_by(expected, iteration - self._previous_iteration)
+            rows = np.flatnonzero(_changed(expected, model))
+        self._changes.append(model[rows])
+        self._change_rows.append(rows)
+        self._iterations.append(iteration)
+        self._event_ids.append(np.asarray(event_ids, dtype=np.int64))
+        self._buffered_bytes += model[rows].nbytes + rows.nbytes + self._event_ids[-1].nbytes
+
+        self._num_snapshots += 1
+        self._previous = model
+        self._previous_iteration = iteration
+        if self._buffered_bytes >= self.chunk_bytes:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered snapshots"""
+        if not self._iterations:
+            return
+        if 'snapshots' not in self.f:
+            self._create(self._previous)
+        grp = self.f['snapshots']
+        num_snapshots = grp['iteration'].shape[0]
+        _append(grp['iteration'], np.array(self._iterations, dtype=np.int64))
+        if self._keyframes:
+            _append(grp['keyframe_snapshot'], np.array(self._keyframe_snapshots, dtype=np.int64))
+            _append(grp['keyframes'], np.stack(self._keyframes))
+        _append_ragged(grp['changes'], grp['change_offsets'], num_snapshots, self._changes)
+        _append(grp['change_rows'], np.concatenate(self._change_rows))
+        _append_ragged(grp['event_ids'], grp['event_offsets'], num_snapshots, self._event_ids)
+        self._clear()
+
+    def close(self):
+        """Write all buffered snapshots"""
+        self.flush()
+
+    def truncate(self, iteration):
+        """Delete all snapshots at or after an iteration"""
+        self.flush()
+        self._num_snapshots = None
+        if 'snapshots' not in self.f:
+            return
+        grp = self.f['snapshots']
+        keep = int(np.searchsorted(grp['iteration'][()], iteration, side='left'))
+        keep_keyframes = int(np.searchsorted(grp['keyframe_snapshot'][()], keep, side='left'))
+        grp['iteration'].resize((keep,))
+        grp['keyframe_snapshot'].resize((keep_keyframes,))
+        grp['keyframes'].resize((keep_keyframes,) + grp['keyframes'].shape[1:])
+        num_changes = int(grp['change_offsets'][keep])
+        grp['changes'].resize((num_changes,) + grp['changes'].shape[1:])
+        grp['change_rows'].resize((num_changes,))
+        grp['change_offsets'].resize((keep + 1,))
+        grp['event_ids'].resize((int(grp['event_offsets'][keep]),))
+        grp['event_offsets'].resize((keep + 1,))
+
+    def _load_previous(self):
+        self._num_snapshots = 0
+        self._previous = None
+        if 'snapshots' in self.f and self.f['snapshots/iteration'].shape[0] > 0:
+            iterations = self.f['snapshots/iteration']
+            self._num_snapshots = iterations.shape[0]
+            self._previous_iteration = int(iterations[-1])
+            self._previous, _ = read_snapshot(self.f, self._previous_iteration)
+
+    def _create(self, model):
+        grp = self.f.create_group('snapshots')
+        record = model.shape[1:]
+        rows_per_chunk = max(1, self.chunk_bytes // max(model[:1].nbytes, 1))
+        grp.create_dataset('iteration', shape=(0,), maxshape=(None,), dtype=np.int64,
+                            chunks=(_EVENT_CHUNK,))
+        grp.create_dataset('keyframe_snapshot', shape=(0,), maxshape=(None,), dtype=np.int64,
+                            chunks=(_EVENT_CHUNK,))
+        grp.create_dataset('keyframes', shape=(0,) + model.shape, maxshape=(None,) + model.shape,
+                            dtype=model.dtype, chunks=(1,) + model.shape, **self.filters)
+        grp.create_dataset('changes', shape=(0,) + record, maxshape=(None,) + record,
+                            dtype=model.dtype, chunks=(rows_per_chunk,) + record, **self.filters)
+        grp.create_dataset('change_rows', shape=(0,), maxshape=(None,), dtype=np.int64,
+                            chunks=(rows_per_chunk,), **self.filters)
+        grp.create_dataset('event_ids', shape=(0,), maxshape=(None,), dtype=np.int64,
+                            chunks=(_EVENT_CHUNK,), **self.filters)
+        for name in ['change_offsets', 'event_offsets']:
+            grp.create_dataset(name, data=np.zeros(1, dtype=np.int64), maxshape=(None,),
+                                chunks=(_EVENT_CHUNK,))
+
+
+class BackgroundWriter():
+    """ Writes snapshots with another writer in a background thread.
+
+    Appending copies the snapshot and queues it. An error raised by the
+    thread is raised again by the next append, flush or close.
+
+    Attributes:
+        writer: The wrapped snapshot writer.
+        write_time: Seconds the thread has spent writing snapshots (float).
+        wait_time: Seconds append, flush and close have spent waiting
+            for the thread (float).
+    """
+    def __init__(self, writer, queue_size=WRITER_QUEUE_SIZE):
+        self.writer = writer
+        self.write_time = 0.0
+        self.wait_time = 0.0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._work, name='sbelt-writer', daemon=True)
+        self._thread.start()
+
+    def append(self, iteration, model, event_ids):
+        """ Queue a copy of a snapshot, waiting if the queue is full.
+
+        Args:
+            iteration: The iteration of the snapshot (int).
+            model: A NumPy array of the model particles (see particles.pack).
+            event_ids: A NumPy array of the uids of the iteration's event particles.
+        """
+        self._raise_error()
+        snapshot = (iteration, np.array(model), np.array(event_ids))
+        start = time.perf_counter()
+        self._queue.put(snapshot)
+        self.wait_time += time.perf_counter() - start
+
+    def flush(self):
+        """Wait for all queued snapshots to be written, then flush the writer"""
+        start = time.perf_counter()
+        self._queue.join()
+        self._raise_error()
+        self.writer.flush()
+        self.wait_time += time.perf_counter() - start
+
+    def truncate(self, iteration):
+        """Delete all snapshots at or after an iteration"""
+        self.flush()
+        self.writer.truncate(iteration)
+
+    def close(self):
+        """Write all queued snapshots and stop the thread"""
+        if self._thread.is_alive():
+            start = time.perf_counter()
+            self._queue.put(None)
+            self._thread.join()
+            self.wait_time += time.perf_counter() - start
+        self._raise_error()
+        self.writer.flush()
+
+    def _work(self):
+        while True:
+            snapshot = self._queue.get()
+            try:
+                if snapshot is None:
+                    return
+                # Once writing failed, drop the remaining snapshots
+                if self._error is None:
+                    start = time.perf_counter()
+                    self.writer.append(*snapshot)
+                    self.write_time += time.perf_counter() - start
+            except Exception as error:
+                self._error = error
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+
+def _age_by(model, iterations):
+    """Age every particle in a model array, in place, by a number of iterations"""
+    ages = model['age'] if model.dtype.names else model[:,5]
+    ages += ages.dtype.type(iterations)
+
+
+def _changed(expected, model):
+    """Returns a boolean mask of the rows of model which differ from expected"""
+    if model.dtype.names:
+        changed = np.zeros(len(model), dtype=bool)
+        for name in model.dtype.names:
+            changed |= expected[name] != model[name]
+        return changed
+    return np.any((expected != model) & ~(np.isnan(expected) & np.isnan(model)), axis=1)
+
+
+def _append_ragged(dataset, offsets, num_snapshots, values):
+    """Append a list of per-snapshot arrays to a dataset and its offsets"""
+    num_values = dataset.shape[0]
+    counts = np.array([len(value) for value in values], dtype=np.int64)
+    _append(dataset, np.concatenate(values))
+    offsets.resize((num_snapshots + len(counts) + 1,))
+    offsets[num_snapshots + 1:] = num_values + np.cumsum(counts)
+
+
+def _append(dataset, values):
+    """Append values along the first axis of a resizable dataset"""
+    size = dataset.shape[0]
+    dataset.resize((size + len(values),) + dataset.shape[1:])
+    dataset[size:] = values
+
+
+def read_params(f):
+    """ Returns the params group of an open h5py File as a dictionary of Python values. """
+    return {key: _read_param(f['params'][key][()]) for key in f['params']}
+
+
+def _read_param(value):
+    """Convert a value read from a params group back to a Python value"""
+    if isinstance(value, bytes):
+        return value.decode()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def snapshot_iterations(f):
+    """ Returns a sorted NumPy array of the iterations with a snapshot in an open h5py File. """
+    if 'snapshots' in f:
+        return f['snapshots/iteration'][()]
+    return np.array(sorted(int(name.split('_')[1]) for name in f
+                            if name.startswith('iteration_')), dtype=np.int64)
+
+
+def read_snapshot(f, iteration):
+    """ Read the snapshot of an iteration from an open h5py File in any layout.
+
+    Args:
+        f: An open h5py File.
+        iteration: The iteration of the snapshot (int).
+
+    Returns:
+        model: A NumPy array of the model particles as stored (see particles.pack).
+        event_ids: A NumPy array of the uids of the iteration's event particles.
+
+    Raises:
+        KeyError: if there is no snapshot of the iteration.
+    """
+    if 'snapshots' not in f:
+        return f[f'iteration_{iteration}/model'][()], f[f'iteration_{iteration}/event_ids'][()]
+    grp = f['snapshots']
+    iterations = grp['iteration'][()]
+    index = int(np.searchsorted(iterations, iteration))
+    if index == len(iterations) or iterations[index] != iteration:
+        raise KeyError(f'No snapshot of iteration {iteration}')
+    start, stop = grp['event_offsets'][index:index + 2]
+    if 'keyframes' not in grp:
+        return grp['model'][index], grp['event_ids'][start:stop]
+
+    keyframe = int(np.searchsorted(grp['keyframe_snapshot'][()], index, side='right')) - 1
+    for _, model in replay_segment(read_segment(grp, keyframe, index + 1)):
+        pass
+    return model, grp['event_ids'][start:stop]
+
+
+def iter_snapshots(f):
+    """ Iterate over all snapshots in an open h5py File in any layout.
+
+    Reading every snapshot this way only replays each delta snapshot
+    once, where calling read_snapshot for each would replay from the
+    nearest keyframe every time.
+
+    Args:
+        f: An open h5py File.
+
+    Yields:
+        iteration: The iteration of the snapshot (int).
+        model: A NumPy array of the model particles as stored (see particles.pack).
+        event_ids: A NumPy array of the uids of the iteration's event particles.
+    """
+    iterations = snapshot_iterations(f)
+    if 'snapshots' not in f:
+        for iteration in iterations:
+            yield (int(iteration),) + read_snapshot(f, iteration)
+        return
+    grp = f['snapshots']
+    event_offsets = grp['event_offsets'][()]
+    if 'keyframes' not in grp:
+        # Read a chunk of snapshots at a time
+        block = grp['model'].chunks[0]
+        for first in range(0, len(iterations), block):
+            models = grp['model'][first:first + block]
+            event_ids = grp['event_ids'][event_offsets[first]:event_offsets[first + len(models)]]
+            for index, model in enumerate(models, first):
+                start, stop = event_offsets[index:index + 2] - event_offsets[first]
+                yield int(iterations[index]), model, event_ids[start:stop]
+        return
+    for keyframe in range(grp['keyframe_snapshot'].shape[0]):
+        segment = read_segment(grp, keyframe)
+        first, stop = segment['first'], segment['stop']
+        event_ids = grp['event_ids'][event_offsets[first]:event_offsets[stop]]
+        for index, model in replay_segment(segment):
+            start, end = event_offsets[index:index + 2] - event_offsets[first]
+            yield int(iterations[index]), model.copy(), event_ids[start:end]
+
+
+def read_segment(grp, keyframe, stop=None):
+    """ Read a segment of delta snapshots: a keyframe and the changes of the
+    snapshots after it, up to the next keyframe.
+
+    Args:
+        grp: The snapshots group of an open h5py File in the delta layout.
+        keyframe: The index of the keyframe (int).
+        stop: Optional index of the snapshot to stop at (exclusive, int). 
+            Defaults to the next keyframe's snapshot.
+
+    Returns:
+        segment: A dictionary with the first and stop snapshot indices,
+            the keyframe, the snapshots' iterations and their changes.
+    """
+    keyframe_snapshot = grp['keyframe_snapshot']
+    first = int(keyframe_snapshot[keyframe])
+    if stop is None:
+        stop = (int(keyframe_snapshot[keyframe + 1]) if keyframe + 1 < keyframe_snapshot.shape[0]
+                    else grp['iteration'].shape[0])
+    change_offsets = grp['change_offsets'][first:stop + 1]
+    return {'first': first,
+            'stop': stop,
+            'keyframe': grp['keyframes'][keyframe],
+            'iterations': grp['iteration'][first:stop],
+            'changes': grp['changes'][change_offsets[0]:change_offsets[-1]],
+            'change_rows': grp['change_rows'][change_offsets[0]:change_offsets[-1]],
+            'change_offsets': change_offsets - change_offsets[0]}
+
+
+def replay_segment(segment, stop=None):
+    """ Reconstruct the snapshots of a segment (see read_segment) in order.
+
+    The same model array is updated and yielded for every snapshot, copy
+    it to keep a snapshot.
+
+    Args:
+        segment: A dictionary returned by read_segment.
+        stop: Optional index of the snapshot to stop at (exclusive, int).
+
+    Yields:
+        index: The index of the snapshot (int).
+        model: A NumPy array of the model particles as stored.
+    """
+    first = segment['first']
+    stop = segment['stop'] if stop is None else stop
+    iterations, offsets = segment['iterations'], segment['change_offsets']
+    model = segment['keyframe'].copy()
+    yield first, model
+    for index in range(first + 1, stop):
+        i = index - first
+        _age_by(model, iterations[i] - iterations[i - 1])
+        start, end = offsets[i:i + 2]
+        model[segment['change_rows'][start:end]] = segment['changes'][start:end]
+        yield index, model
+
+
+def read_model_particles(f, iteration):
+    """ Read the model particles of an iteration as legacy arrays.
+
+    Args:
+        f: An open h5py File with the output of a run.
+        iteration: The iteration of the snapshot (int).
+
+    Returns:
+        model_particles: An n-7 NumPy array representing the stream's
+            n model particles.
+
+    Raises:
+        KeyError: if there is no snapshot of the iteration.
+    """
+    model, _ = read_snapshot(f, iteration)
+    if model.dtype.names:
+        model, _ = particles.to_legacy(model, float(f['params/particle_diam'][()]))
+    return model
@@ -0,0 +1,97 @@
+"""
+This module contains the random streams used by a run to draw the
+number of entrainment events and the hop length of each event particle.
+All functions/classes are designed for internal use and may change
+without note.
+
+Drawing one Poisson value and a handful of hops each iteration spends
+most of its time in per-call overhead. Instead, event counts are drawn
+for a block of iterations at once and hop lengths are drawn into a pool
+which is refilled when it runs out. Each comes from its own generator,
+spawned from the run's seed, so the values handed out only depend on
+the seed and not on the block size or on when a refill happens.
+"""
+import json
+
+import numpy as np
+
+
+class RandomStreams():
+    """ Pre-drawn event counts and hop lengths.
+
+    Attributes:
+        poiss_lambda: Lambda of the Poisson distribution of event counts (float).
+        mu: Mean of the hop length distribution (float).
+        sigma: Standard deviation of the hop length distribution (float).
+        normal: Boolean flag for which distribution hops are drawn
+            from. True = Normal, False = log-Normal.
+        block_size: The number of values drawn per refill (int).
+    """
+    def __init__(self, seed, poiss_lambda, mu, sigma, normal=False, block_size=4096):
+        count_seq, hop_seq = np.random.SeedSequence(seed).spawn(2)
+        self._count_rng = np.random.default_rng(count_seq)
+        self._hop_rng = np.random.default_rng(hop_seq)
+        self.poiss_lambda = poiss_lambda
+        self.mu = mu
+        self.sigma = sigma
+        self.normal = normal
+        self.block_size = block_size
+
+        self._counts = np.empty(0, dtype=np.int64)
+        self._next_count = 0
+        self._hops = np.empty(0, dtype=float)
+        self._next_hop = 0
+
+    def event_count(self):
+        """Returns the number of entrainment events of the next iteration (int)"""
+        if self._next_count == len(self._counts):
+            self._counts = self._count_rng.poisson(self.poiss_lambda, self.block_size)
+            self._next_count = 0
+        count = self._counts[self._next_count]
+        self._next_count += 1
+        return int(count)
+
+    def hops(self, k):
+        """ Take the next k hop lengths from the pool.
+
+        Hops are rounded to one decimal place, as in logic.compute_hops.
+
+        Args:
+            k: The number of hops (int).
+
+        Returns:
+            hops: A NumPy array of k hop lengths.
+        """
+        remaining = len(self._hops) - self._next_hop
+        if remaining < k:
+            size = max(self.block_size, k - remaining)
+            if self.normal:
+                fresh = self._hop_rng.normal(self.mu, self.sigma, size)
+            else:
+                fresh = self._hop_rng.lognormal(self.mu, self.sigma, size)
+            self._hops = np.concatenate((self._hops[self._next_hop:], np.round(fresh, 1)))
+            self._next_hop = 0
+        hops = self._hops[self._next_hop:self._next_hop + k]
+        self._next_hop += k
+        return hops
+
+    def get_state(self):
+        """ Returns the state of the streams as a dictionary.
+
+        The state holds the generators' states (as JSON strings) and
+        the values drawn but not yet handed out. It can be restored
+        with set_state.
+        """
+        return {'count_rng': json.dumps(self._count_rng.bit_generator.state),
+                'hop_rng': json.dumps(self._hop_rng.bit_generator.state),
+                'counts': self._counts[self._next_count:],
+                'hops': self._hops[self._next_hop:]}
+
+    def set_state(self, state):
+        """Restore a state returned by get_state"""
+        self._count_rng.bit_generator.state = json.loads(state['count_rng'])
+        self._hop_rng.bit_generator.state = json.loads(state['hop_rng'])
+        self._counts = np.asarray(state['counts'], dtype=np.int64)
+        self._next_count = 0
+        self._hops = np.asarray(state['hops'], dtype=float)
+        self._next_hop = 0
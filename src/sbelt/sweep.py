@@ -0,0 +1,460 @@
+"""
+This module is responsible for executing resumable parameter sweeps.
+A sweep design (a full grid or a Latin hypercube over some of the run
+parameters) is expanded into jobs which are stored in a SQLite queue.
+Any number of worker processes, on one or more hosts sharing a
+filesystem, can then claim and run jobs from the queue.
+
+A claimed job is leased to its worker for a limited time and the lease
+is renewed while the job runs. If a worker dies (e.g. the node is
+preempted) its lease expires and the job is claimed again. Each attempt
+writes its own output, which only replaces the job's output if the
+attempt still holds the lease when it finishes, so a worker which lost
+its lease never overwrites the output of the worker running the job now.
+Failed jobs, and jobs whose lease expired, are retried until they reach
+the queue's maximum number of attempts and completed jobs are never run
+again, so restarting a sweep only runs
+what is left. Jobs are claimed in order of decreasing estimated cost
+(bed_length x iterations x poiss_lambda) so that long jobs start first.
+
+Examples:
+    A sweep can be set up and run from Python::
+
+        queue = sweep.SweepQueue('sweep.sqlite')
+        queue.add_jobs(sweep.grid_design({'poiss_lambda': [3, 5, 7], 'level_limit': [2, 3]}),
+                        base_parameters={'iterations': 10000}, replicas=5)
+        sweep.run_sweep('sweep.sqlite', out_path='sweep-out', workers=8)
+
+    or from the command line, where design.json holds a design (see
+    design_from_spec)::
+
+        $ sbelt-sweep add sweep.sqlite design.json --replicas 5
+        $ sbelt-sweep work sweep.sqlite --out-path sweep-out --workers 8
+        $ sbelt-sweep status sweep.sqlite
+
+Attributes:
+    JOB_NAME: Format of each job's out_name.
+    ATTEMPT_NAME: Format of the out_name of each attempt at a job.
+    LEASE_EXPIRED: Error recorded for jobs whose lease expired on their last attempt.
+"""
+import argparse
+import glob
+import hashlib
+import inspect
+import itertools
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from sbelt import checkpoint
+from sbelt import ensemble
+from sbelt import sbelt_runner
+
+JOB_NAME = 'job-{job_id:06d}'
+ATTEMPT_NAME = '{out_name}-attempt-{attempt}'
+LEASE_EXPIRED = 'The lease expired on the last attempt, the worker running it was lost.'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    parameters TEXT NOT NULL,
+    seed INTEGER NOT NULL,
+    cost REAL NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    output TEXT,
+    wall_time REAL,
+    error TEXT,
+    UNIQUE (parameters, seed)
+)
+"""
+
+
+def grid_design(space):
+    """ Expand a full grid of parameter values.
+
+    Args:
+        space: A dictionary of parameter name to a Python list of values.
+
+    Returns:
+        design: A Python list with a parameter dictionary for every
+            combination of values.
+    """
+    names = list(space)
+    return [dict(zip(names, values)) for values in itertools.product(*space.values())]
+
+
+def latin_hypercube_design(space, num_samples, seed=None):
+    """ Sample a Latin hypercube of parameter values.
+
+    Each parameter's range is split into num_samples equal strata and
+    every stratum is sampled exactly once. Parameters whose bounds are
+    both ints are sampled as ints.
+
+    Args:
+        space: A dictionary of parameter name to (low, high) bounds.
+        num_samples: The number of parameter dictionaries to sample (int).
+        seed: A seed for the sampling (int or None).
+
+    Returns:
+        design: A Python list of num_samples parameter dictionaries.
+    """
+    rng = np.random.default_rng(seed)
+    design = [{} for _ in range(num_samples)]
+    for name, (low, high) in space.items():
+        strata = (rng.permutation(num_samples) + rng.random(num_samples)) / num_samples
+        if isinstance(low, int) and isinstance(high, int):
+            values = [min(int(low + u * (high - low + 1)), high) for u in strata]
+        else:
+            values = [float(low + u * (high - low)) for u in strata]
+        for parameters, value in zip(design, values):
+            parameters[name] = value
+    return design
+
+
+def design_from_spec(spec):
+    """ Build a design from a dictionary specification.
+
+    Args:
+        spec: A dictionary with either a 'grid' entry (see grid_design) or
+            an 'lhs' entry (see latin_hypercube_design) along with 'samples'
+            and optionally 'seed'. A 'base' entry may hold parameters shared
+            by every job.
+
+    Returns:
+        design: A Python list of parameter dictionaries.
+        base_parameters: A dictionary of the shared parameters.
+
+    Raises:
+        ValueError: if spec has neither a 'grid' nor an 'lhs' entry.
+    """
+    if 'grid' in spec:
+        design = grid_design(spec['grid'])
+    elif 'lhs' in spec:
+        design = latin_hypercube_design(spec['lhs'], spec['samples'], spec.get('seed'))
+    else:
+        raise ValueError("Sweep spec must have a 'grid' or an 'lhs' entry.")
+    return design, spec.get('base', {})
+
+
+def estimated_cost(parameters):
+    """Returns the estimated cost (bed_length x iterations x poiss_lambda) of a run"""
+    defaults = {name: param.default for name, param
+                    in inspect.signature(sbelt_runner.run).parameters.items()}
+    parameters = {**defaults, **parameters}
+    return parameters['bed_length'] * parameters['iterations'] * parameters['poiss_lambda']
+
+
+def job_seed(parameters, replica, root_seed):
+    """ Derive the seed of a job from its parameters and replica number.
+
+    Seeds do not depend on the order jobs are added in, so extending
+    a design or adding replicas leaves the seeds of existing jobs unchanged.
+
+    Args:
+        parameters: A dictionary of the job's run parameters.
+        replica: The job's replica number (int).
+        root_seed: A non-negative int.
+
+    Returns:
+        seed: A non-negative int within int64.
+    """
+    digest = hashlib.sha256(f'{json.dumps(parameters, sort_keys=True)}:{replica}'.encode())
+    entropy = [root_seed] + np.frombuffer(digest.digest(), dtype=np.uint32).tolist()
+    state = np.random.SeedSequence(entropy).generate_state(1, np.uint64)[0]
+    return int(state >> np.uint64(1))
+
+
+class SweepQueue():
+    """ A SQLite queue of sweep jobs.
+
+    Every method opens its own connection, so a SweepQueue can be used
+    from several threads and processes at once.
+
+    Attributes:
+        path: Location of the SQLite database.
+        max_attempts: The number of times a job is attempted before
+            it is left as failed (int).
+    """
+    def __init__(self, path, max_attempts=3):
+        self.path = path
+        self.max_attempts = max_attempts
+        with self._connect() as connection:
+            connection.execute(_SCHEMA)
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        return _Transaction(connection)
+
+    def add_jobs(self, design, base_parameters=None, replicas=1, root_seed=0):
+        """ Add a job for every replica of every parameter set in a design.
+
+        Job seeds are derived from root_seed (see job_seed), so adding the
+        same design again adds no new jobs and adding more replicas only
+        adds the new replicas.
+
+        Args:
+            design: A Python list of parameter dictionaries.
+            base_parameters: A dictionary of parameters shared by every job.
+            replicas: The number of jobs for each parameter set (int).
+            root_seed: A non-negative int used to derive job seeds.
+
+        Returns:
+            added: The number of new jobs (int).
+
+        Raises:
+            ValueError: if a parameter set contains one of ensemble.RESERVED_PARAMETERS.
+        """
+        rows = []
+        for parameters in design:
+            parameters = {**(base_parameters or {}), **parameters}
+            reserved = [key for key in ensemble.RESERVED_PARAMETERS if key in parameters]
+            if reserved:
+                raise ValueError(f'{reserved} are set per job by the sweep.')
+            rows.extend((json.dumps(parameters, sort_keys=True), 
+                            job_seed(parameters, replica, root_seed), 
+                            estimated_cost(parameters)) for replica in range(replicas))
+        with self._connect() as connection:
+            before = connection.execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+            connection.executemany('INSERT OR IGNORE INTO jobs (parameters, seed, cost) '
+                                    'VALUES (?, ?, ?)', rows)
+            return connection.execute('SELECT COUNT(*) FROM jobs').fetchone()[0] - before
+
+    def claim(self, worker, lease_seconds):
+        """ Claim the most expensive job that is ready to run.
+
+        A job is ready if it is pending, or if it failed or its lease
+        expired and it has attempts left. Jobs whose lease expired on
+        their last attempt are marked as failed.
+
+        Args:
+            worker: A string identifying the claiming worker.
+            lease_seconds: How long the job is leased for (float).
+
+        Returns:
+            job: A dictionary with the job's id, parameters, seed and attempt
+                (int, starting at 1), or None if no job is ready.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, lease_owner = NULL, "
+                "lease_expires = NULL WHERE status = 'running' AND lease_expires < ? "
+                "AND attempts >= ?", (LEASE_EXPIRED, now, self.max_attempts))
+            row = connection.execute(
+                "SELECT id, parameters, seed, attempts FROM jobs WHERE status = 'pending' "
+                "OR ((status = 'failed' OR (status = 'running' AND lease_expires < ?)) "
+                "AND attempts < ?) ORDER BY cost DESC, id LIMIT 1",
+                (now, self.max_attempts)).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, "
+                "lease_owner = ?, lease_expires = ? WHERE id = ?",
+                (worker, now + lease_seconds, row['id']))
+        return {'id': row['id'], 'parameters': json.loads(row['parameters']),
+                'seed': row['seed'], 'attempt': row['attempts'] + 1}
+
+    def renew(self, job_id, worker, lease_seconds):
+        """Extend a worker's lease on a job. Returns False if the lease was lost"""
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE id = ? AND lease_owner = ? "
+                "AND status = 'running'", (time.time() + lease_seconds, job_id, worker))
+            return cursor.rowcount == 1
+
+    def finish(self, job_id, worker, result, moves=None):
+        """ Record the result of a job.
+
+        Ignored if the worker no longer holds the job's lease. The lease
+        is checked and the files are moved while the queue is locked, so
+        the job cannot be claimed by another worker in between.
+
+        Args:
+            job_id: The job's id (int).
+            worker: A string identifying the worker.
+            result: A dictionary as returned by ensemble.run_member.
+            moves: An optional dictionary of file locations to move to
+                other locations (e.g. an attempt's output to the job's
+                output) if the job succeeded.
+
+        Returns:
+            recorded: False if the worker no longer held the lease.
+        """
+        status = 'done' if result['status'] == 'ok' else 'failed'
+        with self._connect() as connection:
+            held = connection.execute("SELECT 1 FROM jobs WHERE id = ? AND lease_owner = ?",
+                                        (job_id, worker)).fetchone()
+            if held is None:
+                return False
+            if status == 'done':
+                for source, destination in (moves or {}).items():
+                    os.replace(source, destination)
+            connection.execute(
+                "UPDATE jobs SET status = ?, output = ?, wall_time = ?, error = ?, "
+                "lease_owner = NULL, lease_expires = NULL WHERE id = ?",
+                (status, result['output'], result['wall_time'], result['error'], job_id))
+        return True
+
+    def status(self):
+        """Returns a dictionary of the number of jobs with each status"""
+        with self._connect() as connection:
+            rows = connection.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status')
+            return {status: count for status, count in rows}
+
+
+class _Transaction():
+    """ Context manager running a connection's statements in one
+    transaction. Writes take the database lock up front (BEGIN IMMEDIATE)
+    so two workers can never claim the same job. """
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.connection.execute('ROLLBACK' if exc_type else 'COMMIT')
+        self.connection.close()
+
+
+def run_worker(queue_path, out_path, worker=None, lease_seconds=600, max_attempts=3, max_jobs=None):
+    """ Claim and run jobs until the queue has none ready.
+
+    Args:
+        queue_path: Location of the SQLite queue.
+        out_path: A string representing the location to save job outputs.
+        worker: A string identifying the worker. Defaults to host and pid.
+        lease_seconds: How long a job is leased for (float). The lease is
+            renewed every third of this while the job runs.
+        max_attempts: The number of times a job is attempted (int).
+        max_jobs: The maximum number of jobs to run (int or None).
+
+    Returns:
+        completed: The number of jobs run (int).
+    """
+    worker = worker or f'{socket.gethostname()}-{os.getpid()}'
+    queue = SweepQueue(queue_path, max_attempts)
+    os.makedirs(out_path, exist_ok=True)
+    completed = 0
+    while max_jobs is None or completed < max_jobs:
+        job = queue.claim(worker, lease_seconds)
+        if job is None:
+            break
+        out_name = JOB_NAME.format(job_id=job['id'])
+        attempt_name = ATTEMPT_NAME.format(out_name=out_name, attempt=job['attempt'])
+
+        running = threading.Event()
+        def renew_lease():
+            while not running.wait(lease_seconds / 3):
+                if not queue.renew(job['id'], worker, lease_seconds):
+                    logging.warning(f'{worker} lost the lease on job {job["id"]}, '
+                                        f'its output will be discarded.')
+                    return
+        renewer = threading.Thread(target=renew_lease, daemon=True)
+        renewer.start()
+        try:
+            result = ensemble.run_member(job['parameters'], job['seed'], out_path, attempt_name)
+        finally:
+            running.set()
+            renewer.join()
+
+        moves = {_output(out_path, attempt_name): _output(out_path, out_name)}
+        moves[checkpoint.checkpoint_path(out_path, attempt_name)] = \
+                                            checkpoint.checkpoint_path(out_path, out_name)
+        moves = {source: destination for source, destination in moves.items() 
+                    if os.path.exists(source)}
+        result = dict(result, output=_output(out_path, out_name))
+        if queue.finish(job['id'], worker, result, moves) and result['status'] == 'ok':
+            # Attempts whose worker was lost leave partial outputs behind
+            stale = glob.glob(os.path.join(glob.escape(out_path), 
+                                            ATTEMPT_NAME.format(out_name=out_name, attempt='*')))
+        else:
+            stale = list(moves)
+        for path in stale:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        completed += 1
+    return completed
+
+
+def _output(out_path, out_name):
+    return os.path.join(out_path, f'{out_name}.hdf5')
+
+
+def run_sweep(queue_path, out_path='.', workers=None, lease_seconds=600, max_attempts=3):
+    """ Run all ready jobs of a queue with a pool of worker processes.
+
+    Args:
+        queue_path: Location of the SQLite queue.
+        out_path: A string representing the location to save job outputs.
+        workers: The number of worker processes (int). If None, the number
+            of processors on the machine is used.
+        lease_seconds: How long a job is leased for (float).
+        max_attempts: The number of times a job is attempted (int).
+
+    Returns:
+        status: A dictionary of the number of jobs with each status.
+    """
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_worker, queue_path, out_path,
+                                    lease_seconds=lease_seconds, max_attempts=max_attempts) 
+                    for _ in range(workers)]
+        completed = sum(future.result() for future in futures)
+    status = SweepQueue(queue_path).status()
+    print(f'Ran {completed} job(s). Queue status: {status}')
+    return status
+
+
+def main(argv=None):
+    """Command line entry point, see the module docstring"""
+    parser = argparse.ArgumentParser(description='Run a resumable sbelt parameter sweep.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('add', help='Add the jobs of a design to a queue.')
+    add.add_argument('queue', help='Location of the SQLite queue.')
+    add.add_argument('design', help='JSON file with a design spec (see design_from_spec).')
+    add.add_argument('--replicas', type=int, default=1, help='Jobs per parameter set.')
+    add.add_argument('--root-seed', type=int, default=0, help='Seed to derive job seeds from.')
+
+    work = commands.add_parser('work', help='Run the ready jobs of a queue.')
+    work.add_argument('queue', help='Location of the SQLite queue.')
+    work.add_argument('--out-path', default='.', help='Location to save job outputs.')
+    work.add_argument('--workers', type=int, default=None, help='Number of worker processes.')
+    work.add_argument('--lease-seconds', type=float, default=600, help='Job lease length.')
+    work.add_argument('--max-attempts', type=int, default=3, help='Attempts per job.')
+
+    status = commands.add_parser('status', help='Show the number of jobs with each status.')
+    status.add_argument('queue', help='Location of the SQLite queue.')
+    args = parser.parse_args(argv)
+
+    if args.command == 'add':
+        with open(args.design) as f:
+            design, base_parameters = design_from_spec(json.load(f))
+        added = SweepQueue(args.queue).add_jobs(design, base_parameters, args.replicas,
+                                                    args.root_seed)
+        print(f'Added {added} job(s).')
+    elif args.command == 'work':
+        run_sweep(args.queue, args.out_path, args.workers, args.lease_seconds, 
+                    args.max_attempts)
+    else:
+        print(SweepQueue(args.queue).status())
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,250 @@
+"""
+This module contains the phase timers of a run. When timing is enabled
+the time spent in each phase of every iteration (selecting event
+particles, drawing hops, computing vertices, moving particles, updating
+flux and particle states, writing snapshots and checkpoints, ...) is
+measured. Totals, means, maxima and percentiles of each phase are written to
+final_metrics/timing and printed when the run finishes. The 'full' mode also writes
+the time of each phase in each iteration.
+
+Percentiles are estimated from histograms with log-spaced bins (see
+EDGES) so memory does not grow with the number of iterations, except
+for the per-iteration times of the 'full' mode.
+
+The numba engine runs many iterations per call of its compiled kernel,
+so its iterations are timed as a single 'kernel' phase. The times of
+the phases of a kernel call (kernel, validation, snapshot) are spread
+evenly over the iterations it ran.
+
+Attributes:
+    PHASES: The phases of the reference and lattice engines.
+    NUMBA_PHASES: The phases of the numba engine.
+    TIMING: The timing modes of a run.
+    EDGES: Histogram bin edges, in seconds.
+    PERCENTILES: The percentiles reported for each phase.
+"""
+import math
+import time
+
+import numpy as np
+
+PHASES = ['event_selection', 'hops', 'vertices', 'move', 'flux', 'states', 'validation',
+          'ages', 'statistics', 'snapshot', 'checkpoint']
+NUMBA_PHASES = ['kernel', 'validation', 'statistics', 'snapshot', 'checkpoint']
+TIMING = ['off', 'summary', 'full']
+EDGES = np.logspace(-7, 3, 101)
+_LOG_MIN, _BINS_PER_DECADE = -7, 10
+PERCENTILES = [50, 90, 99]
+
+
+class NullTimer():
+    """ A timer which does nothing, used when timing is off. Its methods
+    cost a function call so that timing is negligible when disabled. """
+    def __bool__(self):
+        return False
+
+    def start(self, iteration):
+        pass
+
+    def lap(self, phase):
+        pass
+
+    def finish(self, count=1):
+        pass
+
+    def timed(self, phase, function, *args):
+        return function(*args)
+
+
+NULL_TIMER = NullTimer()
+
+
+class PhaseTimer():
+    """ Times the phases of iterations.
+
+    An iteration is timed by calling start, then lap at the end of each
+    phase (the time since the previous lap is added to the phase), and
+    finish once the iteration is done.
+
+    Attributes:
+        phases: A Python list of the phase names.
+        totals: A NumPy array of the total seconds spent in each phase.
+        calls: A NumPy array of the number of iterations each phase ran in.
+        maxima: A NumPy array of the longest time of each phase.
+        counts: A phases x bins NumPy array of histograms of each phase's times.
+        per_iteration: An iterations x phases NumPy array of the seconds
+            spent in each phase of each iteration (NaN if it did not run),
+            or None if per-iteration times are not kept.
+    """
+    def __init__(self, phases, iterations, per_iteration=False):
+        self.phases = list(phases)
+        self._columns = {phase: column for column, phase in enumerate(self.phases)}
+        # The accumulators are plain Python lists, as updating a few
+        # phases each iteration is much cheaper without NumPy calls
+        self._totals = [0.0] * len(self.phases)
+        self._calls = [0] * len(self.phases)
+        self._maxima = [0.0] * len(self.phases)
+        self._counts = [[0] * (len(EDGES) - 1) for _ in self.phases]
+        self.per_iteration = None
+        if per_iteration:
+            self.per_iteration = np.full((iterations, len(self.phases)), np.nan, dtype=np.float32)
+        self._current = [0.0] * len(self.phases)
+        self._ran = set()
+        self._iteration = 0
+        self._last_row = 0
+        self._last = 0.0
+
+    def start(self, iteration):
+        """Start timing an iteration (int)"""
+        self._iteration = iteration
+        self._current = [0.0] * len(self.phases)
+        self._ran.clear()
+        self._last = time.perf_counter()
+
+    def lap(self, phase):
+        """Add the time since the previous lap (or start) to a phase"""
+        now = time.perf_counter()
+        column = self._columns[phase]
+        self._current[column] += now - self._last
+        self._ran.add(column)
+        self._last = now
+
+    def finish(self, count=1):
+        """ Record the iteration started last. If it stands for count
+        iterations (a numba kernel call), its times are spread evenly over them. """
+        self._last_row = self._iteration + count - 1
+        row = [np.nan] * len(self.phases)
+        for column in self._ran:
+            row[column] = self._current[column] / count
+            self._record(column, row[column], count)
+        if self.per_iteration is not None:
+            self.per_iteration[self._iteration:self._last_row + 1] = row
+
+    def timed(self, phase, function, *args):
+        """ Call function(*args) between iterations, adding its time to
+        phase in the last iteration recorded. Returns what function returns. """
+        start = time.perf_counter()
+        result = function(*args)
+        seconds = time.perf_counter() - start
+        column = self._columns[phase]
+        self._record(column, seconds, 1)
+        if self.per_iteration is not None:
+            self.per_iteration[self._last_row, column] = np.nansum(
+                                            [self.per_iteration[self._last_row, column], seconds])
+        return result
+
+    def _record(self, column, seconds, count):
+        self._totals[column] += seconds * count
+        self._calls[column] += count
+        if seconds > self._maxima[column]:
+            self._maxima[column] = seconds
+        bin = 0
+        if seconds > 0:
+            bin = int((math.log10(seconds) - _LOG_MIN) * _BINS_PER_DECADE)
+            bin = min(max(bin, 0), len(EDGES) - 2)
+        self._counts[column][bin] += count
+
+    @property
+    def totals(self):
+        return np.array(self._totals)
+
+    @property
+    def calls(self):
+        return np.array(self._calls, dtype=np.int64)
+
+    @property
+    def maxima(self):
+        return np.array(self._maxima)
+
+    @property
+    def counts(self):
+        return np.array(self._counts, dtype=np.int64).reshape(len(self.phases), len(EDGES) - 1)
+
+    def percentile(self, q):
+        """ Returns a NumPy array of the estimated q-th percentile of each phase's
+        times, interpolated in log space within histogram bins (NaN if a phase never ran). """
+        result = np.full(len(self.phases), np.nan)
+        for column, counts in enumerate(self.counts):
+            total = counts.sum()
+            if total == 0:
+                continue
+            cumulative = np.cumsum(counts)
+            rank = q / 100 * total
+            bin = min(int(np.searchsorted(cumulative, rank)), len(counts) - 1)
+            below = cumulative[bin] - counts[bin]
+            fraction = (rank - below) / counts[bin] if counts[bin] else 0
+            low, high = np.log(EDGES[bin]), np.log(EDGES[bin + 1])
+            result[column] = min(np.exp(low + fraction * (high - low)), self._maxima[column])
+        return result
+
+    def summary(self):
+        """Returns a dictionary of the totals, calls, means, maxima and percentiles of each phase"""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.where(self.calls > 0, self.totals / self.calls, np.nan)
+        summary = {'total': self.totals, 'calls': self.calls, 'mean': means, 'max': self.maxima}
+        for q in PERCENTILES:
+            summary[f'p{q}'] = self.percentile(q)
+        return summary
+
+    def write(self, grp):
+        """Write the summary, histograms and per-iteration times to an h5py Group"""
+        grp['phases'] = np.array(self.phases, dtype='S')
+        for key, value in self.summary().items():
+            grp[key] = value
+        grp['edges'] = EDGES
+        grp['counts'] = self.counts
+        if self.per_iteration is not None:
+            grp.create_dataset('iterations', data=self.per_iteration, compression='gzip')
+
+    def format_summary(self):
+        """Returns the summary as a table (string)"""
+        summary = self.summary()
+        run_total = sum(self._totals)
+        lines = [f'{"phase":<16} {"total (s)":>10} {"share":>7} {"mean (ms)":>10} '
+                    + ' '.join(f'{f"p{q} (ms)":>10}' for q in PERCENTILES)]
+        for column, phase in enumerate(self.phases):
+            if not self._calls[column]:
+                continue
+            share = self._totals[column] / run_total if run_total else 0
+            lines.append(f'{phase:<16} {self._totals[column]:>10.3f} {share:>7.1%} '
+                            f'{summary["mean"][column] * 1e3:>10.4f} '
+                            + ' '.join(f'{summary[f"p{q}"][column] * 1e3:>10.4f}'
+                                        for q in PERCENTILES))
+        return '\n'.join(lines)
+
+    def get_state(self):
+        """Returns the state of the timer as a dictionary of arrays"""
+        state = {'totals': self.totals, 'calls': self.calls, 'maxima': self.maxima,
+                 'counts': self.counts}
+        if self.per_iteration is not None:
+            state['per_iteration'] = self.per_iteration
+        return state
+
+    def set_state(self, state):
+        """ Restore a state returned by get_state. Per-iteration times are
+        restored into the first rows, so a run can be extended. """
+        self._totals = [float(value) for value in state['totals']]
+        self._calls = [int(value) for value in state['calls']]
+        self._maxima = [float(value) for value in state['maxima']]
+        self._counts = np.asarray(state['counts'], dtype=np.int64).tolist()
+        if self.per_iteration is not None and 'per_iteration' in state:
+            saved = state['per_iteration']
+            self.per_iteration[:len(saved)] = saved
+
+
+def phase_timer(timing, engine, iterations):
+    """ Returns the timer of a run.
+
+    Args:
+        timing: The run's timing mode, one of TIMING.
+        engine: The engine the run uses.
+        iterations: The number of iterations of the run (int).
+
+    Returns:
+        timer: NULL_TIMER if timing is 'off', otherwise a PhaseTimer of the
+            engine's phases.
+    """
+    if timing == 'off':
+        return NULL_TIMER
+    phases = NUMBA_PHASES if engine == 'numba' else PHASES
+    return PhaseTimer(phases, iterations, per_iteration=timing == 'full')
@@ -21,13 +21,16 @@ def validate_arguments(parameters):
     """
     # TODO: a lot of repeated code here - could be made prettier/simpler
     boolean_type_msg = "{failing_var} must be of type boolean (True/False)."
-    boolean_type_vars = ['gauss', 'height_dependant_entr']
+    boolean_type_vars = ['gauss', 'height_dependant_entr', 'debug', 'background_writer', 'shuffle']
     for key in boolean_type_vars:
         if not isinstance(parameters[key], bool):
             raise ValueError(boolean_type_msg.format(failing_var=key))
     
     int_type_msg = "{failing_var} must be of type int."
-    int_type_vars = ['bed_length', 'num_subregions', 'level_limit', 'iterations', 'data_save_interval']
+    int_type_vars = ['bed_length', 'num_subregions', 'level_limit', 'iterations', 'data_save_interval', \
+                        'checkpoint_interval', 'keyframe_interval', 'writer_queue_size', \
+                        'compression_level', 'snapshot_chunk_bytes', 'flux_chunk_size', \
+                        'profile_start', 'profile_stop']
     for key in int_type_vars:
         if not isinstance(parameters[key], int):
             raise ValueError(int_type_msg.format(failing_var=key))
@@ -39,24 +42,48 @@ def validate_arguments(parameters):
             raise ValueError(number_type_msg.format(failing_var=key))
 
     string_type_msg = "{failing_var} must be of type string."
-    string_type_vars = ['out_path', 'out_name']
+    string_type_vars = ['out_path', 'out_name', 'statistics']
     for key in string_type_vars:
         if not isinstance(parameters[key], str):
             raise ValueError(string_type_msg.format(failing_var=key))
 
     greater_than_0_msg = "{failing_var} must be > 0."
     greater_than_0_vars = ['bed_length','particle_pack_dens', 'particle_diam', 'num_subregions', 'level_limit', \
-                                'iterations', 'gauss_sigma', 'data_save_interval']
+                                'iterations', 'gauss_sigma', 'data_save_interval', 'keyframe_interval', \
+                                'writer_queue_size', 'snapshot_chunk_bytes']
     for key in greater_than_0_vars:
         if parameters[key] <= 0:
             raise ValueError(greater_than_0_msg.format(failing_var=key))
     
     geq_than_0_msg = "{failing_var} must be >= 0."
-    geq_than_0_vars = ['poiss_lambda', 'gauss_mu']
+    geq_than_0_vars = ['poiss_lambda', 'gauss_mu', 'checkpoint_interval', 'compression_level', \
+                        'flux_chunk_size', 'profile_start', 'profile_stop']
     for key in geq_than_0_vars:
         if parameters[key] < 0:
             raise ValueError(geq_than_0_msg.format(failing_var=key))
     
+    valid_option_msg = "{failing_var} must be one of {options}."
+    valid_option_vars = {'engine': ['reference', 'lattice', 'numba'],
+                         'particle_layout': ['legacy', 'compact', 'compact32'],
+                         'storage_layout': ['v1', 'v2', 'delta'],
+                         'compression': ['none', 'lzf', 'gzip'],
+                         'float_precision': ['float64', 'float32'],
+                         'timing': ['off', 'summary', 'full'],
+                         'profile': ['off', 'cprofile', 'sampling']}
+    for key, options in valid_option_vars.items():
+        if parameters[key] not in options:
+            raise ValueError(valid_option_msg.format(failing_var=key, options=options))
+
+    if parameters['seed'] is not None:
+        if not isinstance(parameters['seed'], int) or parameters['seed'] < 0:
+            raise ValueError("seed must be None or a non-negative int.")
+
+    if parameters['compression_level'] > 9:
+        raise ValueError("compression_level must be <= 9.")
+
+    if parameters['profile_stop'] and parameters['profile_stop'] <= parameters['profile_start']:
+        raise ValueError("profile_stop must be 0 or > profile_start.")
+
     valid_filename_msg = "{failing_var} cannot contain spaces or invalid characters."
     valid_filename_vars = ['out_name']
     for key in valid_filename_vars:
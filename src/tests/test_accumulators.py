@@ -0,0 +1,194 @@
+"""
+A module for unit tests of the accumulators module
+"""
+
+import unittest
+import tempfile
+import numpy as np
+import h5py
+
+from ..sbelt import accumulators
+from ..sbelt import numba_engine
+from ..sbelt import storage
+from ..sbelt import sbelt_runner
+
+
+class TestBuildingBlocks(unittest.TestCase):
+
+    def test_running_moments_match_numpy(self):
+        values = np.random.default_rng(0).normal(3, 2, 1000)
+        moments = accumulators.RunningMoments()
+        for batch in np.array_split(values, 37):
+            moments.add(batch)
+        moments.add([])
+        self.assertEqual(moments.count, 1000)
+        self.assertAlmostEqual(moments.mean, values.mean())
+        self.assertAlmostEqual(moments.variance, values.var())
+        self.assertEqual((moments.minimum, moments.maximum), (values.min(), values.max()))
+
+    def test_histogram_clips_values_into_range(self):
+        histogram = accumulators.Histogram([0, 1, 2, 4])
+        histogram.add([-5, 0.5, 1, 3, 10])
+        self.assertIsNone(np.testing.assert_array_equal(histogram.counts, [2, 1, 2]))
+
+    def test_reservoir_is_uniform_and_resumable(self):
+        reservoir = accumulators.Reservoir(size=100, seed=1)
+        reservoir.add(np.arange(500))
+        copy = accumulators.Reservoir(size=100)
+        copy.set_state(reservoir.get_state())
+        reservoir.add(np.arange(500, 1000))
+        copy.add(np.arange(500, 1000))
+        self.assertEqual(reservoir.seen, 1000)
+        self.assertIsNone(np.testing.assert_array_equal(reservoir.samples, copy.samples))
+        self.assertEqual(len(np.unique(reservoir.samples)), 100)
+        # A uniform sample of 0..999 has a mean close to 500
+        self.assertLess(abs(reservoir.samples.mean() - 500), 100)
+
+    def test_time_average_weights_values_by_duration(self):
+        average = accumulators.TimeAverage([0.0, 2.0])
+        average.set(3, [0], [1.0])
+        with tempfile.TemporaryFile() as tmp, h5py.File(tmp, 'w') as f:
+            average.write(f, 0, 4)
+            self.assertIsNone(np.testing.assert_allclose(f['mean'][()], [0.25, 2.0]))
+            self.assertIsNone(np.testing.assert_allclose(f['std'][()], [np.sqrt(0.1875), 0]))
+            self.assertIsNone(np.testing.assert_array_equal(f['max'][()], [1.0, 2.0]))
+
+    def test_unknown_statistic_raises_value_error(self):
+        self.assertEqual(accumulators.parse_names(' age, hops,'), ['age', 'hops'])
+        with self.assertRaises(ValueError):
+            accumulators.parse_names('age,median')
+
+
+class TestRunStatistics(unittest.TestCase):
+    """Statistics of a run should equal those computed from every snapshot."""
+
+    kwargs = {'iterations': 60, 'bed_length': 20, 'num_subregions': 2, 'seed': 4,
+                'statistics': 'age,residence,hops,subregion_counts,elevation'}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        sbelt_runner.run(out_path=cls.tmp_dir.name, engine='lattice', **cls.kwargs)
+        with h5py.File(f'{cls.tmp_dir.name}/sbelt-out.hdf5', 'r') as f:
+            cls.initial = f['initial_values/model'][()]
+            cls.snapshots = list(storage.iter_snapshots(f))
+            cls.avg_age = f['final_metrics/avg_age'][()]
+            cls.statistics = {}
+            f['final_metrics/statistics'].visititems(
+                lambda name, item: cls.statistics.update({name: item[()]}) 
+                                    if isinstance(item, h5py.Dataset) else None)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def test_age_distribution_matches_avg_age(self):
+        ages = np.concatenate([model[:,5] for _, model, _ in self.snapshots])
+        self.assertEqual(self.statistics['age/count'], len(ages))
+        self.assertEqual(self.statistics['age/counts'].sum(), len(ages))
+        self.assertAlmostEqual(self.statistics['age/mean'], self.avg_age.mean())
+        self.assertAlmostEqual(self.statistics['age/std'], ages.std())
+
+    def test_residence_and_hops_match_snapshots(self):
+        residence, hops, exits, entries = [], [], 0, 0
+        previous = self.initial
+        for _, model, event_ids in self.snapshots:
+            before, after = previous[event_ids, 0], model[event_ids, 0]
+            residence.extend(previous[event_ids, 5])
+            in_stream = (before != -1) & (after != -1)
+            hops.extend(after[in_stream] - before[in_stream])
+            exits += np.sum((before != -1) & (after == -1))
+            entries += np.sum((before == -1) & (after != -1))
+            previous = model
+        self.assertEqual(self.statistics['residence/count'], len(residence))
+        self.assertAlmostEqual(self.statistics['residence/mean'], np.mean(residence))
+        self.assertEqual(self.statistics['hops/count'], len(hops))
+        self.assertAlmostEqual(self.statistics['hops/mean'], np.mean(hops))
+        self.assertAlmostEqual(self.statistics['hops/std'], np.std(hops))
+        self.assertEqual((self.statistics['hops/exits'], self.statistics['hops/entries']), 
+                            (exits, entries))
+        self.assertTrue(set(self.statistics['hops/samples']) <= set(hops))
+
+    def test_subregion_counts_match_snapshots(self):
+        boundaries = self.statistics['subregion_counts/left_boundaries']
+        counts = np.array([[np.sum((model[:,0] >= left) & (model[:,0] < left + 10)) 
+                                for left in boundaries] for _, model, _ in self.snapshots])
+        self.assertIsNone(np.testing.assert_allclose(self.statistics['subregion_counts/mean'],
+                                                        counts.mean(axis=0)))
+        self.assertIsNone(np.testing.assert_allclose(self.statistics['subregion_counts/std'],
+                                                        counts.std(axis=0), atol=1e-9))
+
+    def test_elevation_matches_snapshots(self):
+        x = self.statistics['elevation/x']
+        elevations = np.zeros((len(self.snapshots), len(x)))
+        for row, (_, model, _) in zip(elevations, self.snapshots):
+            in_stream = model[model[:,0] != -1]
+            np.maximum.at(row, np.searchsorted(x, in_stream[:,0]), in_stream[:,2])
+        self.assertIsNone(np.testing.assert_allclose(self.statistics['elevation/mean'],
+                                                        elevations.mean(axis=0)))
+        self.assertIsNone(np.testing.assert_array_equal(self.statistics['elevation/max'],
+                                                        elevations.max(axis=0)))
+
+    def test_statistics_do_not_change_the_run(self):
+        with tempfile.TemporaryDirectory() as out_path:
+            sbelt_runner.run(out_path=out_path, engine='lattice', 
+                                **dict(self.kwargs, statistics=''))
+            with h5py.File(f'{out_path}/sbelt-out.hdf5', 'r') as f:
+                self.assertNotIn('statistics', f['final_metrics'])
+                for (_, expected, _), (_, model, _) in zip(self.snapshots, storage.iter_snapshots(f)):
+                    self.assertIsNone(np.testing.assert_array_equal(model, expected))
+
+    @unittest.skipUnless(numba_engine.NUMBA_AVAILABLE, 'Numba is not installed')
+    def test_numba_statistics_do_not_depend_on_kernel_blocks(self):
+        """The numba kernel runs the iterations between snapshots in one call."""
+        results = []
+        for data_save_interval in [1, 20]:
+            with tempfile.TemporaryDirectory() as out_path:
+                sbelt_runner.run(out_path=out_path, engine='numba', 
+                                    data_save_interval=data_save_interval, **self.kwargs)
+                with h5py.File(f'{out_path}/sbelt-out.hdf5', 'r') as f:
+                    statistics = {}
+                    f['final_metrics/statistics'].visititems(
+                        lambda name, item: statistics.update({name: item[()]}) 
+                                            if isinstance(item, h5py.Dataset) else None)
+                    results.append(statistics)
+        self.assertEqual(sorted(results[0]), sorted(self.statistics))
+        for name, value in results[0].items():
+            self.assertIsNone(np.testing.assert_array_equal(value, results[1][name]), name)
+
+    def test_custom_statistics_can_be_registered(self):
+        class EventCount(accumulators.Statistic):
+            def __init__(self, parameters, model_particles, subregions, h):
+                super().__init__(parameters, model_particles, subregions, h)
+                self.events = 0
+            def update(self, iteration, event_ids, before, model_particles):
+                self.events += len(event_ids)
+            def write(self, grp, iterations, model_particles):
+                grp['events'] = self.events
+
+        # Register with the accumulators module the runner imported
+        sbelt_runner.accumulators.register('event_count', EventCount)
+        self.addCleanup(sbelt_runner.accumulators.STATISTICS.pop, 'event_count')
+        with tempfile.TemporaryDirectory() as out_path:
+            sbelt_runner.run(out_path=out_path, engine='lattice', 
+                                **dict(self.kwargs, statistics='event_count'))
+            with h5py.File(f'{out_path}/sbelt-out.hdf5', 'r') as f:
+                events = f['final_metrics/statistics/event_count/events'][()]
+        self.assertEqual(events, self.statistics['residence/count'])
+
+    def test_incomplete_statistic_fails_before_the_run(self):
+        class Unwritten(accumulators.Statistic):
+            def update(self, iteration, event_ids, before, model_particles):
+                pass
+
+        sbelt_runner.accumulators.register('unwritten', Unwritten)
+        self.addCleanup(sbelt_runner.accumulators.STATISTICS.pop, 'unwritten')
+        with tempfile.TemporaryDirectory() as out_path:
+            with self.assertRaises(TypeError):
+                sbelt_runner.run(out_path=out_path, **dict(self.kwargs, statistics='unwritten'))
+            with h5py.File(f'{out_path}/sbelt-out.hdf5', 'r') as f:
+                self.assertEqual(len(storage.snapshot_iterations(f)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+"""
+A module for unit tests of the benchmark module
+"""
+
+import unittest
+import json
+import os
+import tempfile
+
+from ..sbelt import benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+
+    grid = {'bed_length': [20], 'particle_pack_dens': [0.78], 'num_subregions': [2],
+            'poiss_lambda': [2, 5]}
+
+    def test_times_each_benchmark_and_case(self):
+        results = benchmark.run_benchmarks(self.grid, repeat=2)
+        self.assertEqual(len(results['results']), 2 * len(benchmark.BENCHMARKS))
+        self.assertEqual(results['metadata']['seed'], benchmark.SEED)
+        for result in results['results']:
+            self.assertIn(result['benchmark'], benchmark.BENCHMARKS)
+            self.assertTrue(0 < result['min'] <= result['median'])
+            self.assertTrue(1 <= result['number'] <= benchmark.MAX_NUMBER)
+        self.assertEqual(len(benchmark.format_results(results).splitlines()), 
+                            1 + len(results['results']))
+
+    def test_cases_are_reproducible(self):
+        first = benchmark.build_case(benchmark.grid_cases(self.grid)[1])
+        second = benchmark.build_case(benchmark.grid_cases(self.grid)[1])
+        self.assertEqual(first['event_ids'].tolist(), second['event_ids'].tolist())
+        self.assertEqual(first['moved_particles'].tolist(), second['moved_particles'].tolist())
+
+    def test_compare_flags_regressions(self):
+        baseline = benchmark.run_benchmarks(self.grid, ['update_flux', 'iteration'], repeat=1)
+        current = json.loads(json.dumps(baseline))
+        current['results'][0]['median'] *= 2
+        comparison = benchmark.compare(baseline, current)
+        self.assertEqual([row['regression'] for row in comparison], [True, False, False, False])
+        self.assertEqual(comparison[0]['ratio'], 2)
+
+    def test_main_writes_json_and_compares(self):
+        with tempfile.TemporaryDirectory() as out_path:
+            path = os.path.join(out_path, 'results.json')
+            arguments = ['--bed-length', '20', '--pack-dens', '0.5', '--num-subregions', '2',
+                            '--poiss-lambda', '2', '--benchmarks', 'update_flux', '--repeat', '1']
+            self.assertEqual(benchmark.main(arguments + ['--json', path]), 0)
+            with open(path) as f:
+                self.assertEqual(len(json.load(f)['results']), 1)
+            self.assertEqual(benchmark.main(arguments + ['--compare', path, 
+                                                            '--threshold', '1000']), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+"""
+A module for unit tests of the ensemble module
+"""
+
+import unittest
+import json
+import os
+import tempfile
+import numpy as np
+import h5py
+
+from ..sbelt import ensemble
+
+SMALL_RUN = {'iterations': 5, 'bed_length': 10, 'num_subregions': 2}
+
+
+class TestMemberSeeds(unittest.TestCase):
+
+    def test_same_root_seed_same_seeds(self):
+        root_seed, seeds = ensemble.member_seeds(8, 5)
+        _, same_seeds = ensemble.member_seeds(8, 5)
+        self.assertEqual(root_seed, 8)
+        self.assertEqual(seeds, same_seeds)
+        self.assertEqual(len(set(seeds)), 5)
+        for seed in seeds:
+            self.assertTrue(0 <= seed < np.iinfo(np.int64).max)
+
+    def test_no_root_seed_records_entropy(self):
+        root_seed, seeds = ensemble.member_seeds(None, 3)
+        self.assertEqual(ensemble.member_seeds(root_seed, 3)[1], seeds)
+
+
+class TestRunEnsemble(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.out_path = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_members_write_outputs_and_manifest(self):
+        parameter_sets = [SMALL_RUN, dict(SMALL_RUN, gauss=True)]
+        manifest = ensemble.run_ensemble(parameter_sets, replicas=2, root_seed=3, workers=2,
+                                            out_path=self.out_path, out_name='ens')
+        self.assertEqual(len(manifest['members']), 4)
+        with open(os.path.join(self.out_path, 'ens', ensemble.MANIFEST_NAME)) as f:
+            self.assertEqual(json.load(f)['root_seed'], 3)
+
+        _, expected_seeds = ensemble.member_seeds(3, 4)
+        for member, seed in zip(manifest['members'], expected_seeds):
+            self.assertEqual(member['status'], 'ok')
+            self.assertEqual(member['seed'], seed)
+            self.assertTrue(member['wall_time'] > 0)
+            with h5py.File(member['output'], 'r') as f:
+                self.assertEqual(f['params/seed'][()], seed)
+                self.assertEqual(f['params/gauss'][()], member['parameters'].get('gauss', False))
+
+    def test_failed_member_is_reported(self):
+        parameter_sets = [SMALL_RUN, dict(SMALL_RUN, level_limit=-1)]
+        manifest = ensemble.run_ensemble(parameter_sets, seeds=[1, 2], workers=1,
+                                            out_path=self.out_path)
+        statuses = [member['status'] for member in manifest['members']]
+        self.assertEqual(statuses, ['ok', 'failed'])
+        self.assertIn('ValueError', manifest['members'][1]['error'])
+
+    def test_reserved_parameters_raise_value_error(self):
+        with self.assertRaises(ValueError):
+            ensemble.run_ensemble(dict(SMALL_RUN, seed=1), out_path=self.out_path)
+
+    def test_wrong_number_of_seeds_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            ensemble.run_ensemble(SMALL_RUN, replicas=2, seeds=[1], out_path=self.out_path)
+
+    def test_command_line(self):
+        parameters_file = os.path.join(self.out_path, 'parameters.json')
+        with open(parameters_file, 'w') as f:
+            json.dump(SMALL_RUN, f)
+        status = ensemble.main([parameters_file, '--replicas', '2', '--root-seed', '5',
+                                '--workers', '1', '--out-path', self.out_path])
+        self.assertEqual(status, 0)
+        with open(os.path.join(self.out_path, 'sbelt-ensemble', ensemble.MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+        self.assertEqual([member['seed'] for member in manifest['members']],
+                            ensemble.member_seeds(5, 2)[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
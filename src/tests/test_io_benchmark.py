@@ -0,0 +1,35 @@
+"""
+A module for unit tests of the io_benchmark module
+"""
+
+import unittest
+import json
+import os
+import tempfile
+
+from ..sbelt import io_benchmark
+
+
+class TestIOBenchmark(unittest.TestCase):
+
+    def test_reports_each_option(self):
+        options = [{'compression': 'none'}, {'storage_layout': 'v2', 'compression': 'lzf'}]
+        results = io_benchmark.run_benchmark(options, repeat=1, iterations=10, bed_length=20)
+        self.assertEqual([result['options'] for result in results], options)
+        for result in results:
+            self.assertTrue(result['seconds'] > 0)
+            self.assertTrue(result['mb_per_s'] > 0)
+            self.assertTrue(result['file_bytes'] > 0)
+        self.assertEqual(len(io_benchmark.format_results(results).splitlines()), 3)
+
+    def test_main_writes_json(self):
+        with tempfile.TemporaryDirectory() as out_path:
+            path = os.path.join(out_path, 'results.json')
+            io_benchmark.main(['--iterations', '5', '--bed-length', '20', '--repeat', '1', 
+                                '--json', path])
+            with open(path) as f:
+                self.assertEqual(len(json.load(f)), len(io_benchmark.OPTIONS))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,372 @@
+"""
+A module for unit tests of the lattice module
+"""
+
+import unittest
+import random
+import tempfile
+from unittest import mock
+import numpy as np
+import h5py
+
+from ..sbelt import logic
+from ..sbelt import lattice
+from ..sbelt import sbelt_runner
+
+ATTR_COUNT = 7 # Number of attributes associated with a Particle
+
+
+def build_test_stream(bed_length, diam, pack_frac, level_limit, h):
+    """Build bed and model particles the same way sbelt_runner does"""
+    bed_particles = logic.build_streambed(bed_length, diam)
+    available_vertices = logic.compute_available_vertices(np.empty((0, ATTR_COUNT)),
+                                                            bed_particles, diam, level_limit)
+    model_particles, model_supp = logic.set_model_particles(bed_particles, available_vertices,
+                                                            diam, pack_frac, h)
+    return bed_particles, model_particles, model_supp
+
+
+class TestLatticeBed(unittest.TestCase):
+    """ Unit tests for the LatticeBed class.
+
+    Attributes:
+        diam: diameter for the test particles
+        h: float derived from diam used in the
+            geometric calculations of particle elevations
+        level_limit: the level limit for the test stream
+    """
+    def setUp(self):
+        self.diam = 0.5
+        self.h = np.sqrt(np.square(self.diam) - np.square(self.diam / 2))
+        self.level_limit = 3
+        random.seed(5)
+        np.random.seed(5)
+        self.bed_particles, self.model_particles, self.model_supp = build_test_stream(
+                                                            10, self.diam, 0.5,
+                                                            self.level_limit, self.h)
+
+    def test_available_vertices_match_logic(self):
+        """The lattice available vertices should equal those computed
+        by logic.compute_available_vertices."""
+        lattice_bed = lattice.LatticeBed(self.bed_particles, self.model_particles,
+                                            self.diam, self.level_limit, self.h)
+        expected = logic.compute_available_vertices(self.model_particles, self.bed_particles,
+                                                        self.diam, self.level_limit)
+        self.assertIsNone(np.testing.assert_array_equal(np.sort(expected),
+                                                        lattice_bed.available_vertices()))
+
+    def test_lifted_available_vertices_match_logic(self):
+        """Lifting particles should free the same vertices as
+        passing lifted_particles to logic.compute_available_vertices."""
+        lattice_bed = lattice.LatticeBed(self.bed_particles, self.model_particles,
+                                            self.diam, self.level_limit, self.h)
+        lifted = np.array([0, 2], dtype=np.intp)
+        lattice_bed.lift(lifted)
+        expected = logic.compute_available_vertices(self.model_particles, self.bed_particles,
+                                                        self.diam, self.level_limit,
+                                                        lifted_particles=lifted)
+        self.assertIsNone(np.testing.assert_array_equal(np.sort(expected),
+                                                        lattice_bed.available_vertices()))
+
+    def test_place_returns_same_as_place_particle(self):
+        """Placing a particle on a second level vertex should return the
+        same location and supports as logic.place_particle."""
+        lattice_bed = lattice.LatticeBed(self.bed_particles, self.model_particles,
+                                            self.diam, self.level_limit, self.h)
+        vertex = lattice_bed.available_vertices()[-1]
+        particle = np.copy(self.model_particles[0])
+        particle[0] = vertex
+        expected = logic.place_particle(particle, self.model_particles,
+                                            self.bed_particles, self.h)
+        lattice_bed.lift([0])
+        placed = lattice_bed.place(0, lattice_bed.slot(vertex))
+        self.assertEqual(expected, placed)
+
+    def test_above_level_limit_returns_no_vertices(self):
+        """If the only vertex would be above the level limit
+        then no vertices should be available."""
+        bed_particles = logic.build_streambed(1, self.diam)
+        model_particles = np.zeros((1, ATTR_COUNT))
+        model_particles[0] = [0.5, self.diam, round(self.h, 2), 0, 1, 0, 0]
+        lattice_bed = lattice.LatticeBed(bed_particles, model_particles,
+                                            self.diam, 1, self.h)
+        self.assertEqual(lattice_bed.available_vertices().size, 0)
+
+    def test_maintained_availability_matches_recompute(self):
+        """After lifting and placing particles, the incrementally maintained
+        availability should equal a full recomputation."""
+        lattice_bed = lattice.LatticeBed(self.bed_particles, self.model_particles,
+                                            self.diam, self.level_limit, self.h)
+        all_slots = np.arange(1, len(lattice_bed.levels)-1)
+        for _ in range(5):
+            # Only active particles can be lifted
+            event_ids = np.flatnonzero((self.model_particles[:,4] == 1)
+                                        & (self.model_particles[:,0] != -1))[:2]
+            lattice_bed.lift(event_ids)
+            event_particles = np.copy(self.model_particles[event_ids])
+            event_particles[:,0] = event_particles[:,0] + self.diam
+            lattice.move_model_particles(event_particles, self.model_particles,
+                                            self.model_supp, lattice_bed)
+            logic.update_particle_states(self.model_particles, self.model_supp)
+            expected = lattice_bed.compute_available(all_slots)
+            self.assertIsNone(np.testing.assert_array_equal(expected,
+                                                    lattice_bed.available[1:-1]))
+            # The index kept on the lattice finds the same slots
+            found = [lattice_bed.next_vertex.find(slot) for slot in all_slots]
+            closest = [np.append(np.flatnonzero(lattice_bed.available[slot:]) + slot,
+                                    len(lattice_bed.available))[0] for slot in all_slots]
+            self.assertEqual(found, closest)
+
+
+class TestSupportGraph(unittest.TestCase):
+    """ Unit tests for the SupportGraph class.
+
+    Attributes:
+        diam: diameter for the test particles
+        h: float derived from diam used in the
+            geometric calculations of particle elevations
+        level_limit: the level limit for the test stream
+    """
+    def setUp(self):
+        self.diam = 0.5
+        self.h = np.sqrt(np.square(self.diam) - np.square(self.diam / 2))
+        self.level_limit = 3
+        random.seed(9)
+        np.random.seed(9)
+        self.bed_particles, self.model_particles, self.model_supp = build_test_stream(
+                                                            10, self.diam, 0.8,
+                                                            self.level_limit, self.h)
+
+    def test_resting_on_matches_supports(self):
+        """Particles resting on a particle j should be exactly those 
+        with j as a support."""
+        support_graph = lattice.SupportGraph(self.model_particles, self.model_supp,
+                                                len(self.bed_particles))
+        for uid in self.bed_particles[:,3].astype(int):
+            expected = np.flatnonzero((self.model_supp == uid).any(axis=1))
+            self.assertCountEqual(expected, support_graph.resting_on(uid))
+            self.assertEqual(len(expected), support_graph.rest_count[support_graph._row(uid)])
+
+    def test_states_match_logic_after_events(self):
+        """States maintained through lift and place should equal those
+        from logic.update_particle_states."""
+        lattice_bed = lattice.LatticeBed(self.bed_particles, self.model_particles,
+                                            self.diam, self.level_limit, self.h)
+        support_graph = lattice.SupportGraph(self.model_particles, self.model_supp,
+                                                len(self.bed_particles))
+        subregions = logic.define_subregion_table(10, 2, 1)
+        for _ in range(20):
+            event_ids = logic.get_event_particles(2, subregions, self.model_particles,
+                                                    self.level_limit)
+            lattice_bed.lift(event_ids)
+            support_graph.lift(event_ids, self.model_particles, self.model_supp)
+            event_particles = logic.compute_hops(event_ids, self.model_particles, 0, 0.5)
+            lattice.move_model_particles(event_particles, self.model_particles,
+                                            self.model_supp, lattice_bed)
+            support_graph.place(event_ids, self.model_particles, self.model_supp)
+
+            expected = logic.update_particle_states(np.copy(self.model_particles), 
+                                                    self.model_supp)
+            self.assertIsNone(np.testing.assert_array_equal(expected[:,4], 
+                                                            self.model_particles[:,4]))
+
+
+class TestParticleBuckets(unittest.TestCase):
+    """ Unit tests for the ParticleBuckets class.
+
+    Attributes:
+        diam: diameter for the test particles
+        h: float derived from diam used in the
+            geometric calculations of particle elevations
+        level_limit: the level limit for the test stream
+        subregions: a SubregionTable for the test stream
+    """
+    def setUp(self):
+        self.diam = 0.5
+        self.h = np.sqrt(np.square(self.diam) - np.square(self.diam / 2))
+        self.level_limit = 3
+        random.seed(7)
+        np.random.seed(7)
+        self.bed_particles, self.model_particles, self.model_supp = build_test_stream(
+                                                            10, self.diam, 0.6,
+                                                            self.level_limit, self.h)
+        self.subregions = logic.define_subregion_table(10, 4, 1)
+
+    def assert_members_match_scan(self, particle_buckets):
+        for idx, subregion in enumerate(self.subregions):
+            in_subregion = ((self.model_particles[:,0] >= subregion.leftBoundary())
+                            & (self.model_particles[:,0] <= subregion.rightBoundary())
+                            & (self.model_particles[:,4] != 0))
+            members = particle_buckets.members[idx]
+            self.assertIsNone(np.testing.assert_array_equal(np.flatnonzero(in_subregion),
+                                                            np.sort(members)))
+            self.assertIsNone(np.testing.assert_array_equal(
+                                        particle_buckets.positions(idx, members),
+                                        np.arange(len(members))))
+
+    def test_initial_members_match_scan(self):
+        """Members should be the active particles within each subregion."""
+        lattice_bed = lattice.LatticeBed(self.bed_particles, self.model_particles,
+                                            self.diam, self.level_limit, self.h)
+        particle_buckets = lattice.ParticleBuckets(lattice_bed, self.subregions,
+                                                    self.model_particles)
+        self.assert_members_match_scan(particle_buckets)
+
+    def test_updated_members_match_scan(self):
+        """After moving event particles and updating the index for the
+        event particles and their supports, members should still be
+        the active particles within each subregion."""
+        lattice_bed = lattice.LatticeBed(self.bed_particles, self.model_particles,
+                                            self.diam, self.level_limit, self.h)
+        particle_buckets = lattice.ParticleBuckets(lattice_bed, self.subregions,
+                                                    self.model_particles)
+        for _ in range(10):
+            event_ids = particle_buckets.get_event_particles(2, self.subregions,
+                                                                self.model_particles,
+                                                                self.level_limit)
+            lifted_supp = self.model_supp[event_ids]
+            lattice_bed.lift(event_ids)
+            event_particles = logic.compute_hops(event_ids, self.model_particles, 0, 0.5)
+            lattice.move_model_particles(event_particles, self.model_particles,
+                                            self.model_supp, lattice_bed)
+            logic.update_particle_states(self.model_particles, self.model_supp)
+            particle_buckets.update(np.concatenate((event_ids, lifted_supp.ravel(),
+                                                    self.model_supp[event_ids].ravel())),
+                                    self.model_particles)
+            self.assert_members_match_scan(particle_buckets)
+            self.assertCountEqual(particle_buckets.ghosts,
+                                    np.flatnonzero(self.model_particles[:,0] == -1))
+
+    def test_event_particles_match_logic(self):
+        """For the same random state, a newly built index (in uid order)
+        and a full scan should select the same event particles."""
+        lattice_bed = lattice.LatticeBed(self.bed_particles, self.model_particles,
+                                            self.diam, self.level_limit, self.h)
+        particle_buckets = lattice.ParticleBuckets(lattice_bed, self.subregions,
+                                                    self.model_particles)
+        np.random.seed(3)
+        expected = logic.get_event_particles(3, self.subregions, self.model_particles,
+                                                self.level_limit, height_dependant=True)
+        np.random.seed(3)
+        event_ids = particle_buckets.get_event_particles(3, self.subregions,
+                                                            self.model_particles,
+                                                            self.level_limit,
+                                                            height_dependant=True)
+        self.assertIsNone(np.testing.assert_array_equal(expected, event_ids))
+
+    def test_rebuilt_index_selects_like_logic(self):
+        """Updates leave the members unordered, rebuild puts them back
+        in uid order."""
+        lattice_bed = lattice.LatticeBed(self.bed_particles, self.model_particles,
+                                            self.diam, self.level_limit, self.h)
+        particle_buckets = lattice.ParticleBuckets(lattice_bed, self.subregions,
+                                                    self.model_particles)
+        # Updated particles are removed and appended again
+        particle_buckets.update(particle_buckets.members[0][:2], self.model_particles)
+        self.assertFalse((np.diff(particle_buckets.members[0]) > 0).all())
+        particle_buckets.rebuild()
+        for members in particle_buckets.members:
+            self.assertTrue((np.diff(members) > 0).all())
+        expected = logic.get_event_particles(4, self.subregions, self.model_particles,
+                                                self.level_limit, 
+                                                rng=np.random.default_rng(5))
+        event_ids = particle_buckets.get_event_particles(4, self.subregions,
+                                                            self.model_particles,
+                                                            self.level_limit,
+                                                            rng=np.random.default_rng(5))
+        self.assertIsNone(np.testing.assert_array_equal(expected, event_ids))
+
+
+class TestNextVertexIndex(unittest.TestCase):
+    """ Unit tests for the NextVertexIndex class. """
+
+    def setUp(self):
+        self.available = np.array([False, True, False, False, True, False])
+        self.index = lattice.NextVertexIndex(self.available)
+
+    def test_find_returns_closest_downstream_slot(self):
+        """Find should return the slot itself if available, otherwise
+        the next available slot downstream."""
+        self.assertEqual(self.index.find(1), 1)
+        self.assertEqual(self.index.find(2), 4)
+        self.assertEqual(self.index.find(0), 1)
+
+    def test_find_past_last_available_returns_end(self):
+        """If no slot is available downstream then find returns end."""
+        self.assertEqual(self.index.find(5), self.index.end)
+        self.assertEqual(self.index.find(self.index.end), self.index.end)
+
+    def test_removed_slot_is_skipped(self):
+        """Removed slots should never be returned by find."""
+        self.index.remove(1)
+        self.assertEqual(self.index.find(0), 4)
+        self.index.remove(4)
+        self.assertEqual(self.index.find(0), self.index.end)
+
+    def test_added_slot_is_found(self):
+        """A slot added back should be found from slots upstream of it,
+        even if their paths were compressed past it."""
+        self.assertEqual(self.index.find(2), 4)
+        self.index.add(3)
+        self.assertEqual(self.index.find(2), 3)
+        self.assertEqual(self.index.find(0), 1)
+        self.index.remove(1)
+        self.assertEqual(self.index.find(0), 3)
+
+
+class TestLatticeEngine(unittest.TestCase):
+    """ Compare full runs of the lattice and reference engines. """
+
+    def run_engine(self, engine, **kwargs):
+        with tempfile.TemporaryDirectory() as out_path:
+            sbelt_runner.run(out_path=out_path, engine=engine, seed=11, **kwargs)
+            with h5py.File(f'{out_path}/sbelt-out.hdf5', 'r') as f:
+                fluxes = [f['final_metrics/subregions'][name][()] for name in
+                                    sorted(f['final_metrics/subregions'])]
+                avg_age = f['final_metrics/avg_age'][()]
+                final_model = f[f'iteration_{kwargs["iterations"]-1}/model'][()]
+        return fluxes, avg_age, final_model
+
+    def test_lattice_engine_matches_reference(self):
+        """For the same seed and event particles, both engines should 
+        produce identical output."""
+        kwargs = {'iterations': 50, 'bed_length': 20, 'num_subregions': 2,
+                    'poiss_lambda': 4, 'height_dependant_entr': True}
+        ref_fluxes, ref_age, ref_model = self.run_engine('reference', **kwargs)
+        # The index samples its members in its own order, so select as the reference does
+        with mock.patch.object(sbelt_runner.lattice.ParticleBuckets, 'get_event_particles',
+                                autospec=True, side_effect=lambda self, *args: 
+                                        sbelt_runner.logic.get_event_particles(*args)):
+            lat_fluxes, lat_age, lat_model = self.run_engine('lattice', **kwargs)
+
+        for ref_flux, lat_flux in zip(ref_fluxes, lat_fluxes):
+            self.assertIsNone(np.testing.assert_array_equal(ref_flux, lat_flux))
+        self.assertIsNone(np.testing.assert_array_equal(ref_age, lat_age))
+        self.assertIsNone(np.testing.assert_array_equal(ref_model, lat_model))
+
+    def test_statistics_match_reference(self):
+        """Flux and age statistics should agree with the reference engine."""
+        kwargs = {'iterations': 500, 'bed_length': 20, 'num_subregions': 2,
+                    'data_save_interval': 50}
+        reference, indexed = [], []
+        for seed in range(6):
+            for engine, runs in [('reference', reference), ('lattice', indexed)]:
+                with tempfile.TemporaryDirectory() as out_path:
+                    sbelt_runner.run(out_path=out_path, engine=engine, seed=seed, **kwargs)
+                    with h5py.File(f'{out_path}/sbelt-out.hdf5', 'r') as f:
+                        grp = f['final_metrics/subregions']
+                        runs.append((np.array([grp[name][()] for name in sorted(grp)]),
+                                        f['final_metrics/avg_age'][()]))
+
+        ref_flux = np.mean([fluxes.mean(axis=1) for fluxes, _ in reference], axis=0)
+        lat_flux = np.mean([fluxes.mean(axis=1) for fluxes, _ in indexed], axis=0)
+        self.assertIsNone(np.testing.assert_allclose(lat_flux, ref_flux, rtol=0.05))
+
+        half = kwargs['iterations'] // 2
+        ref_age = np.mean([avg_age[half:].mean() for _, avg_age in reference])
+        lat_age = np.mean([avg_age[half:].mean() for _, avg_age in indexed])
+        self.assertIsNone(np.testing.assert_allclose(lat_age, ref_age, rtol=0.2))
+
+
+if __name__ == '__main__':
+    unittest.main()
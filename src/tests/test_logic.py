@@ -251,6 +251,57 @@ class TestGetEventParticlesWithNSubregions(unittest.TestCase):
         self.assertEqual(len(list), 1)
 
 # Test Define Subregions
+class TestSelectEventParticles(unittest.TestCase):
+    """ Unit tests for the select_event_particles function.
+
+    Attributes:
+        mock_sub_list_2: list of Mock-type subregions
+    """
+    def setUp(self):
+        mock_subregion_0 = Mock()
+        mock_subregion_0.getName.return_value = 'Mock_Subregion_0'
+        mock_subregion_1 = Mock()
+        mock_subregion_1.getName.return_value = 'Mock_Subregion_1'
+        self.mock_sub_list_2 = [mock_subregion_0, mock_subregion_1]
+
+    def test_tips_and_ghosts_are_always_selected(self):
+        """Tip and ghost particles should always be selected, on top of 
+        the sampled particles, and never selected twice."""
+        candidates = [np.arange(0, 5), np.arange(4, 10)]
+        tips = [np.array([1, 2]), np.array([4])]
+        ghosts = np.array([10, 11])
+
+        event_ids = logic.select_event_particles(2, self.mock_sub_list_2, 
+                                                    candidates, tips, ghosts)
+        self.assertEqual(len(event_ids), len(np.unique(event_ids)))
+        for uid in [1, 2, 10, 11]:
+            self.assertIn(uid, event_ids)
+        # Subregion 0: 2 tips, 2 sampled, 2 ghosts. Subregion 1: 2 sampled (+ 1 tip
+        # if the tip was not selected in subregion 0)
+        self.assertIn(len(event_ids), [8, 9])
+
+    def test_sample_size_is_limited_by_candidates(self):
+        """If there are fewer candidates than events, all candidates are selected."""
+        candidates = [np.arange(0, 2), np.empty(0, dtype=np.intp)]
+        tips = [np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)]
+        ghosts = np.empty(0, dtype=np.intp)
+
+        event_ids = logic.select_event_particles(5, self.mock_sub_list_2, 
+                                                    candidates, tips, ghosts)
+        self.assertCountEqual(event_ids, [0, 1])
+
+    def test_same_generator_seed_selects_same_particles(self):
+        candidates = [np.arange(0, 50), np.arange(49, 100)]
+        tips = [np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)]
+        ghosts = np.empty(0, dtype=np.intp)
+
+        first_ids = logic.select_event_particles(5, self.mock_sub_list_2, candidates, tips, 
+                                                    ghosts, rng=np.random.default_rng(3))
+        second_ids = logic.select_event_particles(5, self.mock_sub_list_2, candidates, tips, 
+                                                    ghosts, rng=np.random.default_rng(3))
+        self.assertIsNone(np.testing.assert_array_equal(first_ids, second_ids))
+
+
 class TestDefineSubregions(unittest.TestCase):
     """ Test define subregions module
 
@@ -462,6 +513,45 @@ class TestSetModelParticles(unittest.TestCase):
         self.assertEqual(0, len(model_supports[model_supports > 0]))
 
 
+    def test_supports_are_bed_particles_either_side(self):
+        """ Each model particle should be supported by the bed particles 
+        a radius to its left and right and sit at the first level.
+        """
+        model_particles, model_supports = logic.set_model_particles(self.bed_particles,   
+                                                    self.available_vertices, 
+                                                    self.diam, 
+                                                    self.pack_fraction, 
+                                                    self.h)
+        bed_x = dict(zip(self.bed_particles[:,3], self.bed_particles[:,0]))
+        for particle, supports in zip(model_particles, model_supports):
+            self.assertAlmostEqual(bed_x[supports[0]], particle[0] - self.diam/2)
+            self.assertAlmostEqual(bed_x[supports[1]], particle[0] + self.diam/2)
+        self.assertTrue(np.all(model_particles[:,2] == round(self.h, 2)))
+
+    def test_vertex_not_on_bed_raises_value_error(self):
+        """ If a vertex is not formed by two bed particles then
+        a ValueError should be raised.
+        """
+        with self.assertRaises(ValueError):
+            logic.set_model_particles(self.bed_particles, np.array([0.6]), 
+                                        self.diam, 1, self.h)
+
+
+class TestValidateUids(unittest.TestCase):
+    """ Unit tests for the validate_uids function. """
+
+    def test_uids_equal_to_rows_pass(self):
+        model_particles = np.zeros((4, ATTR_COUNT))
+        model_particles[:,3] = np.arange(4)
+        self.assertIsNone(logic.validate_uids(model_particles))
+
+    def test_uid_not_equal_to_row_raises_value_error(self):
+        model_particles = np.zeros((4, ATTR_COUNT))
+        model_particles[:,3] = [0, 2, 1, 3]
+        with self.assertRaises(ValueError):
+            logic.validate_uids(model_particles)
+
+
 class TestComputeAvailableVerticesLifted(unittest.TestCase):
     """ Test compute_available_vertices function with 
     the lifted argument set to True.
@@ -1095,6 +1185,26 @@ class TestComputeHops(unittest.TestCase):
         event_particles = logic.compute_hops(event_particles_idx, model_particles, mu, sigma, normal=False)
         self.assertCountEqual(np.round([1.55428104, 1.10521435, 1.27721828], 1), event_particles[:,0])
 
+    def test_generator_updates_event_locations(self):
+        mu = 0
+        sigma = 0.25
+        model_particles = np.zeros((4, ATTR_COUNT), dtype=float)
+        event_particles_idx = [0, 2, 3]
+        expected = np.round(np.random.default_rng(0).lognormal(mu, sigma, 3), 1)
+
+        event_particles = logic.compute_hops(event_particles_idx, model_particles, mu, sigma, 
+                                                normal=False, rng=np.random.default_rng(0))
+        self.assertIsNone(np.testing.assert_array_equal(expected, event_particles[:,0]))
+
+    def test_predrawn_hops_update_event_locations(self):
+        model_particles = np.zeros((4, ATTR_COUNT), dtype=float)
+        model_particles[:,0] = [0.5, 1.0, 1.5, 2.0]
+        event_particles_idx = [0, 2, 3]
+
+        event_particles = logic.compute_hops(event_particles_idx, model_particles, 0, 1, 
+                                                hops=np.array([1.2, 0.3, 2.0]))
+        self.assertIsNone(np.testing.assert_allclose([1.7, 1.8, 4.0], event_particles[:,0]))
+
 
 class TestMoveModelParticles(unittest.TestCase):
     """ Unit tests for move_model_particles function.
@@ -1306,6 +1416,66 @@ class TestUpdateFlux(unittest.TestCase): # Easy
         self.mock_subregion_2.reset_mock()
 
 
+class TestSubregionTable(unittest.TestCase):
+    """ Unit tests for the SubregionTable class and 
+    define_subregion_table function.
+
+    Attributes:
+        bed_length: the length of the bed
+        num_subregions: the number of subregions
+        iterations: the number of iterations
+    """
+    def setUp(self):
+        self.bed_length = 10
+        self.num_subregions = 5
+        self.iterations = 3
+
+    def test_table_boundaries_match_subregion_list(self):
+        """A table should have the same names and boundaries as
+        the list from define_subregions."""
+        subregion_list = logic.define_subregions(self.bed_length, 
+                                                self.num_subregions, 
+                                                self.iterations)
+        subregion_table = logic.define_subregion_table(self.bed_length, 
+                                                self.num_subregions, 
+                                                self.iterations)
+        self.assertEqual(len(subregion_table), len(subregion_list))
+        for listed, tabled in zip(subregion_list, subregion_table):
+            self.assertEqual(listed.getName(), tabled.getName())
+            self.assertEqual(listed.leftBoundary(), tabled.leftBoundary())
+            self.assertEqual(listed.rightBoundary(), tabled.rightBoundary())
+
+    def test_table_flux_matches_subregion_list_flux(self):
+        """Crossings (including ghost particles) counted by a table 
+        should equal those counted over a list of Subregions."""
+        subregion_list = logic.define_subregions(self.bed_length, 
+                                                self.num_subregions, 
+                                                self.iterations)
+        subregion_table = logic.define_subregion_table(self.bed_length, 
+                                                self.num_subregions, 
+                                                self.iterations)
+        init_pos = np.array([0, 1, 2.5, 4, 6, 9.5, 3])
+        final_pos = np.array([2, 1.5, 8, -1, 9, -1, 4])
+        for iteration in range(self.iterations):
+            logic.update_flux(init_pos, final_pos, iteration, subregion_list)
+            logic.update_flux(init_pos, final_pos, iteration, subregion_table)
+
+        for listed, tabled in zip(subregion_list, subregion_table):
+            self.assertIsNone(np.testing.assert_array_equal(listed.getFluxList(), 
+                                                            tabled.getFluxList()))
+        expected_flux = np.array([s.getFluxList() for s in subregion_list]).T
+        self.assertIsNone(np.testing.assert_array_equal(expected_flux, subregion_table.flux))
+
+    def test_incrementing_subregion_updates_table(self):
+        """Subregions from a table share the table's flux matrix."""
+        subregion_table = logic.define_subregion_table(self.bed_length, 
+                                                self.num_subregions, 
+                                                self.iterations)
+        subregion_table[2].incrementFlux(1)
+        self.assertEqual(subregion_table.flux[1, 2], 1)
+        self.assertEqual(np.sum(subregion_table.flux), 1)
+
+
 class TestFindClosestVertex(unittest.TestCase): # Easy 
     """ Unit test for the find_closest_vertex function. 
     """
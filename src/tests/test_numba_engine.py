@@ -0,0 +1,151 @@
+import unittest
+import tempfile
+from unittest import mock
+import numpy as np
+import h5py
+
+from ..sbelt import logic
+from ..sbelt import lattice
+from ..sbelt import numba_engine
+from ..sbelt import sbelt_runner
+
+
+def run_engine(engine, seed, **kwargs):
+    with tempfile.TemporaryDirectory() as out_path:
+        sbelt_runner.run(out_path=out_path, engine=engine, seed=seed, **kwargs)
+        with h5py.File(f'{out_path}/sbelt-out.hdf5', 'r') as f:
+            fluxes = np.array([f['final_metrics/subregions'][name][()] for name in
+                                sorted(f['final_metrics/subregions'])])
+            avg_age = f['final_metrics/avg_age'][()]
+            final_model = f[f'iteration_{kwargs["iterations"]-1}/model'][()]
+    return fluxes, avg_age, final_model
+
+
+@unittest.skipUnless(numba_engine.NUMBA_AVAILABLE, 'Numba is not installed')
+class TestRunIterations(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(5)
+        self.diam = 0.5
+        self.h = np.sqrt(np.square(self.diam) - np.square(self.diam/2))
+        self.level_limit = 3
+        self.iterations = 400
+        self.bed_particles = logic.build_streambed(30, self.diam)
+        available_vertices = logic.compute_available_vertices(np.empty((0, 7)),
+                                                    self.bed_particles, self.diam,
+                                                    self.level_limit)
+        self.model_particles, self.model_supp = logic.set_model_particles(self.bed_particles,
+                                                    available_vertices, self.diam,
+                                                    0.78, self.h)
+        self.subregions = logic.define_subregion_table(30, 3, self.iterations)
+        self.lattice_bed = lattice.LatticeBed(self.bed_particles, self.model_particles,
+                                                    self.diam, self.level_limit, self.h)
+        self.first, self.last = numba_engine.subregion_slots(self.lattice_bed, self.subregions)
+        self.avg_age = np.zeros(self.iterations)
+        self.age_range = np.zeros(self.iterations)
+        numba_engine.seed(1)
+
+    def run_iterations(self, start, stop, record=False):
+        lattice_bed = self.lattice_bed
+        result = numba_engine.run_iterations(self.model_particles, self.model_supp,
+                                lattice_bed.levels, lattice_bed.uids, lattice_bed.slot_of,
+                                lattice_bed.level_of, lattice_bed.available, lattice_bed.slot_x,
+                                lattice_bed.elevations, self.subregions.left_boundaries,
+                                self.subregions.right_boundaries, self.first, self.last,
+                                self.subregions.flux, self.avg_age, self.age_range, start,
+                                stop, 5, 1, 0.25, False, self.level_limit, True, record)
+        return result if record else result[0]
+
+    def test_state_matches_rebuilt_lattice(self):
+        """After each block, the kernel's arrays should match ones rebuilt from scratch."""
+        for start in range(0, self.iterations, 100):
+            event_particles = self.run_iterations(start, start + 100)
+            self.assertTrue(event_particles.size > 0)
+
+            rebuilt = lattice.LatticeBed(self.bed_particles, self.model_particles,
+                                            self.diam, self.level_limit, self.h)
+            self.assertIsNone(np.testing.assert_array_equal(rebuilt.levels,
+                                                            self.lattice_bed.levels))
+            self.assertIsNone(np.testing.assert_array_equal(rebuilt.available,
+                                                            self.lattice_bed.available))
+            states = logic.update_particle_states(self.model_particles.copy(), self.model_supp)
+            self.assertIsNone(np.testing.assert_array_equal(states[:,4],
+                                                            self.model_particles[:,4]))
+            for uid in np.flatnonzero(self.model_particles[:,0] != -1):
+                slot, level = rebuilt.slot_of[uid], rebuilt.level_of[uid]
+                self.assertEqual(self.model_supp[uid][0], rebuilt.uids[level-1, slot-1])
+                self.assertEqual(self.model_supp[uid][1], rebuilt.uids[level-1, slot+1])
+
+    def test_log_matches_iterations_run_one_at_a_time(self):
+        """The log of a block should hold each iteration's event particles
+        with their values before and after the iteration."""
+        _, counts, ids, before, after = self.run_iterations(0, 50, record=True)
+        self.assertEqual(counts.sum(), len(ids))
+        self.assertTrue((before[:,0] == -1).any())
+
+        self.setUp()
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        for iteration in range(50):
+            previous = self.model_particles.copy()
+            event_ids = self.run_iterations(iteration, iteration + 1)
+            begin, end = offsets[iteration], offsets[iteration+1]
+            self.assertIsNone(np.testing.assert_array_equal(ids[begin:end], event_ids))
+            self.assertIsNone(np.testing.assert_array_equal(before[begin:end], 
+                                                            previous[event_ids][:,[0,2,5]]))
+            self.assertIsNone(np.testing.assert_array_equal(after[begin:end], 
+                                                    self.model_particles[event_ids][:,[0,2]]))
+
+    def test_records_flux_and_ages(self):
+        self.run_iterations(0, self.iterations)
+        self.assertTrue(np.all(self.subregions.flux >= 0))
+        self.assertTrue(self.subregions.flux.sum() > 0)
+        self.assertTrue(np.all(self.avg_age > 0))
+        self.assertEqual(self.avg_age[-1], np.average(self.model_particles[:,5]))
+        self.assertEqual(self.age_range[-1], np.ptp(self.model_particles[:,5]))
+
+
+@unittest.skipUnless(numba_engine.NUMBA_AVAILABLE, 'Numba is not installed')
+class TestNumbaEngine(unittest.TestCase):
+    """ Compare full runs of the numba and reference engines. """
+
+    kwargs = {'iterations': 500, 'bed_length': 20, 'num_subregions': 2,
+                'data_save_interval': 50}
+
+    def test_same_seed_same_run(self):
+        first_fluxes, first_age, first_model = run_engine('numba', 3, **self.kwargs)
+        second_fluxes, second_age, second_model = run_engine('numba', 3, **self.kwargs)
+        self.assertIsNone(np.testing.assert_array_equal(first_fluxes, second_fluxes))
+        self.assertIsNone(np.testing.assert_array_equal(first_age, second_age))
+        self.assertIsNone(np.testing.assert_array_equal(first_model, second_model))
+
+    def test_statistics_match_reference(self):
+        """Flux and age statistics should agree with the reference engine."""
+        seeds = range(6)
+        reference = [run_engine('reference', seed, **self.kwargs)[:2] for seed in seeds]
+        compiled = [run_engine('numba', seed, **self.kwargs)[:2] for seed in seeds]
+
+        ref_flux = np.mean([fluxes.mean(axis=1) for fluxes, _ in reference], axis=0)
+        numba_flux = np.mean([fluxes.mean(axis=1) for fluxes, _ in compiled], axis=0)
+        self.assertIsNone(np.testing.assert_allclose(numba_flux, ref_flux, rtol=0.05))
+
+        half = self.kwargs['iterations'] // 2
+        ref_age = np.mean([avg_age[half:].mean() for _, avg_age in reference])
+        numba_age = np.mean([avg_age[half:].mean() for _, avg_age in compiled])
+        self.assertIsNone(np.testing.assert_allclose(numba_age, ref_age, rtol=0.2))
+
+
+class TestNumbaFallback(unittest.TestCase):
+
+    def test_falls_back_to_lattice(self):
+        """Without Numba, the numba engine should produce the lattice engine's run."""
+        kwargs = {'iterations': 30, 'bed_length': 20, 'num_subregions': 2}
+        lat_fluxes, lat_age, lat_model = run_engine('lattice', 7, **kwargs)
+        with mock.patch.object(sbelt_runner.numba_engine, 'NUMBA_AVAILABLE', False):
+            fb_fluxes, fb_age, fb_model = run_engine('numba', 7, **kwargs)
+        self.assertIsNone(np.testing.assert_array_equal(lat_fluxes, fb_fluxes))
+        self.assertIsNone(np.testing.assert_array_equal(lat_age, fb_age))
+        self.assertIsNone(np.testing.assert_array_equal(lat_model, fb_model))
+
+
+if __name__ == '__main__':
+    unittest.main()
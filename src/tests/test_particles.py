@@ -0,0 +1,63 @@
+"""
+A module for unit tests of the particles module
+"""
+
+import unittest
+import numpy as np
+
+from ..sbelt import particles
+
+ATTR_COUNT = 7 # Number of attributes associated with a Particle
+
+
+class TestCompactConversion(unittest.TestCase):
+    """ Unit tests for converting between the legacy and compact layouts.
+
+    Attributes:
+        diam: diameter for the test particles
+        model_particles: An n-7 array of test model particles,
+            the last of which is a ghost particle
+        model_supp: An n-2 array of test model supports
+    """
+    def setUp(self):
+        self.diam = 0.5
+        self.model_particles = np.array([[1.0, self.diam, 0.43, 0, 1, 3, 0],
+                                         [1.25, self.diam, 0.86, 1, 0, 0, 2],
+                                         [-1, self.diam, 0.43, 2, 1, 12, 1]])
+        self.model_supp = np.array([[-2, -3],
+                                    [0, 3],
+                                    [np.nan, np.nan]])
+
+    def test_round_trip_returns_legacy_arrays(self):
+        """Converting to compact and back should return the original arrays."""
+        compact = particles.to_compact(self.model_particles, self.model_supp)
+        model_particles, model_supp = particles.to_legacy(compact, self.diam)
+        self.assertIsNone(np.testing.assert_array_equal(self.model_particles, model_particles))
+        self.assertIsNone(np.testing.assert_array_equal(self.model_supp, model_supp))
+
+    def test_float32_round_trip_is_close(self):
+        """Converting with float32 coordinates should keep all integer
+        attributes and keep coordinates to float32 precision."""
+        compact = particles.to_compact(self.model_particles, self.model_supp, float32=True)
+        self.assertEqual(compact['x'].dtype, np.float32)
+        model_particles, model_supp = particles.to_legacy(compact, self.diam)
+        self.assertIsNone(np.testing.assert_allclose(self.model_particles, model_particles, 
+                                                        rtol=1e-6))
+        self.assertIsNone(np.testing.assert_array_equal(self.model_particles[:,3:], 
+                                                        model_particles[:,3:]))
+        self.assertIsNone(np.testing.assert_array_equal(self.model_supp, model_supp))
+
+    def test_compact_is_at_most_half_the_size(self):
+        """A compact particle should use at most half the bytes of a legacy
+        particle and its supports."""
+        legacy_size = (ATTR_COUNT + 2) * np.dtype(float).itemsize
+        self.assertLessEqual(particles.particle_dtype().itemsize, legacy_size / 2 + 1)
+        self.assertLess(particles.particle_dtype(float32=True).itemsize, legacy_size / 2)
+
+    def test_pack_legacy_returns_model_particles(self):
+        packed = particles.pack(self.model_particles, self.model_supp, 'legacy')
+        self.assertIs(packed, self.model_particles)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+"""
+A module for unit tests of the profiling module
+"""
+
+import unittest
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+import pstats
+import numpy as np
+import h5py
+
+from ..sbelt import numba_engine
+from ..sbelt import profiling
+from ..sbelt import sbelt_runner
+from ..sbelt import timing
+from .test_sbelt_runner import read_output
+
+
+def spin(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class TestProfilers(unittest.TestCase):
+
+    def test_collapse_lists_outermost_frame_first(self):
+        def inner():
+            return profiling.collapse(sys._getframe())
+        stack = inner().split(';')
+        self.assertRegex(stack[-1], r'^inner \(test_profiling\.py:\d+\)$')
+        self.assertTrue(stack[-2].startswith('test_collapse_lists_outermost_frame_first '))
+
+    def test_sampling_profiler_samples_the_enabling_thread(self):
+        profiler = profiling.SamplingProfiler(interval=0.001)
+        profiler.enable()
+        spin(0.2)
+        profiler.disable()
+        samples = sum(profiler.stacks.values())
+        spinning = sum(count for stack, count in profiler.stacks.items() if ';spin (' in stack)
+        self.assertGreater(samples, 0)
+        # A sample can land after spin returns, while disable waits for the thread
+        self.assertGreaterEqual(spinning, samples - 1)
+
+    def test_memory_is_recorded_only_inside_the_window(self):
+        profiler = profiling.ProfilingTimer(timing.NULL_TIMER, 'sampling', 'lattice', 2, 4)
+        for iteration in range(6):
+            profiler.start(iteration)
+            data = np.ones(100000)
+            profiler.lap('hops')
+            profiler.lap('move')
+            profiler.finish()
+            del data
+        self.assertEqual(profiler.iterations, 2)
+        self.assertGreaterEqual(profiler.peak_bytes[timing.PHASES.index('hops')], 800000)
+        self.assertLess(profiler.peak_bytes[timing.PHASES.index('move')], 800000)
+        self.assertFalse(profiler._active)
+
+    def test_memory_keeps_the_callers_traces(self):
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+        kept = np.ones(100000)
+        profiler = profiling.ProfilingTimer(timing.NULL_TIMER, 'sampling', 'lattice', 0, 2)
+        for iteration in range(2):
+            profiler.start(iteration)
+            data = np.ones(100000)
+            profiler.lap('hops')
+            profiler.finish()
+            del data
+        self.assertTrue(tracemalloc.is_tracing())
+        self.assertGreaterEqual(tracemalloc.get_traced_memory()[0], kept.nbytes)
+        self.assertGreaterEqual(profiler.peak_bytes[timing.PHASES.index('hops')], 800000)
+
+
+class TestProfiledRun(unittest.TestCase):
+
+    kwargs = {'iterations': 40, 'bed_length': 20, 'num_subregions': 2, 'seed': 3}
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.out_path = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def read_profile(self):
+        with h5py.File(os.path.join(self.out_path, 'sbelt-out.hdf5'), 'r') as f:
+            grp = f['final_metrics/profile']
+            return dict(grp.attrs), {name: grp[name][()] for name in grp}
+
+    def test_cprofile_writes_pstats_of_the_window(self):
+        sbelt_runner.run(out_path=self.out_path, profile='cprofile', profile_start=10,
+                            profile_stop=30, **self.kwargs)
+        attrs, result = self.read_profile()
+        self.assertEqual(attrs, {'profile': 'cprofile', 'file': 'sbelt-out.pstats'})
+        self.assertEqual(result['iterations'], 20)
+        self.assertEqual(list(result['window']), [10, 30])
+        stats = pstats.Stats(os.path.join(self.out_path, 'sbelt-out.pstats')).stats
+        calls = {function: value[1] for (_, _, function), value in stats.items()}
+        self.assertEqual(calls['entrainment_event'], 20)
+        self.assertGreater(result['peak_bytes'][timing.PHASES.index('event_selection')], 0)
+
+    @unittest.skipUnless(numba_engine.NUMBA_AVAILABLE, 'Numba is not installed')
+    def test_sampling_writes_collapsed_stacks(self):
+        sbelt_runner.run(out_path=self.out_path, profile='sampling', engine='numba',
+                            **dict(self.kwargs, iterations=200))
+        attrs, result = self.read_profile()
+        self.assertEqual(attrs['file'], 'sbelt-out.collapsed')
+        self.assertEqual(result['iterations'], 200)
+        with open(os.path.join(self.out_path, 'sbelt-out.collapsed')) as f:
+            for line in f:
+                self.assertRegex(line, r'^\S.*;entrain \(sbelt_runner\.py:\d+\).* \d+$')
+
+    def test_profiling_does_not_change_the_run(self):
+        profiled = os.path.join(self.out_path, 'profiled')
+        os.makedirs(profiled)
+        sbelt_runner.run(out_path=self.out_path, **self.kwargs)
+        sbelt_runner.run(out_path=profiled, profile='cprofile', **self.kwargs)
+        first, second = read_output(self.out_path), read_output(profiled)
+        second = {name: value for name, value in second.items()
+                    if not name.startswith(('final_metrics/profile', 'params/profile'))}
+        first = {name: value for name, value in first.items()
+                    if not name.startswith('params/profile')}
+        self.assertEqual(sorted(first), sorted(second))
+        for name in first:
+            self.assertIsNone(np.testing.assert_array_equal(first[name], second[name]), name)
+
+    def test_extending_a_run_keeps_its_profile(self):
+        sbelt_runner.run(out_path=self.out_path, profile='sampling', profile_start=5,
+                            profile_stop=25, checkpoint_interval=10, **self.kwargs)
+        profile_path = os.path.join(self.out_path, 'sbelt-out.collapsed')
+        with open(profile_path) as f:
+            stacks = f.read()
+        expected = self.read_profile()
+        sbelt_runner.resume(out_path=self.out_path, extra_iterations=20)
+        attrs, result = self.read_profile()
+        self.assertEqual(attrs, expected[0])
+        self.assertEqual(result['iterations'], 20)
+        for name, value in expected[1].items():
+            self.assertIsNone(np.testing.assert_array_equal(result[name], value), name)
+        with open(profile_path) as f:
+            self.assertEqual(f.read(), stacks)
+
+    def test_invalid_profile_raises_value_error(self):
+        for invalid in [{'profile': 'perf'}, {'profile_start': -1},
+                            {'profile_start': 10, 'profile_stop': 5}]:
+            with self.assertRaises(ValueError):
+                sbelt_runner.run(out_path=self.out_path, **dict(self.kwargs, **invalid))
+
+
+if __name__ == '__main__':
+    unittest.main()
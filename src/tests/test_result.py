@@ -0,0 +1,109 @@
+"""
+A module for unit tests of the result module
+"""
+
+import unittest
+import tempfile
+import numpy as np
+import h5py
+
+from ..sbelt import result
+from ..sbelt import storage
+from ..sbelt import sbelt_runner
+
+
+class TestChunkCache(unittest.TestCase):
+
+    def test_least_recently_used_chunks_are_evicted(self):
+        cache = result.ChunkCache(max_bytes=3 * 80)
+        for key in range(3):
+            cache.get(key, lambda: np.zeros(10))
+        cache.get(0, lambda: None)
+        cache.get(3, lambda: np.zeros(10))
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.nbytes, 3 * 80)
+        self.assertEqual((cache.hits, cache.misses), (1, 4))
+        loaded = []
+        cache.get(1, lambda: loaded.append(1) or np.zeros(10))
+        cache.get(0, lambda: loaded.append(0) or np.zeros(10))
+        self.assertEqual(loaded, [1])
+
+
+class TestSbeltResult(unittest.TestCase):
+
+    kwargs = {'iterations': 40, 'bed_length': 20, 'num_subregions': 2, 'seed': 6, 
+                'data_save_interval': 2, 'keyframe_interval': 9, 'snapshot_chunk_bytes': 4096}
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def run_layout(self, storage_layout, particle_layout='legacy', **kwargs):
+        out_name = f'{storage_layout}-{particle_layout}'
+        sbelt_runner.run(out_path=self.tmp_dir.name, out_name=out_name, 
+                            storage_layout=storage_layout, particle_layout=particle_layout,
+                            **dict(self.kwargs, **kwargs))
+        return f'{self.tmp_dir.name}/{out_name}.hdf5'
+
+    def test_snapshots_match_storage_in_every_layout(self):
+        for storage_layout in storage.LAYOUTS:
+            path = self.run_layout(storage_layout)
+            with h5py.File(path, 'r') as f:
+                expected = list(storage.iter_snapshots(f))
+            with result.SbeltResult(path, cache_bytes=8192) as run:
+                self.assertEqual(list(run.iterations), list(range(1, 40, 2)))
+                # Out of order access goes through the cache and replays
+                for iteration, model, event_ids in reversed(expected):
+                    self.assertIsNone(np.testing.assert_array_equal(model, run.model(iteration)))
+                    self.assertIsNone(np.testing.assert_array_equal(event_ids, 
+                                                                    run.event_ids(iteration)))
+                self.assertTrue(run.cache.nbytes <= 8192 or len(run.cache) == 1)
+                for (iteration, model, event_ids), snapshot in zip(expected[3:7], 
+                                                                    run.snapshots(7, 15)):
+                    self.assertEqual(iteration, snapshot[0])
+                    self.assertIsNone(np.testing.assert_array_equal(model, snapshot[1]))
+                    self.assertIsNone(np.testing.assert_array_equal(event_ids, snapshot[2]))
+
+    def test_models_and_columns_slice_iterations(self):
+        path = self.run_layout('delta')
+        with result.SbeltResult(path) as run:
+            models = run.models(start=10, stop=20)
+            self.assertEqual(models.shape[0], 5)
+            self.assertIsNone(np.testing.assert_array_equal(models[0], run.model(11)))
+            iterations, ages = run.column('age', uids=[0, 5], start=10, stop=20)
+            self.assertEqual(list(iterations), [11, 13, 15, 17, 19])
+            self.assertIsNone(np.testing.assert_array_equal(ages, models[:, [0, 5], 5]))
+            self.assertEqual(run.models(start=100).shape[0], 0)
+
+    def test_compact_columns_and_legacy_model_particles(self):
+        legacy = result.SbeltResult(self.run_layout('v2'))
+        compact = result.SbeltResult(self.run_layout('v2', 'compact'))
+        with legacy, compact:
+            self.assertIsNone(np.testing.assert_array_equal(legacy.column('x')[1], 
+                                                            compact.column('x')[1]))
+            self.assertIsNone(np.testing.assert_array_equal(legacy.model_particles(21), 
+                                                            compact.model_particles(21)))
+
+    def test_params_and_final_metrics(self):
+        path = self.run_layout('v1')
+        with result.SbeltResult(path) as run, h5py.File(path, 'r') as f:
+            self.assertEqual(run.params['bed_length'], 20)
+            self.assertEqual(run.params['storage_layout'], 'v1')
+            self.assertEqual(list(run.flux), ['subregion-0', 'subregion-1'])
+            self.assertIsNone(np.testing.assert_array_equal(run.flux['subregion-1'],
+                                    f['final_metrics/subregions/subregion-1-flux'][()]))
+            self.assertIsNone(np.testing.assert_array_equal(run.avg_age, 
+                                                            f['final_metrics/avg_age'][()]))
+            self.assertEqual(run.bed.shape[1], 7)
+            self.assertEqual(len(run), 20)
+
+    def test_missing_iteration_raises_key_error(self):
+        with result.SbeltResult(self.run_layout('v2')) as run:
+            with self.assertRaises(KeyError):
+                run.model(2)
+
+
+if __name__ == '__main__':
+    unittest.main()
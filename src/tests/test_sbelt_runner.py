@@ -0,0 +1,156 @@
+"""
+A module for unit tests of the sbelt_runner module
+"""
+
+import unittest
+import os
+import tempfile
+from unittest import mock
+import numpy as np
+import h5py
+
+from ..sbelt import numba_engine
+from ..sbelt import sbelt_runner
+
+
+class TestRunSeed(unittest.TestCase):
+
+    def run_seeded(self, seed):
+        with tempfile.TemporaryDirectory() as out_path:
+            sbelt_runner.run(iterations=20, bed_length=20, num_subregions=2, 
+                                out_path=out_path, seed=seed)
+            with h5py.File(f'{out_path}/sbelt-out.hdf5', 'r') as f:
+                recorded_seed = f['params/seed'][()]
+                final_model = f['iteration_19/model'][()]
+        return recorded_seed, final_model
+
+    def test_same_seed_same_run(self):
+        first_seed, first_model = self.run_seeded(5)
+        second_seed, second_model = self.run_seeded(5)
+        self.assertEqual(first_seed, 5)
+        self.assertEqual(second_seed, 5)
+        self.assertIsNone(np.testing.assert_array_equal(first_model, second_model))
+
+    def test_different_seeds_different_runs(self):
+        _, first_model = self.run_seeded(5)
+        _, second_model = self.run_seeded(6)
+        self.assertFalse(np.array_equal(first_model, second_model))
+
+    def test_drawn_seed_is_recorded(self):
+        """Without a seed, the recorded seed should reproduce the run."""
+        np.random.seed(2)
+        drawn_seed, drawn_model = self.run_seeded(None)
+        _, seeded_model = self.run_seeded(int(drawn_seed))
+        self.assertIsNone(np.testing.assert_array_equal(drawn_model, seeded_model))
+
+    def test_invalid_seed_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            self.run_seeded(-1)
+        with self.assertRaises(ValueError):
+            self.run_seeded(1.5)
+
+
+def read_output(out_path, out_name='sbelt-out'):
+    """Returns a dictionary of every dataset in a run's output, except out_path"""
+    datasets = {}
+    def visit(name, item):
+        if isinstance(item, h5py.Dataset) and name != 'params/out_path':
+            datasets[name] = item[()]
+    with h5py.File(f'{out_path}/{out_name}.hdf5', 'r') as f:
+        f.visititems(visit)
+    return datasets
+
+
+class TestCheckpointResume(unittest.TestCase):
+
+    kwargs = {'bed_length': 20, 'num_subregions': 2, 'data_save_interval': 3, 
+                'checkpoint_interval': 10, 'seed': 2}
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.uninterrupted = os.path.join(self.tmp_dir.name, 'uninterrupted')
+        self.resumed = os.path.join(self.tmp_dir.name, 'resumed')
+        os.makedirs(self.uninterrupted)
+        os.makedirs(self.resumed)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def assertSameOutput(self, first_path, second_path):
+        first = read_output(first_path)
+        second = read_output(second_path)
+        self.assertEqual(sorted(first), sorted(second))
+        for name in first:
+            self.assertIsNone(np.testing.assert_array_equal(first[name], second[name]), name)
+
+    def crash_and_resume(self, engine):
+        sbelt_runner.run(iterations=50, engine=engine, out_path=self.uninterrupted, **self.kwargs)
+
+        write_snapshot = sbelt_runner.write_snapshot
+        def crash_at_35(f, iteration, *args):
+            if iteration >= 35:
+                raise RuntimeError('Node preempted')
+            write_snapshot(f, iteration, *args)
+        with mock.patch.object(sbelt_runner, 'write_snapshot', side_effect=crash_at_35):
+            with self.assertRaises(RuntimeError):
+                sbelt_runner.run(iterations=50, engine=engine, out_path=self.resumed, 
+                                    **self.kwargs)
+        sbelt_runner.resume(out_path=self.resumed)
+        self.assertSameOutput(self.uninterrupted, self.resumed)
+
+    def test_resumed_reference_run_matches_uninterrupted(self):
+        self.crash_and_resume('reference')
+
+    def test_resumed_lattice_run_matches_uninterrupted(self):
+        self.crash_and_resume('lattice')
+
+    @unittest.skipUnless(numba_engine.NUMBA_AVAILABLE, 'Numba is not installed')
+    def test_resumed_numba_run_matches_uninterrupted(self):
+        self.crash_and_resume('numba')
+
+    def test_resumed_v2_run_matches_uninterrupted(self):
+        self.kwargs = dict(self.kwargs, storage_layout='v2')
+        self.crash_and_resume('lattice')
+
+    def test_resumed_delta_run_matches_uninterrupted(self):
+        self.kwargs = dict(self.kwargs, storage_layout='delta', keyframe_interval=7)
+        self.crash_and_resume('lattice')
+
+    def test_resumed_background_writer_run_matches_uninterrupted(self):
+        self.kwargs = dict(self.kwargs, storage_layout='v2', background_writer=True)
+        self.crash_and_resume('reference')
+
+    def test_resumed_statistics_match_uninterrupted(self):
+        self.kwargs = dict(self.kwargs, statistics='age,residence,hops,subregion_counts,elevation')
+        self.crash_and_resume('lattice')
+
+    @unittest.skipUnless(numba_engine.NUMBA_AVAILABLE, 'Numba is not installed')
+    def test_resumed_numba_statistics_match_uninterrupted(self):
+        self.kwargs = dict(self.kwargs, statistics='residence,hops')
+        self.crash_and_resume('numba')
+
+    def test_extended_run_matches_longer_run(self):
+        sbelt_runner.run(iterations=60, out_path=self.uninterrupted, **self.kwargs)
+        sbelt_runner.run(iterations=40, out_path=self.resumed, **self.kwargs)
+        sbelt_runner.resume(out_path=self.resumed, extra_iterations=20)
+        self.assertSameOutput(self.uninterrupted, self.resumed)
+
+    def test_extended_run_statistics_match_longer_run(self):
+        # Age histograms keep the bins of the original run, so are left out
+        self.kwargs = dict(self.kwargs, statistics='hops,subregion_counts,elevation')
+        self.test_extended_run_matches_longer_run()
+
+    def test_checkpoint_replaces_temporary_file(self):
+        sbelt_runner.run(iterations=20, out_path=self.resumed, **self.kwargs)
+        self.assertEqual(sorted(os.listdir(self.resumed)), 
+                            ['sbelt-out.checkpoint.hdf5', 'sbelt-out.hdf5'])
+
+    def test_resume_without_checkpoint_raises_value_error(self):
+        sbelt_runner.run(iterations=20, out_path=self.resumed, 
+                            **dict(self.kwargs, checkpoint_interval=0))
+        with self.assertRaises(ValueError):
+            sbelt_runner.resume(out_path=self.resumed)
+
+
+if __name__ == '__main__':
+    unittest.main()
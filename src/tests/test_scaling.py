@@ -0,0 +1,66 @@
+"""
+A module for unit tests of the scaling module
+"""
+
+import unittest
+import os
+import tempfile
+import numpy as np
+
+from ..sbelt import scaling
+
+
+class TestFitPowerLaw(unittest.TestCase):
+
+    def test_recovers_exponent_and_coefficient(self):
+        values = np.array([10, 20, 40, 80])
+        exponent, coefficient = scaling.fit_power_law(values, 3 * values**1.5)
+        self.assertAlmostEqual(exponent, 1.5)
+        self.assertAlmostEqual(coefficient, 3)
+
+    def test_zero_costs_are_left_out(self):
+        self.assertAlmostEqual(scaling.fit_power_law([1, 2, 4], [0, 2, 4])[0], 1)
+        self.assertTrue(np.isnan(scaling.fit_power_law([1, 2, 4], [0, 0, 4])[0]))
+
+
+class TestScalingReport(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.report = scaling.scaling_report(bed_lengths=[20, 40, 80], lambdas=[1, 4],
+                                            phases=['build_streambed', 'iteration'], repeat=1)
+
+    def test_report_fits_each_phase_of_each_sweep(self):
+        self.assertEqual(sorted(self.report['sweeps']), ['bed_length', 'poiss_lambda'])
+        bed_lengths = self.report['sweeps']['bed_length']
+        self.assertEqual(bed_lengths['values'], [20, 40, 80])
+        self.assertTrue(bed_lengths['particles'][0] < bed_lengths['particles'][-1])
+        for measured in bed_lengths['phases'].values():
+            self.assertEqual(len(measured['seconds']), 3)
+            self.assertTrue(all(peak >= 0 for peak in measured['peak_bytes']))
+            self.assertTrue(np.isfinite(measured['time_exponent']))
+            self.assertEqual(measured['superlinear'], 
+                                measured['time_exponent'] > scaling.SUPERLINEAR
+                                or measured['memory_exponent'] > scaling.SUPERLINEAR)
+        # Building the bed allocates memory in proportion to its length
+        self.assertAlmostEqual(bed_lengths['phases']['build_streambed']['memory_exponent'], 1, 
+                                delta=0.2)
+
+    def test_predict_extrapolates_the_fit(self):
+        measured = self.report['sweeps']['bed_length']['phases']['iteration']
+        self.assertAlmostEqual(scaling.predict(self.report, 'iteration', 'bed_length', 80), 
+                                measured['time_coefficient'] * 80**measured['time_exponent'])
+
+    def test_format_and_plot_report(self):
+        table = scaling.format_report(self.report)
+        self.assertIn('Scaling with bed_length', table)
+        self.assertIn('Scaling with poiss_lambda', table)
+        report = dict(self.report, sweeps={'poiss_lambda': self.report['sweeps']['poiss_lambda']})
+        with tempfile.TemporaryDirectory() as out_path:
+            scaling.plot_report(report, out_location=out_path + '/')
+            self.assertEqual(sorted(os.listdir(out_path)), 
+                                ['scaling-poiss_lambda-memory.png', 'scaling-poiss_lambda-time.png'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,282 @@
+"""
+A module for unit tests of the storage module
+"""
+
+import unittest
+import os
+import tempfile
+import threading
+import numpy as np
+import h5py
+
+from ..sbelt import storage
+from ..sbelt import particles
+from ..sbelt import sbelt_runner
+
+
+class TestDatasetFilters(unittest.TestCase):
+
+    def test_filters_per_codec(self):
+        self.assertEqual(storage.dataset_filters('none'), {'shuffle': False})
+        self.assertEqual(storage.dataset_filters('lzf', shuffle=True), 
+                            {'compression': 'lzf', 'shuffle': True})
+        self.assertEqual(storage.dataset_filters('gzip', 9), 
+                            {'compression': 'gzip', 'compression_opts': 9, 'shuffle': False})
+
+
+class TestChunkedWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'snapshots.hdf5')
+        rng = np.random.default_rng(0)
+        self.models = [rng.random((10, 7)) for _ in range(7)]
+        self.event_ids = [np.arange(k) * 2 for k in [3, 0, 1, 5, 2, 2, 4]]
+        self.iterations = [1, 3, 5, 7, 9, 11, 13]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, layout, snapshots_per_chunk=None):
+        with h5py.File(self.path, 'w') as f:
+            writer = storage.snapshot_writer(f, layout)
+            for iteration, model, event_ids in zip(self.iterations, self.models, self.event_ids):
+                writer.append(iteration, model, event_ids)
+                if snapshots_per_chunk:
+                    writer.snapshots_per_chunk = snapshots_per_chunk
+            writer.flush()
+
+    def test_snapshots_read_back_in_both_layouts(self):
+        for layout in storage.LAYOUTS:
+            self.write(layout, snapshots_per_chunk=3 if layout == 'v2' else None)
+            with h5py.File(self.path, 'r') as f:
+                self.assertEqual(list(storage.snapshot_iterations(f)), self.iterations)
+                for iteration, model, event_ids in zip(self.iterations, self.models, 
+                                                        self.event_ids):
+                    read_model, read_event_ids = storage.read_snapshot(f, iteration)
+                    self.assertIsNone(np.testing.assert_array_equal(model, read_model))
+                    self.assertIsNone(np.testing.assert_array_equal(event_ids, read_event_ids))
+
+    def test_v2_uses_few_objects(self):
+        self.write('v2', snapshots_per_chunk=2)
+        with h5py.File(self.path, 'r') as f:
+            self.assertEqual(list(f), ['snapshots'])
+            self.assertEqual(f['snapshots/model'].shape, (7, 10, 7))
+            self.assertEqual(f['snapshots/event_offsets'].shape, (8,))
+
+    def test_missing_iteration_raises_key_error(self):
+        self.write('v2')
+        with h5py.File(self.path, 'r') as f:
+            with self.assertRaises(KeyError):
+                storage.read_snapshot(f, 2)
+
+    def test_truncate_removes_later_snapshots(self):
+        for layout in storage.LAYOUTS:
+            self.write(layout, snapshots_per_chunk=3 if layout == 'v2' else None)
+            with h5py.File(self.path, 'a') as f:
+                storage.snapshot_writer(f, layout).truncate(6)
+                self.assertEqual(list(storage.snapshot_iterations(f)), [1, 3, 5])
+                _, event_ids = storage.read_snapshot(f, 5)
+                self.assertIsNone(np.testing.assert_array_equal(self.event_ids[2], event_ids))
+                if layout == 'v2':
+                    self.assertEqual(f['snapshots/event_ids'].shape, (4,))
+
+
+class TestDeltaWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'snapshots.hdf5')
+        rng = np.random.default_rng(1)
+        model = np.zeros((12, 7))
+        model[:,3] = np.arange(12)
+        self.iterations = list(range(2, 26, 2))
+        self.models, self.event_ids = [], []
+        for _ in self.iterations:
+            model = model.copy()
+            model[:,5] += 2
+            event_ids = rng.choice(12, 3, replace=False)
+            model[event_ids, 0] = rng.random(3)
+            model[event_ids, 5] = 0
+            self.models.append(model)
+            self.event_ids.append(event_ids)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, iterations, keyframe_interval=10):
+        with h5py.File(self.path, 'a') as f:
+            writer = storage.snapshot_writer(f, 'delta', keyframe_interval)
+            for iteration, model, event_ids in zip(self.iterations, self.models, self.event_ids):
+                if iteration in iterations:
+                    writer.append(iteration, model, event_ids)
+            writer.flush()
+
+    def test_snapshots_are_reconstructed(self):
+        self.write(self.iterations)
+        with h5py.File(self.path, 'r') as f:
+            self.assertEqual(list(f['snapshots/keyframe_snapshot']), [0, 4, 9])
+            for iteration, model, event_ids in zip(self.iterations, self.models, self.event_ids):
+                read_model, read_event_ids = storage.read_snapshot(f, iteration)
+                self.assertIsNone(np.testing.assert_array_equal(model, read_model))
+                self.assertIsNone(np.testing.assert_array_equal(event_ids, read_event_ids))
+            for (iteration, model, _), expected in zip(storage.iter_snapshots(f), self.models):
+                self.assertIsNone(np.testing.assert_array_equal(expected, model))
+
+    def test_only_changed_particles_are_stored(self):
+        self.write(self.iterations)
+        with h5py.File(self.path, 'r') as f:
+            self.assertEqual(f['snapshots/keyframes'].shape, (3, 12, 7))
+            self.assertEqual(f['snapshots/changes'].shape, (3 * 9, 7))
+
+    def test_appending_after_truncate_matches_single_write(self):
+        self.write(self.iterations)
+        with h5py.File(self.path, 'r') as f:
+            expected = {name: f['snapshots'][name][()] for name in f['snapshots']}
+        with h5py.File(self.path, 'a') as f:
+            storage.snapshot_writer(f, 'delta').truncate(13)
+        self.write(self.iterations[6:])
+        with h5py.File(self.path, 'r') as f:
+            for name, data in expected.items():
+                self.assertIsNone(np.testing.assert_array_equal(data, f['snapshots'][name][()]))
+
+
+class SlowWriter():
+    """A snapshot writer which waits for permission to write each snapshot"""
+    def __init__(self, fail_at=None):
+        self.snapshots = []
+        self.flushed = False
+        self.proceed = threading.Semaphore(0)
+        self.fail_at = fail_at
+
+    def append(self, iteration, model, event_ids):
+        self.proceed.acquire()
+        if iteration == self.fail_at:
+            raise OSError('Disk full')
+        self.snapshots.append((iteration, model, event_ids))
+
+    def flush(self):
+        self.flushed = True
+
+
+class TestBackgroundWriter(unittest.TestCase):
+
+    def test_snapshots_are_copied_and_written_in_order(self):
+        writer = storage.BackgroundWriter(SlowWriter(), queue_size=4)
+        model = np.zeros((3, 7))
+        for iteration in range(4):
+            model[:,5] = iteration
+            writer.append(iteration, model, np.array([iteration]))
+        for _ in range(4):
+            writer.writer.proceed.release()
+        writer.close()
+        self.assertTrue(writer.writer.flushed)
+        self.assertEqual([iteration for iteration, _, _ in writer.writer.snapshots], 
+                            list(range(4)))
+        for iteration, model, _ in writer.writer.snapshots:
+            self.assertTrue(np.all(model[:,5] == iteration))
+
+    def test_append_waits_when_queue_is_full(self):
+        writer = storage.BackgroundWriter(SlowWriter(), queue_size=1)
+        writer.append(0, np.zeros(1), np.zeros(0))
+        writer.append(1, np.zeros(1), np.zeros(0))
+        blocked = threading.Thread(target=writer.append, args=(2, np.zeros(1), np.zeros(0)))
+        blocked.start()
+        blocked.join(0.2)
+        self.assertTrue(blocked.is_alive())
+        for _ in range(3):
+            writer.writer.proceed.release()
+        blocked.join()
+        writer.close()
+        self.assertEqual(len(writer.writer.snapshots), 3)
+
+    def test_writer_errors_are_raised(self):
+        writer = storage.BackgroundWriter(SlowWriter(fail_at=1))
+        for iteration in range(3):
+            writer.append(iteration, np.zeros(1), np.zeros(0))
+            writer.writer.proceed.release()
+        with self.assertRaises(OSError):
+            writer.close()
+        self.assertEqual(len(writer.writer.snapshots), 1)
+
+
+class TestStorageLayoutRuns(unittest.TestCase):
+
+    def run_layout(self, out_path, storage_layout, particle_layout, **kwargs):
+        sbelt_runner.run(iterations=20, bed_length=20, num_subregions=2, data_save_interval=3,
+                            seed=4, out_path=out_path, storage_layout=storage_layout,
+                            particle_layout=particle_layout, keyframe_interval=7, **kwargs)
+        with h5py.File(f'{out_path}/sbelt-out.hdf5', 'r') as f:
+            return {iteration: storage.read_snapshot(f, iteration) 
+                        for iteration in storage.snapshot_iterations(f)}
+
+    def test_all_layouts_store_the_same_snapshots(self):
+        for particle_layout in particles.LAYOUTS:
+            for storage_layout in ['v2', 'delta']:
+                with tempfile.TemporaryDirectory() as v1_path, \
+                        tempfile.TemporaryDirectory() as other_path:
+                    v1 = self.run_layout(v1_path, 'v1', particle_layout)
+                    other = self.run_layout(other_path, storage_layout, particle_layout)
+                self.assertEqual(sorted(v1), list(range(2, 20, 3)))
+                self.assertEqual(sorted(v1), sorted(other))
+                for iteration in v1:
+                    for v1_data, other_data in zip(v1[iteration], other[iteration]):
+                        self.assertIsNone(np.testing.assert_array_equal(v1_data, other_data))
+
+    def test_background_writer_stores_the_same_snapshots(self):
+        for storage_layout in storage.LAYOUTS:
+            with tempfile.TemporaryDirectory() as sync_path, \
+                    tempfile.TemporaryDirectory() as background_path:
+                sync = self.run_layout(sync_path, storage_layout, 'legacy')
+                background = self.run_layout(background_path, storage_layout, 'legacy', 
+                                                background_writer=True, writer_queue_size=2)
+            self.assertEqual(sorted(sync), sorted(background))
+            for iteration in sync:
+                for sync_data, background_data in zip(sync[iteration], background[iteration]):
+                    self.assertIsNone(np.testing.assert_array_equal(sync_data, background_data))
+
+    def test_storage_options_are_applied_and_recorded(self):
+        with tempfile.TemporaryDirectory() as out_path:
+            self.run_layout(out_path, 'v2', 'legacy', compression='lzf', shuffle=True,
+                                float_precision='float32', snapshot_chunk_bytes=1024,
+                                flux_chunk_size=8)
+            with h5py.File(f'{out_path}/sbelt-out.hdf5', 'r') as f:
+                self.assertEqual(f.attrs['compression'], 'lzf')
+                self.assertTrue(f.attrs['shuffle'])
+                self.assertEqual(f.attrs['float_precision'], 'float32')
+                model = f['snapshots/model']
+                self.assertEqual(model.compression, 'lzf')
+                self.assertTrue(model.shuffle)
+                self.assertEqual(model.dtype, np.float32)
+                self.assertEqual(model.chunks[0], 1024 // (model.shape[1] * 7 * 4))
+                flux = f['final_metrics/subregions/subregion-0-flux']
+                self.assertEqual(flux.chunks, (8,))
+                self.assertEqual(flux.compression, 'lzf')
+                self.assertEqual(f['final_metrics/avg_age'].dtype, np.float32)
+
+    def test_uncompressed_output_matches_gzip(self):
+        for storage_layout in storage.LAYOUTS:
+            with tempfile.TemporaryDirectory() as gzip_path, \
+                    tempfile.TemporaryDirectory() as none_path:
+                gzip = self.run_layout(gzip_path, storage_layout, 'compact')
+                none = self.run_layout(none_path, storage_layout, 'compact', compression='none')
+                with h5py.File(f'{none_path}/sbelt-out.hdf5', 'r') as f:
+                    self.assertIsNone(f['final_metrics/avg_age'].compression)
+            for iteration in gzip:
+                for gzip_data, none_data in zip(gzip[iteration], none[iteration]):
+                    self.assertIsNone(np.testing.assert_array_equal(gzip_data, none_data))
+
+    def test_read_model_particles_returns_legacy_arrays(self):
+        with tempfile.TemporaryDirectory() as legacy_path, \
+                tempfile.TemporaryDirectory() as compact_path:
+            self.run_layout(legacy_path, 'delta', 'legacy')
+            self.run_layout(compact_path, 'delta', 'compact')
+            with h5py.File(f'{legacy_path}/sbelt-out.hdf5', 'r') as legacy, \
+                    h5py.File(f'{compact_path}/sbelt-out.hdf5', 'r') as compact:
+                self.assertIsNone(np.testing.assert_array_equal(
+                                    storage.read_model_particles(legacy, 17),
+                                    storage.read_model_particles(compact, 17)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+"""
+A module for unit tests of the streams module
+"""
+
+import unittest
+import numpy as np
+
+from ..sbelt import streams
+
+
+class TestRandomStreams(unittest.TestCase):
+
+    def test_event_counts_do_not_depend_on_block_size(self):
+        small_blocks = streams.RandomStreams(4, 5, 0, 0.25, block_size=3)
+        large_blocks = streams.RandomStreams(4, 5, 0, 0.25, block_size=1000)
+        small_counts = [small_blocks.event_count() for _ in range(20)]
+        large_counts = [large_blocks.event_count() for _ in range(20)]
+        self.assertEqual(small_counts, large_counts)
+        for count in small_counts:
+            self.assertIsInstance(count, int)
+
+    def test_hops_do_not_depend_on_pool_size(self):
+        small_pool = streams.RandomStreams(4, 5, 0, 0.25, block_size=4)
+        large_pool = streams.RandomStreams(4, 5, 0, 0.25, block_size=1000)
+        small_hops = np.concatenate([small_pool.hops(k) for k in [3, 0, 7, 1, 9]])
+        large_hops = np.concatenate([large_pool.hops(k) for k in [10, 10]])
+        self.assertIsNone(np.testing.assert_array_equal(small_hops, large_hops))
+
+    def test_hops_are_rounded(self):
+        random_streams = streams.RandomStreams(1, 5, 1, 0.25, normal=True)
+        hops = random_streams.hops(50)
+        self.assertEqual(len(hops), 50)
+        self.assertIsNone(np.testing.assert_array_equal(hops, np.round(hops, 1)))
+
+    def test_streams_are_independent(self):
+        """Drawing hops should not change the event counts."""
+        first = streams.RandomStreams(2, 5, 0, 0.25, block_size=8)
+        second = streams.RandomStreams(2, 5, 0, 0.25, block_size=8)
+        first_counts = []
+        for _ in range(20):
+            first_counts.append(first.event_count())
+            first.hops(first_counts[-1])
+        second_counts = [second.event_count() for _ in range(20)]
+        self.assertEqual(first_counts, second_counts)
+
+
+if __name__ == '__main__':
+    unittest.main()
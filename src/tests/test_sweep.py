@@ -0,0 +1,142 @@
+"""
+A module for unit tests of the sweep module
+"""
+
+import unittest
+import json
+import os
+import tempfile
+import sqlite3
+from unittest import mock
+import h5py
+
+from ..sbelt import sweep
+
+SMALL_RUN = {'iterations': 5, 'bed_length': 10, 'num_subregions': 2}
+
+
+class TestDesigns(unittest.TestCase):
+
+    def test_grid_design_has_every_combination(self):
+        design = sweep.grid_design({'poiss_lambda': [3, 5], 'level_limit': [2, 3, 4]})
+        self.assertEqual(len(design), 6)
+        self.assertIn({'poiss_lambda': 5, 'level_limit': 3}, design)
+
+    def test_latin_hypercube_samples_every_stratum_once(self):
+        design = sweep.latin_hypercube_design({'gauss_mu': (0.0, 2.0), 'level_limit': (1, 8)}, 
+                                                8, seed=1)
+        self.assertEqual(len(design), 8)
+        strata = sorted(int(parameters['gauss_mu'] / 0.25) for parameters in design)
+        self.assertEqual(strata, list(range(8)))
+        self.assertEqual(sorted(parameters['level_limit'] for parameters in design), 
+                            list(range(1, 9)))
+
+    def test_spec_without_design_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            sweep.design_from_spec({'base': SMALL_RUN})
+
+    def test_estimated_cost_uses_run_defaults(self):
+        self.assertEqual(sweep.estimated_cost({'iterations': 10}), 100 * 10 * 5)
+
+
+class TestSweepQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.queue_path = os.path.join(self.tmp_dir.name, 'queue.sqlite')
+        self.queue = sweep.SweepQueue(self.queue_path, max_attempts=2)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_adding_design_again_adds_no_jobs(self):
+        design = sweep.grid_design({'poiss_lambda': [3, 5]})
+        self.assertEqual(self.queue.add_jobs(design, SMALL_RUN, replicas=2), 4)
+        self.assertEqual(self.queue.add_jobs(design, SMALL_RUN, replicas=2), 0)
+        self.assertEqual(self.queue.status(), {'pending': 4})
+        self.assertEqual(self.queue.add_jobs(design, SMALL_RUN, replicas=3), 2)
+
+    def test_jobs_are_claimed_by_decreasing_cost(self):
+        self.queue.add_jobs(sweep.grid_design({'poiss_lambda': [3, 7, 5]}), SMALL_RUN)
+        claimed = [self.queue.claim('w', 60)['parameters']['poiss_lambda'] for _ in range(3)]
+        self.assertEqual(claimed, [7, 5, 3])
+        self.assertIsNone(self.queue.claim('w', 60))
+
+    def test_expired_lease_is_claimed_again(self):
+        self.queue.add_jobs([SMALL_RUN])
+        job = self.queue.claim('lost-worker', -1)
+        self.assertEqual(self.queue.claim('worker', 60)['id'], job['id'])
+        # The lost worker can no longer renew or finish the job
+        self.assertFalse(self.queue.renew(job['id'], 'lost-worker', 60))
+        self.assertFalse(self.queue.finish(job['id'], 'lost-worker', 
+                                            {'status': 'ok', 'output': None, 
+                                                'wall_time': 0, 'error': None}))
+        self.assertEqual(self.queue.status(), {'running': 1})
+
+    def test_expired_lease_on_last_attempt_fails_the_job(self):
+        self.queue.add_jobs([SMALL_RUN])
+        for worker in ['first', 'second']:
+            self.assertEqual(self.queue.claim(worker, -1)['attempt'], 
+                                1 if worker == 'first' else 2)
+        self.assertIsNone(self.queue.claim('worker', 60))
+        self.assertEqual(self.queue.status(), {'failed': 1})
+        with sqlite3.connect(self.queue_path) as connection:
+            error, = connection.execute('SELECT error FROM jobs').fetchone()
+        self.assertEqual(error, sweep.LEASE_EXPIRED)
+
+    def test_failed_job_is_retried_until_max_attempts(self):
+        self.queue.add_jobs([SMALL_RUN])
+        failure = {'status': 'failed', 'output': None, 'wall_time': 0, 'error': 'boom'}
+        for _ in range(2):
+            job = self.queue.claim('worker', 60)
+            self.queue.finish(job['id'], 'worker', failure)
+        self.assertIsNone(self.queue.claim('worker', 60))
+        self.assertEqual(self.queue.status(), {'failed': 1})
+
+    def test_worker_runs_jobs_and_restart_skips_completed(self):
+        out_path = os.path.join(self.tmp_dir.name, 'out')
+        self.queue.add_jobs(sweep.grid_design({'poiss_lambda': [3, 5]}), SMALL_RUN)
+        self.queue.add_jobs([dict(SMALL_RUN, level_limit=-1)])
+        self.assertEqual(sweep.run_worker(self.queue_path, out_path, max_attempts=2), 4)
+        self.assertEqual(self.queue.status(), {'done': 2, 'failed': 1})
+        self.assertEqual(sweep.run_worker(self.queue_path, out_path, max_attempts=2), 0)
+        with h5py.File(os.path.join(out_path, 'job-000001.hdf5'), 'r') as f:
+            self.assertEqual(f['params/poiss_lambda'][()], 3)
+
+    def test_worker_which_lost_its_lease_keeps_no_output(self):
+        out_path = os.path.join(self.tmp_dir.name, 'out')
+        self.queue.add_jobs([SMALL_RUN])
+        run_member = sweep.ensemble.run_member
+        def lose_lease(*args):
+            result = run_member(*args)
+            # The lease expires and another worker claims the job while it finishes
+            with sqlite3.connect(self.queue_path) as connection:
+                connection.execute('UPDATE jobs SET lease_expires = 0')
+            self.queue.claim('other-worker', 60)
+            return result
+        with mock.patch.object(sweep.ensemble, 'run_member', side_effect=lose_lease):
+            sweep.run_worker(self.queue_path, out_path, max_attempts=2)
+        self.assertEqual(self.queue.status(), {'running': 1})
+        self.assertEqual(os.listdir(out_path), [])
+
+        # The other worker is preempted, leaving a partial output behind
+        open(os.path.join(out_path, 'job-000001-attempt-2.hdf5'), 'w').close()
+        with sqlite3.connect(self.queue_path) as connection:
+            connection.execute('UPDATE jobs SET lease_expires = 0')
+        self.assertEqual(sweep.run_worker(self.queue_path, out_path, max_attempts=3), 1)
+        self.assertEqual(self.queue.status(), {'done': 1})
+        self.assertEqual(os.listdir(out_path), ['job-000001.hdf5'])
+
+    def test_command_line(self):
+        design_file = os.path.join(self.tmp_dir.name, 'design.json')
+        with open(design_file, 'w') as f:
+            json.dump({'grid': {'poiss_lambda': [3, 5]}, 'base': SMALL_RUN}, f)
+        out_path = os.path.join(self.tmp_dir.name, 'out')
+        self.assertEqual(sweep.main(['add', self.queue_path, design_file]), 0)
+        self.assertEqual(sweep.main(['work', self.queue_path, '--out-path', out_path,
+                                        '--workers', '2']), 0)
+        self.assertEqual(self.queue.status(), {'done': 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
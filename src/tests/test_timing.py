@@ -0,0 +1,138 @@
+"""
+A module for unit tests of the timing module
+"""
+
+import unittest
+import os
+import tempfile
+from unittest import mock
+import numpy as np
+import h5py
+
+from ..sbelt import numba_engine
+from ..sbelt import sbelt_runner
+from ..sbelt import timing
+
+
+class TestPhaseTimer(unittest.TestCase):
+
+    def time_iterations(self, timer, seconds):
+        """Record each of seconds as the time of phase 'a' in its own iteration"""
+        for iteration, value in enumerate(seconds):
+            timer.start(iteration)
+            timer.lap('a')
+            timer._current[0] = value
+            timer.finish()
+
+    def test_summary_of_known_times(self):
+        timer = timing.PhaseTimer(['a', 'b'], 100)
+        seconds = np.linspace(1e-3, 1e-2, 100)
+        self.time_iterations(timer, seconds)
+        summary = timer.summary()
+        self.assertEqual(list(summary['calls']), [100, 0])
+        self.assertAlmostEqual(summary['total'][0], seconds.sum())
+        self.assertAlmostEqual(summary['mean'][0], seconds.mean())
+        self.assertEqual(summary['max'][0], seconds.max())
+        self.assertTrue(np.isnan(summary['mean'][1]))
+        # Percentiles are exact to within a histogram bin
+        for q in timing.PERCENTILES:
+            self.assertLess(abs(np.log10(summary[f'p{q}'][0] / np.percentile(seconds, q))), 0.1)
+        self.assertLessEqual(summary['p99'][0], seconds.max())
+
+    def test_kernel_calls_are_spread_over_their_iterations(self):
+        timer = timing.PhaseTimer(['kernel', 'checkpoint'], 10, per_iteration=True)
+        timer.start(0)
+        timer.lap('kernel')
+        timer._current[0] = 0.4
+        timer.finish(4)
+        timer.timed('checkpoint', lambda: None)
+        self.assertEqual(timer.calls[0], 4)
+        self.assertAlmostEqual(timer.totals[0], 0.4)
+        self.assertIsNone(np.testing.assert_allclose(timer.per_iteration[:4, 0], 0.1))
+        self.assertTrue(np.isnan(timer.per_iteration[4:]).all())
+        # Checkpoints are added to the last iteration of the call
+        self.assertEqual(list(np.isnan(timer.per_iteration[:4, 1])), [True] * 3 + [False])
+
+    def test_state_round_trip(self):
+        timer = timing.PhaseTimer(['a'], 20, per_iteration=True)
+        self.time_iterations(timer, [1e-3] * 10)
+        copy = timing.PhaseTimer(['a'], 20, per_iteration=True)
+        copy.set_state(timer.get_state())
+        for value in (timer, copy):
+            value.start(10)
+            value.lap('a')
+            value._current[0] = 2e-3
+            value.finish()
+        for key, value in timer.get_state().items():
+            self.assertIsNone(np.testing.assert_array_equal(value, copy.get_state()[key]), key)
+
+    def test_timing_off_uses_null_timer(self):
+        self.assertIs(timing.phase_timer('off', 'lattice', 10), timing.NULL_TIMER)
+        self.assertFalse(timing.NULL_TIMER)
+        self.assertEqual(timing.NULL_TIMER.timed('checkpoint', max, 1, 2), 2)
+        self.assertEqual(timing.phase_timer('summary', 'numba', 10).phases, timing.NUMBA_PHASES)
+
+
+class TestTimedRun(unittest.TestCase):
+
+    kwargs = {'iterations': 50, 'bed_length': 20, 'num_subregions': 2, 'data_save_interval': 3,
+                'checkpoint_interval': 10, 'seed': 2}
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.out_path = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def read_timing(self):
+        with h5py.File(os.path.join(self.out_path, 'sbelt-out.hdf5'), 'r') as f:
+            grp = f['final_metrics/timing']
+            return {name: grp[name][()] for name in grp}
+
+    def test_summary_is_written(self):
+        sbelt_runner.run(out_path=self.out_path, timing='summary', **self.kwargs)
+        result = self.read_timing()
+        phases = [phase.decode() for phase in result['phases']]
+        self.assertEqual(phases, timing.PHASES)
+        self.assertNotIn('iterations', result)
+        calls = dict(zip(phases, result['calls']))
+        self.assertEqual(calls['event_selection'], 50)
+        self.assertEqual(calls['snapshot'], 16)
+        self.assertEqual(calls['checkpoint'], 4)
+        self.assertTrue((result['counts'].sum(axis=1) == result['calls']).all())
+
+    def test_untimed_run_writes_no_timing(self):
+        sbelt_runner.run(out_path=self.out_path, **self.kwargs)
+        with h5py.File(os.path.join(self.out_path, 'sbelt-out.hdf5'), 'r') as f:
+            self.assertNotIn('timing', f['final_metrics'])
+
+    @unittest.skipUnless(numba_engine.NUMBA_AVAILABLE, 'Numba is not installed')
+    def test_full_numba_timing_covers_every_iteration(self):
+        sbelt_runner.run(out_path=self.out_path, timing='full', engine='numba', **self.kwargs)
+        result = self.read_timing()
+        self.assertEqual([phase.decode() for phase in result['phases']], timing.NUMBA_PHASES)
+        self.assertEqual(result['iterations'].shape, (50, len(timing.NUMBA_PHASES)))
+        self.assertFalse(np.isnan(result['iterations'][:, 0]).any())
+
+    def test_resumed_run_keeps_timing_of_checkpointed_iterations(self):
+        write_snapshot = sbelt_runner.write_snapshot
+        def crash_at_35(f, iteration, *args):
+            if iteration >= 35:
+                raise RuntimeError('Node preempted')
+            write_snapshot(f, iteration, *args)
+        with mock.patch.object(sbelt_runner, 'write_snapshot', side_effect=crash_at_35):
+            with self.assertRaises(RuntimeError):
+                sbelt_runner.run(out_path=self.out_path, timing='full', **self.kwargs)
+        sbelt_runner.resume(out_path=self.out_path)
+        result = self.read_timing()
+        self.assertEqual(result['calls'][timing.PHASES.index('event_selection')], 50)
+        self.assertFalse(np.isnan(result['iterations'][:, 0]).any())
+
+    def test_invalid_timing_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            sbelt_runner.run(out_path=self.out_path, timing='detailed', **self.kwargs)
+
+
+if __name__ == '__main__':
+    unittest.main()